@@ -43,6 +43,7 @@ from xlgui.guiutil import idle_add, GtkTemplate
 from xlgui.accelerators import Accelerator
 from xlgui.widgets import menu, dialogs
 
+import bpmbatch
 import bpmdetect
 autodetect_enabled = bpmdetect.autodetect_supported()
 
@@ -58,9 +59,11 @@ class BPMCounterPlugin(object):
     # Provider API requirement
     name = 'BPM'
     menuitem = None
+    tools_menuitem = None
+    batch_thread = None
     
     def enable(self, exaile):
-        pass
+        self.exaile = exaile
     
     def on_gui_loaded(self):
         providers.register('mainwindow-info-area-widget', self)
@@ -72,6 +75,11 @@ class BPMCounterPlugin(object):
             
             for p in menu_providers:
                 providers.register(p, self.menuitem)
+            
+            self.tools_menuitem = menu.simple_menu_item('_bpm',
+                ['plugin-sep'], _('Autodetect BPM of Collection'),
+                callback=self.on_collection_menuitem)
+            providers.register('menubar-tools-menu', self.tools_menuitem)
     
     def disable(self, exaile):
         """
@@ -83,6 +91,12 @@ class BPMCounterPlugin(object):
             for p in menu_providers:
                 providers.unregister(p, self.menuitem)
         
+        if self.tools_menuitem is not None:
+            providers.unregister('menubar-tools-menu', self.tools_menuitem)
+        
+        if self.batch_thread is not None:
+            self.batch_thread.stop()
+        
     def create_widget(self, info_area):
         """
             mainwindow-info-area-widget provider API method
@@ -91,8 +105,28 @@ class BPMCounterPlugin(object):
 
     def on_auto_menuitem(self, menu, display_name, playlist_view, context):
         tracks = context['selected-tracks']
-        if len(tracks) > 0:
+        if len(tracks) == 1:
             self.autodetect_bpm(tracks[0], playlist_view.get_toplevel())
+        elif len(tracks) > 1:
+            self.autodetect_bpm_batch(tracks)
+    
+    def on_collection_menuitem(self, widget, name, parent, context):
+        self.autodetect_bpm_batch(bpmbatch.get_missing(self.exaile.collection))
+    
+    def autodetect_bpm_batch(self, tracks):
+        '''Detects and sets the BPM of tracks in the background'''
+        
+        if not tracks or self.batch_thread is not None:
+            return
+        
+        def _on_done(thread):
+            self.batch_thread = None
+        
+        self.batch_thread = bpmbatch.BPMDetectThread(tracks,
+            self.exaile.collection)
+        self.batch_thread.connect('done', _on_done)
+        self.exaile.gui.progress_manager.add_monitor(self.batch_thread,
+            _('Detecting BPM...'), Gtk.STOCK_EXECUTE)
             
     def autodetect_bpm(self, track, parent_window=None):
         
@@ -0,0 +1,167 @@
+# Copyright (C) 2011 Dustin Spicuzza
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+'''
+    Detects the BPM of many tracks in parallel pipelines
+'''
+
+import logging
+import multiprocessing
+import Queue
+import threading
+
+from gi.repository import GLib
+
+from xl import settings
+from xl.common import ProgressThread
+
+from bpmdetect import BPMDetector, BPMDetectError
+
+logger = logging.getLogger(__name__)
+
+# Number of results that are stored at once
+BATCH_SIZE = 50
+
+
+def get_job_count():
+    '''Returns the number of pipelines to run at the same time'''
+    try:
+        default = multiprocessing.cpu_count()
+    except NotImplementedError:
+        default = 1
+    return max(1, int(settings.get_option('plugin/bpm/jobs', default)))
+
+
+def get_missing(tracks):
+    '''Returns the local tracks without a BPM'''
+    return [track for track in tracks
+            if track.is_local() and not track.get_tag_raw('bpm')]
+
+
+class BPMDetectThread(ProgressThread):
+    '''
+        Detects the BPM of tracks with a number of worker threads,
+        each running its own pipeline.
+        
+        Results are stored to the 'bpm' tag in batches: the tags are
+        written to the files, and the collection is saved once per
+        batch.
+    '''
+    
+    def __init__(self, tracks, collection=None, job_count=None):
+        ProgressThread.__init__(self)
+        self.tracks = tracks
+        self.collection = collection
+        self.job_count = job_count or get_job_count()
+        self.do_stop = False
+        self.detected = 0
+        self.failed = 0
+        
+        self._queue = Queue.Queue()
+        self._results = Queue.Queue()
+    
+    def stop(self):
+        self.do_stop = True
+        ProgressThread.stop(self)
+    
+    def _stopped(self):
+        return self.do_stop
+    
+    def run(self):
+        for track in self.tracks:
+            self._queue.put(track)
+        
+        workers = []
+        for i in range(min(self.job_count, len(self.tracks))):
+            worker = threading.Thread(target=self._work,
+                                      name='BPMDetect-%d' % i)
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        
+        total = float(len(self.tracks))
+        done = 0
+        batch = []
+        while done < total and not self.do_stop:
+            try:
+                track, bpm = self._results.get(timeout=0.5)
+            except Queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    break
+                continue
+            
+            done += 1
+            if bpm is not None:
+                batch.append((track, bpm))
+            else:
+                self.failed += 1
+            if len(batch) >= BATCH_SIZE:
+                self._store(batch)
+                batch = []
+            GLib.idle_add(self.emit, 'progress-update', int(done / total * 100))
+        
+        # keep what has been detected, even when stopped
+        self._store(batch)
+        logger.info('Detected the BPM of %d tracks, %d failed',
+                    self.detected, self.failed)
+        if not self.do_stop:
+            GLib.idle_add(self.emit, 'done')
+    
+    def _work(self):
+        try:
+            detector = BPMDetector()
+        except BPMDetectError as e:
+            logger.warning('%s', e)
+            return
+        
+        while not self.do_stop:
+            try:
+                track = self._queue.get_nowait()
+            except Queue.Empty:
+                return
+            
+            try:
+                bpm = detector.detect(track.get_loc_for_io(), self._stopped)
+            except BPMDetectError as e:
+                if self.do_stop:
+                    return
+                logger.warning('Could not detect the BPM of %s: %s',
+                               track.get_loc_for_io(), e)
+                bpm = None
+            self._results.put((track, bpm))
+    
+    def _store(self, batch):
+        for track, bpm in batch:
+            track.set_tag_raw('bpm', int(round(bpm)))
+            if track.write_tags():
+                self.detected += 1
+            else:
+                self.failed += 1
+                logger.warning('Error writing BPM to %s',
+                               track.get_loc_for_io())
+        
+        if batch and self.collection is not None:
+            self.collection.save_to_location()
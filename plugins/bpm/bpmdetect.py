@@ -102,6 +102,97 @@ def detect_bpm(uri, on_complete):
     playbin.set_state(Gst.State.PLAYING)
 
 
+class BPMDetectError(Exception):
+    pass
+
+
+class BPMDetector(object):
+    '''
+        Detects the BPM of songs one after another, without a main loop.
+        
+        Unlike :func:`detect_bpm`, the pipeline is reused and not
+        synchronized to a clock, so songs are decoded as fast as
+        possible. Each detector can be used from its own thread.
+    '''
+    
+    def __init__(self):
+        self.pipe = Gst.Pipeline()
+        self.decoder = Gst.ElementFactory.make('uridecodebin', None)
+        self.convert = Gst.ElementFactory.make('audioconvert', None)
+        
+        # see detect_bpm for why there is only one channel
+        cf = Gst.ElementFactory.make('capsfilter', None)
+        cf.props.caps = Gst.Caps.from_string('audio/x-raw,channels=1')
+        
+        self.bpmdetect = Gst.ElementFactory.make('bpmdetect', None)
+        if self.bpmdetect is None:
+            raise BPMDetectError("GStreamer BPM detection plugin not found")
+        
+        fakesink = Gst.ElementFactory.make('fakesink', None)
+        fakesink.props.sync = False
+        fakesink.props.signal_handoffs = False
+        
+        for elem in (self.decoder, self.convert, cf, self.bpmdetect, fakesink):
+            self.pipe.add(elem)
+        
+        self.convert.link(cf)
+        cf.link(self.bpmdetect)
+        self.bpmdetect.link(fakesink)
+        
+        self.decoder.connect('pad-added', self._on_pad_added)
+        self.bus = self.pipe.get_bus()
+    
+    def _on_pad_added(self, decoder, pad):
+        sinkpad = self.convert.get_static_pad('sink')
+        if not sinkpad.is_linked() and \
+                pad.query_caps(None).to_string().startswith('audio/'):
+            pad.link(sinkpad)
+    
+    def detect(self, uri, stopped=None):
+        '''
+            Returns the BPM of a song, or None if no BPM was detected
+            
+            :param stopped: a function returning True if detection
+                            should be aborted
+            :raises BPMDetectError: if the song could not be processed
+        '''
+        bpm = None
+        types = Gst.MessageType.EOS | Gst.MessageType.ERROR | \
+                Gst.MessageType.TAG
+        
+        self.decoder.props.uri = uri
+        self.pipe.set_state(Gst.State.PLAYING)
+        try:
+            while True:
+                if stopped is not None and stopped():
+                    raise BPMDetectError("Detection stopped")
+                
+                msg = self.bus.timed_pop_filtered(100 * Gst.MSECOND, types)
+                if msg is None:
+                    continue
+                
+                if msg.type == Gst.MessageType.TAG:
+                    # bpmdetect sends its result downstream, so the sink
+                    # posts it. Discard tags already set on the file
+                    tags = msg.parse_tag()
+                    if tags.n_tags() > 1:
+                        continue
+                    found, v = tags.get_double('beats-per-minute')
+                    if found and v > 0:
+                        bpm = v
+                
+                elif msg.type == Gst.MessageType.ERROR:
+                    gerror, debug_info = msg.parse_error()
+                    if gerror:
+                        raise BPMDetectError(gerror.message.rstrip("."))
+                    raise BPMDetectError(debug_info)
+                
+                elif msg.type == Gst.MessageType.EOS:
+                    return bpm
+        finally:
+            self.pipe.set_state(Gst.State.NULL)
+
+
 
 if __name__ == '__main__':
 
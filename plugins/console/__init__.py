@@ -27,6 +27,7 @@ from gi.repository import Gdk
 
 import os, sys, traceback
 from cStringIO import StringIO
+from xl import common
 from xl.nls import gettext as _
 
 class PyConsole():
@@ -94,7 +95,9 @@ def enable(exaile):
 
 def _enable(eventname, exaile, eventdata):
     global PLUGIN
-    PLUGIN = PyConsole({'exaile': exaile}, exaile)
+    # cache_stats() prints the statistics of the caches in xl.common
+    PLUGIN = PyConsole({'exaile': exaile,
+        'cache_stats': common.dump_cache_stats}, exaile)
     PLUGIN.window.set_transient_for(exaile.gui.main.window)
     PLUGIN.window.present()
 
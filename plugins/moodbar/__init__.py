@@ -22,24 +22,57 @@
 
 from __future__ import division, print_function
 
+import multiprocessing
 import os.path
 
 from gi.repository import (
     Gdk,
     GLib,
+    Gtk,
 )
 
 import xl.event
 from xl.nls import gettext as _
 import xl.player
+import xl.providers
+import xl.settings
 import xl.xdg
 import xlgui.guiutil
+from xlgui.widgets import menu
 
 from cache import ExaileMoodbarCache
 from generator import SpectrumMoodbarGenerator
 from painter import MoodbarPainter
+from pregenerator import (
+    MoodbarPregenerator,
+    PregenerationThread,
+    PRIORITY_NOW,
+    PRIORITY_UPCOMING,
+)
 from widget import Moodbar
 
+# Number of upcoming tracks whose moodbars are generated ahead
+UPCOMING_TRACKS = 5
+
+
+def get_upcoming(queue, count):
+    """Return the tracks that will probably be played next.
+
+    Only the order of the queue and the current playlist is looked at;
+    `queue.get_next` would fix the choice of the next track in shuffle
+    mode until it is played.
+
+    :type queue: xl.player.queue.PlayQueue
+    :type count: int
+    :rtype: List[xl.trax.Track]
+    """
+    tracks = list(queue[:count])
+    playlist = queue.current_playlist
+    if playlist is not queue:
+        position = playlist.current_position
+        tracks.extend(playlist[position + 1:position + 1 + count])
+    return tracks
+
 
 class MoodbarPlugin:
     def __init__(self):
@@ -52,6 +85,14 @@ class MoodbarPlugin:
         self.exaile = exaile
         self.cache = ExaileMoodbarCache(os.path.join(xl.xdg.get_cache_dir(), 'moods'))
         self.painter = MoodbarPainter()
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 1
+        workers = int(xl.settings.get_option('plugin/moodbar/jobs', workers))
+        self.pregenerator = MoodbarPregenerator(self.generator, self.cache, workers)
+        self.batches = []
+        self.menu_items = []
 
         xl.event.add_ui_callback(self._on_preview_device_enabled, 'preview_device_enabled')
         xl.event.add_ui_callback(self._on_preview_device_disabling, 'preview_device_disabling')
@@ -61,17 +102,57 @@ class MoodbarPlugin:
 
     def on_gui_loaded(self):
         self.main_controller = MoodbarController(self, xl.player.PLAYER, self.exaile.gui.main.progress_bar)
+        xl.event.add_ui_callback(self._on_playback_track_start, 'playback_track_start',
+            xl.player.PLAYER)
+
+        item = menu.simple_menu_item('moodbar', ['plugin-sep'],
+            _('Generate Moodbars for Collection'),
+            callback=lambda *args: self.pregenerate(self.exaile.collection))
+        self.menu_items.append(('menubar-tools-menu', item))
+        item = menu.simple_menu_item('moodbar', ['tab-close-sep'], _('Generate Moodbars'),
+            callback=lambda widget, name, page, context: self.pregenerate(page.playlist))
+        self.menu_items.append(('playlist-tab-context-menu', item))
+        for name, item in self.menu_items:
+            xl.providers.register(name, item)
 
     def disable(self, exaile):
         if not self.main_controller:  # Disabled more than once or before gui_loaded
             return
         xl.event.remove_callback(self._on_preview_device_enabled, 'preview_device_enabled')
         xl.event.remove_callback(self._on_preview_device_disabling, 'preview_device_disabling')
+        xl.event.remove_callback(self._on_playback_track_start, 'playback_track_start',
+            xl.player.PLAYER)
+        for name, item in self.menu_items:
+            xl.providers.unregister(name, item)
+        for batch in self.batches[:]:
+            batch.stop()
+        self.pregenerator.stop()
         self.main_controller.destroy()
         if self.preview_controller:
             self.preview_controller.destroy()
         self.main_controller = self.preview_controller = None
-        del self.exaile, self.cache, self.generator, self.painter
+        del self.exaile, self.cache, self.generator, self.painter, self.pregenerator
+
+    def pregenerate(self, tracks):
+        """Generate the moodbars of tracks in the background.
+
+        :type tracks: Iterable[xl.trax.Track]
+        """
+        batch = PregenerationThread(self.pregenerator,
+            [track.get_loc_for_io() for track in tracks])
+        batch.connect('done', self._on_batch_done)
+        self.batches.append(batch)
+        self.exaile.gui.progress_manager.add_monitor(batch,
+            _('Generating moodbars...'), Gtk.STOCK_EXECUTE)
+
+    def _on_batch_done(self, batch):
+        # Stopping a batch emits 'done' as well
+        if batch in self.batches:
+            self.batches.remove(batch)
+
+    def _on_playback_track_start(self, event, player, track):
+        for track in get_upcoming(xl.player.QUEUE, UPCOMING_TRACKS):
+            self.pregenerator.request(track.get_loc_for_io(), PRIORITY_UPCOMING)
 
     # Preview Device events
 
@@ -129,12 +210,10 @@ class MoodbarController:
         self.moodbar.set_mood(data)
         self._on_timer()
         self.timer = GLib.timeout_add_seconds(1, self._on_timer)
-        if not data and uri.startswith('file://'):
+        if not data:
             def callback(uri, data):
-                if cache:
-                    cache.put(uri, data)
                 self.moodbar.set_mood(data)
-            self.plugin.generator.generate_async(uri, callback)
+            self.plugin.pregenerator.request(uri, PRIORITY_NOW, callback)
 
     def _on_timer(self):
         assert self.moodbar
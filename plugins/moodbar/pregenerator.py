@@ -0,0 +1,209 @@
+# moodbar - Replace Exaile's seekbar with a moodbar
+# Copyright (C) 2015  Johannes Sasongko <sasongko@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import division, print_function, unicode_literals
+
+import heapq
+import itertools
+import logging
+import threading
+
+from gi.repository import GLib
+
+from xl.common import ProgressThread
+
+from generator import MoodbarGeneratorError
+
+logger = logging.getLogger(__name__)
+
+# Request priorities, lower runs first
+PRIORITY_NOW = 0
+PRIORITY_UPCOMING = 1
+PRIORITY_BATCH = 2
+
+
+class _Job:
+    def __init__(self, uri, priority):
+        self.uri = uri
+        self.priority = priority
+        self.callbacks = []
+        self.wanted = False
+        self.started = False
+
+
+class MoodbarPregenerator:
+    """Generate moodbars into a cache with a bounded number of workers.
+
+    Each worker runs one generator subprocess at a time. Requests are
+    served by priority, so the moodbar of the playing track and those
+    of the upcoming tracks are generated before the ones of a batch.
+    """
+
+    def __init__(self, generator, cache, workers=2):
+        """
+        :type generator: generator.MoodbarGenerator
+        :type cache: cache.MoodbarCache
+        :param workers: Maximum number of concurrent generators
+        :type workers: int
+        """
+        self.generator = generator
+        self.cache = cache
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._heap = []
+        self._jobs = {}  # uri -> _Job, for pending and running jobs
+        self._counter = itertools.count()
+        self._threads = []
+        self._stopped = False
+
+    def request(self, uri, priority=PRIORITY_BATCH, callback=None):
+        """Request the moodbar of a track.
+
+        Cached moodbars are not generated again. Requesting a uri that is
+        already pending with a higher priority value moves it forward.
+
+        :type uri: bytes
+        :type priority: int
+        :param callback: Called from a worker thread when generation
+            finishes, with the uri and the data (None on failure)
+        :type callback: Optional[Callable[[bytes, Optional[bytes]], None]]
+        :return: Whether generation was scheduled
+        :rtype: bool
+        """
+        if not uri.startswith(b'file://') or self.cache.has(uri):
+            return False
+        with self._lock:
+            if self._stopped:
+                return False
+            job = self._jobs.get(uri)
+            if job is None:
+                job = self._jobs[uri] = _Job(uri, priority)
+            elif priority < job.priority and not job.started:
+                job.priority = priority
+            else:
+                priority = None
+            if callback is None:
+                job.wanted = True
+            else:
+                job.callbacks.append(callback)
+            if priority is not None:
+                # Stale heap entries are skipped when they are popped
+                heapq.heappush(self._heap, (priority, next(self._counter), job))
+                self._start_worker()
+        return True
+
+    def cancel(self, callback):
+        """Cancel pending requests made with a callback.
+
+        Jobs that are not wanted by any other request are dropped.
+        """
+        with self._lock:
+            for job in self._jobs.itervalues():
+                job.callbacks = [c for c in job.callbacks if c is not callback]
+
+    def stop(self):
+        """Drop all pending requests and let the workers exit."""
+        with self._lock:
+            self._stopped = True
+            del self._heap[:]
+
+    def _start_worker(self):
+        # Called with the lock held
+        if len(self._threads) < min(self.workers, len(self._heap)):
+            t = threading.Thread(name=self.__class__.__name__, target=self._work)
+            t.daemon = True
+            self._threads.append(t)
+            t.start()
+
+    def _next_job(self):
+        with self._lock:
+            while True:
+                if self._stopped or not self._heap:
+                    # The worker exits; request() starts a new one
+                    self._threads.remove(threading.current_thread())
+                    return None
+                priority, _, job = heapq.heappop(self._heap)
+                if job.started or job.priority != priority or \
+                        self._jobs.get(job.uri) is not job:
+                    continue  # Stale entry
+                if job.wanted or job.callbacks:
+                    job.started = True
+                    return job
+                del self._jobs[job.uri]
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                data = self.generator.generate(job.uri)
+            except MoodbarGeneratorError as e:
+                logger.warning("Failed to generate moodbar for %s: %s", job.uri, e)
+                data = None
+            if data:
+                self.cache.put(job.uri, data)
+            with self._lock:
+                del self._jobs[job.uri]
+                callbacks = job.callbacks
+            for callback in callbacks:
+                callback(job.uri, data)
+
+
+class PregenerationThread(ProgressThread):
+    """Generate the moodbars of many tracks, reporting progress."""
+
+    def __init__(self, pregenerator, uris):
+        """
+        :type pregenerator: MoodbarPregenerator
+        :type uris: Iterable[bytes]
+        """
+        ProgressThread.__init__(self)
+        self.pregenerator = pregenerator
+        self.uris = list(uris)
+        self.done = threading.Event()
+        self.count = 0
+        self.total = len(self.uris)
+        self.lock = threading.Lock()
+
+    def stop(self):
+        self.pregenerator.cancel(self._on_generated)
+        self.done.set()
+        ProgressThread.stop(self)
+
+    def _on_generated(self, uri, data):
+        with self.lock:
+            self.count += 1
+            GLib.idle_add(self.emit, 'progress-update',
+                int(self.count / self.total * 100))
+            if self.count == self.total:
+                self.done.set()
+
+    def run(self):
+        for uri in self.uris:
+            if self.done.is_set():
+                return
+            if not self.pregenerator.request(uri, PRIORITY_BATCH, self._on_generated):
+                # Cached or not a local file
+                self._on_generated(uri, None)
+        if self.total:
+            self.done.wait()
+        if self.count == self.total:
+            GLib.idle_add(self.emit, 'done')
+
+
+# vi: et sts=4 sw=4 tw=99
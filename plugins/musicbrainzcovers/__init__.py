@@ -50,6 +50,8 @@ class MusicBrainzCoverSearch(covers.CoverSearchMethod):
     """
     name = 'musicbrainz'
     title = 'MusicBrainz'
+    # the MusicBrainz web service allows one request per second
+    min_interval = 1.0
     __caa_url ='http://coverartarchive.org/release/{mbid}/front-{size}'
     
     def __init__(self, exaile):
@@ -108,7 +108,7 @@ class ExaileNotifyOsd(object):
                 # this is for when the song has been stopped previously
                 self.icon = self.resumeicon
             elif self.show_covers:
-                cover_data = covers.MANAGER.get_cover(track,
+                cover_data = covers.MANAGER.get_cover_thumbnail(track, 100,
                     set_only=True, use_default=True)
                 self.icon = icons.MANAGER.pixbuf_from_data(cover_data)
 
@@ -24,10 +24,15 @@
 # do so. If you do not wish to do so, delete this exception statement
 # from your version.
 
-from xl import providers, event, settings
+from xl import providers, event, player, settings
+from xl.nls import gettext as _
 from xl.player.gst.gst_utils import ElementBin
+from xlgui.widgets import menu
 
 from gi.repository import Gst
+from gi.repository import Gtk
+
+import analysis
 
 try:
     import replaygainprefs
@@ -38,17 +43,77 @@ except: # fail gracefully if we cant set up the UI
 
 NEEDED_ELEMS = ["rgvolume", "rglimiter"]
 
+MENU_PROVIDERS = ['track-panel-menu', 'playlist-context-menu']
+MENU_ITEMS = []
+TOOLS_ITEM = None
+EXAILE = None
+
 def enable(exaile):
+    global EXAILE
     for elem in NEEDED_ELEMS:
         if not Gst.ElementFactory.find(elem):
             raise ImportError("Needed gstreamer element %s missing." % elem)
     providers.register("gst_audio_filter", ReplaygainVolume)
     providers.register("gst_audio_filter", ReplaygainLimiter)
 
+    EXAILE = exaile
+    if all(Gst.ElementFactory.find(elem) for elem in analysis.NEEDED_ELEMS):
+        if exaile.loading:
+            event.add_callback(_enable_analysis, 'gui_loaded')
+        else:
+            _enable_analysis(None, exaile, None)
+
 def disable(exaile):
+    global TOOLS_ITEM
     providers.unregister("gst_audio_filter", ReplaygainVolume)
     providers.unregister("gst_audio_filter", ReplaygainLimiter)
 
+    event.remove_callback(_enable_analysis, 'gui_loaded')
+    for item in MENU_ITEMS:
+        for p in MENU_PROVIDERS:
+            providers.unregister(p, item)
+    del MENU_ITEMS[:]
+    if TOOLS_ITEM is not None:
+        providers.unregister('menubar-tools-menu', TOOLS_ITEM)
+        TOOLS_ITEM = None
+
+def _enable_analysis(eventname, exaile, nothing):
+    global TOOLS_ITEM
+    has_selection = lambda n, p, c: not c['selection-empty']
+    MENU_ITEMS.append(menu.simple_menu_item('replaygain-tracks',
+            ['properties'], _('Analyze ReplayGain of Tracks'),
+            callback=_on_analyze_tracks, condition_fn=has_selection))
+    MENU_ITEMS.append(menu.simple_menu_item('replaygain-albums',
+            ['replaygain-tracks'], _('Analyze ReplayGain of Albums'),
+            callback=_on_analyze_albums, condition_fn=has_selection))
+    for item in MENU_ITEMS:
+        for p in MENU_PROVIDERS:
+            providers.register(p, item)
+
+    TOOLS_ITEM = menu.simple_menu_item('replaygain-collection',
+            ['plugin-sep'], _('Analyze ReplayGain of Collection'),
+            callback=lambda *x: _start_analysis(
+                analysis.get_jobs(list(exaile.collection), albums=True)))
+    providers.register('menubar-tools-menu', TOOLS_ITEM)
+
+def _on_analyze_tracks(widget, name, parent, context):
+    _start_analysis(analysis.get_jobs(context['selected-tracks']))
+
+def _on_analyze_albums(widget, name, parent, context):
+    _start_analysis(analysis.get_jobs(context['selected-tracks'],
+            albums=True, collection=EXAILE.collection))
+
+def _start_analysis(jobs):
+    """
+        Runs the analysis jobs in the background, showing their
+        progress in the main window
+    """
+    if not jobs:
+        return
+    thread = analysis.AnalysisThread(jobs, collection=EXAILE.collection)
+    EXAILE.gui.progress_manager.add_monitor(thread,
+            _('Analyzing ReplayGain...'), Gtk.STOCK_EXECUTE)
+
 
 class ReplaygainVolume(ElementBin):
     """
@@ -68,6 +133,9 @@ class ReplaygainVolume(ElementBin):
         self.setup_elements()
 
         event.add_ui_callback(self._on_option_set, "replaygain_option_set")
+        event.add_ui_callback(self._on_playback_track_start,
+                "playback_track_start", player.PLAYER)
+        self.track = None
 
         # load settings
         for x in ("album-mode", "pre-amp", "fallback-gain"):
@@ -81,9 +149,30 @@ class ReplaygainVolume(ElementBin):
         elif data == "replaygain/pre-amp":
             self.rgvol.set_property("pre-amp",
                     settings.get_option("replaygain/pre-amp", 0))
-        elif data == "replaygain/fallback-gain":
-            self.rgvol.set_property("fallback-gain",
-                    settings.get_option("replaygain/fallback-gain", 0))
+        if data in ("replaygain/album-mode", "replaygain/pre-amp",
+                "replaygain/fallback-gain"):
+            self._set_fallback_gain()
+
+    def _on_playback_track_start(self, name, player, track):
+        self.track = track
+        self._set_fallback_gain()
+
+    def _set_fallback_gain(self):
+        """
+            rgvolume uses the fallback gain for streams without
+            ReplayGain tags, so the analyzed gain of the current track
+            is applied through it.
+        """
+        gain = None
+        if self.track is not None:
+            gain = analysis.get_stored_gain(self.track,
+                    settings.get_option("replaygain/album-mode", True))
+        if gain is None:
+            gain = settings.get_option("replaygain/fallback-gain", 0)
+        else:
+            # pre-amp is not applied to the fallback gain
+            gain += settings.get_option("replaygain/pre-amp", 0)
+        self.rgvol.set_property("fallback-gain", max(-60, min(60, gain)))
 
 
 class ReplaygainLimiter(ElementBin):
@@ -0,0 +1,375 @@
+# Copyright (C) 2009-2010 Aren Olson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+    Batch ReplayGain analysis of tracks and albums.
+
+    Results are stored in internal tags of the tracks, so that they are
+    saved with the collection and analyzed tracks are skipped when an
+    interrupted scan is started again.
+"""
+
+import itertools
+import logging
+import multiprocessing
+import Queue
+import threading
+import time
+
+from gi.repository import GLib
+from gi.repository import Gst
+
+from xl import settings
+from xl.common import ProgressThread
+
+logger = logging.getLogger(__name__)
+
+TRACK_GAIN = '__replaygain_track_gain'
+TRACK_PEAK = '__replaygain_track_peak'
+ALBUM_GAIN = '__replaygain_album_gain'
+ALBUM_PEAK = '__replaygain_album_peak'
+
+NEEDED_ELEMS = ['uridecodebin', 'audioconvert', 'audioresample',
+                'rganalysis', 'fakesink']
+
+# How often the collection is saved during a scan, in seconds
+SAVE_INTERVAL = 60
+
+
+def get_job_count():
+    """
+        Returns the number of pipelines that may run at the same time
+    """
+    try:
+        default = multiprocessing.cpu_count()
+    except NotImplementedError:
+        default = 1
+    return max(1, int(settings.get_option('replaygain/analysis-jobs',
+                                          default)))
+
+
+def get_stored_gain(track, album_mode=True):
+    """
+        Returns the analyzed gain of a track, or None if the track
+        has not been analyzed
+
+        :param album_mode: prefer the album gain if it is known
+    """
+    if album_mode:
+        gain = track.get_tag_raw(ALBUM_GAIN)
+        if gain is not None:
+            return gain
+    return track.get_tag_raw(TRACK_GAIN)
+
+
+def _get_album_key(track):
+    """
+        Tracks with the same album tag in the same directory are
+        considered to be an album
+    """
+    album = track.get_tag_raw('album', join=True)
+    if not album:
+        return None
+    return (album, track.get_loc_for_io().rsplit('/', 1)[0])
+
+
+def get_jobs(tracks, albums=False, collection=None):
+    """
+        Groups tracks into analysis jobs, skipping those that
+        already have been analyzed.
+
+        :param tracks: the tracks to analyze
+        :param albums: if True, the albums of the tracks are analyzed
+            as a whole and album gain is computed too
+        :param collection: where to find the other tracks of the albums
+        :returns: a list of (tracks, albums) tuples
+    """
+    if not albums:
+        return [([tr], False) for tr in tracks
+                if tr.get_tag_raw(TRACK_GAIN) is None]
+
+    groups = {}
+    singles = []
+    for tr in tracks:
+        key = _get_album_key(tr)
+        if key is None:
+            singles.append(tr)
+        else:
+            groups.setdefault(key, [])
+
+    sources = [tracks]
+    if collection is not None:
+        sources.append(collection)
+    seen = set()
+    for tr in itertools.chain(*sources):
+        key = _get_album_key(tr)
+        if key in groups and tr not in seen:
+            seen.add(tr)
+            groups[key].append(tr)
+
+    jobs = [([tr], False) for tr in singles
+            if tr.get_tag_raw(TRACK_GAIN) is None]
+    for key in sorted(groups):
+        album = groups[key]
+        if any(tr.get_tag_raw(ALBUM_GAIN) is None for tr in album):
+            album.sort(key=lambda tr: tr.get_loc_for_io())
+            jobs.append((album, True))
+    return jobs
+
+
+def store_results(tracks, results, album=None, write_tags=False):
+    """
+        Stores analysis results in the tracks
+
+        :param results: a (gain, peak) tuple for each track
+        :param album: a (gain, peak) tuple for the album, or None
+        :param write_tags: also write the values to the files
+    """
+    for tr, (gain, peak) in zip(tracks, results):
+        tr.set_tag_raw(TRACK_GAIN, gain)
+        tr.set_tag_raw(TRACK_PEAK, peak)
+        if album is not None:
+            tr.set_tag_raw(ALBUM_GAIN, album[0])
+            tr.set_tag_raw(ALBUM_PEAK, album[1])
+        if write_tags:
+            tr.set_tag_raw('replaygain_track_gain', u'%.2f dB' % gain)
+            tr.set_tag_raw('replaygain_track_peak', u'%.6f' % peak)
+            if album is not None:
+                tr.set_tag_raw('replaygain_album_gain', u'%.2f dB' % album[0])
+                tr.set_tag_raw('replaygain_album_peak', u'%.6f' % album[1])
+            if not tr.write_tags():
+                logger.warning('Could not write ReplayGain tags to %s',
+                               tr.get_loc_for_io())
+
+
+class AnalysisError(Exception):
+    pass
+
+
+class Analyzer(object):
+    """
+        A pipeline that analyzes tracks one after another.
+
+        The rganalysis element is kept in the PLAYING state between the
+        tracks of an album, so it can compute the album gain.
+    """
+    def __init__(self):
+        self.pipe = Gst.Pipeline()
+        self.decoder = Gst.ElementFactory.make('uridecodebin', None)
+        self.convert = Gst.ElementFactory.make('audioconvert', None)
+        self.resample = Gst.ElementFactory.make('audioresample', None)
+        self.analysis = Gst.ElementFactory.make('rganalysis', None)
+        sink = Gst.ElementFactory.make('fakesink', None)
+        sink.set_property('sync', False)
+
+        for elem in (self.decoder, self.convert, self.resample,
+                     self.analysis, sink):
+            self.pipe.add(elem)
+        self.convert.link(self.resample)
+        self.resample.link(self.analysis)
+        self.analysis.link(sink)
+        self.decoder.connect('pad-added', self._on_pad_added)
+
+        self.bus = self.pipe.get_bus()
+
+    def _on_pad_added(self, decoder, pad):
+        sinkpad = self.convert.get_static_pad('sink')
+        if not sinkpad.is_linked() and \
+                pad.query_caps(None).to_string().startswith('audio/'):
+            pad.link(sinkpad)
+
+    def analyze(self, uris, album=False, stopped=None):
+        """
+            Analyzes the given uris
+
+            :param album: compute the album gain of the uris as well
+            :param stopped: a function returning True if the analysis
+                should be aborted
+            :returns: a list of (gain, peak) tuples, one for each uri,
+                and a (gain, peak) tuple for the album or None
+            :raises AnalysisError: if a uri could not be analyzed
+        """
+        self.analysis.set_property('num-tracks', len(uris) if album else 0)
+        results = []
+        album_result = None
+        try:
+            for uri in uris:
+                self.pipe.set_state(Gst.State.NULL)
+                self.decoder.set_property('uri', uri)
+                self.pipe.set_state(Gst.State.PLAYING)
+                track, album_result = self._wait(uri, stopped)
+                results.append(track)
+                # keep the collected album data while the
+                # rest of the pipeline is reset
+                self.analysis.set_locked_state(True)
+        finally:
+            self.analysis.set_locked_state(False)
+            self.pipe.set_state(Gst.State.NULL)
+
+        if not album:
+            # album tags of the file, not computed
+            return results, None
+        if album_result is None:
+            raise AnalysisError('No album gain computed')
+        return results, album_result
+
+    def _wait(self, uri, stopped):
+        """
+            Waits for the analysis of the current uri to finish
+
+            rganalysis sends its results downstream in a tag event at the
+            end of each track, so they are posted by the sink. Tags of the
+            file come earlier, and the last values before EOS are used.
+        """
+        track = None
+        album = None
+        types = Gst.MessageType.EOS | Gst.MessageType.ERROR | \
+                Gst.MessageType.TAG
+        while True:
+            if stopped is not None and stopped():
+                raise AnalysisError('Analysis stopped')
+            message = self.bus.timed_pop_filtered(100 * Gst.MSECOND, types)
+            if message is None:
+                continue
+            if message.type == Gst.MessageType.ERROR:
+                error, debug = message.parse_error()
+                raise AnalysisError('%s: %s' % (uri, error.message))
+            elif message.type == Gst.MessageType.TAG:
+                tags = message.parse_tag()
+                values = _get_gain(tags, Gst.TAG_TRACK_GAIN,
+                                   Gst.TAG_TRACK_PEAK)
+                if values is not None:
+                    track = values
+                values = _get_gain(tags, Gst.TAG_ALBUM_GAIN,
+                                   Gst.TAG_ALBUM_PEAK)
+                if values is not None:
+                    album = values
+            elif message.type == Gst.MessageType.EOS:
+                if track is None:
+                    raise AnalysisError('%s: no track gain computed' % uri)
+                return track, album
+
+
+def _get_gain(tags, gain_tag, peak_tag):
+    """
+        Returns a (gain, peak) tuple from a tag list, or None
+    """
+    found_gain, gain = tags.get_double(gain_tag)
+    found_peak, peak = tags.get_double(peak_tag)
+    if found_gain and found_peak:
+        return (gain, peak)
+    return None
+
+
+class AnalysisThread(ProgressThread):
+    """
+        Runs analysis jobs in a number of parallel pipelines, and
+        stores the results in the tracks as each job completes.
+    """
+    def __init__(self, jobs, collection=None, job_count=None):
+        """
+            :param jobs: jobs as returned by :func:`get_jobs`
+            :param collection: a collection to save periodically, so that
+                results are kept when the scan is interrupted
+            :param job_count: the number of parallel pipelines, defaults to
+                the replaygain/analysis-jobs setting
+        """
+        ProgressThread.__init__(self)
+        self.jobs = jobs
+        self.collection = collection
+        self.job_count = job_count or get_job_count()
+        self.write_tags = settings.get_option(
+            'replaygain/analysis-write-tags', False)
+        self.do_stop = False
+        self.failed = 0
+
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._total = sum(len(tracks) for tracks, album in jobs)
+        self._done = 0
+        self._last_save = time.time()
+
+    def stop(self):
+        self.do_stop = True
+        ProgressThread.stop(self)
+
+    def _stopped(self):
+        return self.do_stop
+
+    def run(self):
+        for job in self.jobs:
+            self._queue.put(job)
+
+        workers = []
+        for i in range(min(self.job_count, len(self.jobs))):
+            worker = threading.Thread(target=self._work,
+                                      name='ReplayGainAnalysis-%d' % i)
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+
+        self._save()
+        logger.info('ReplayGain analysis of %d tracks finished, %d failed',
+                    self._done, self.failed)
+        if not self.do_stop:
+            GLib.idle_add(self.emit, 'done')
+
+    def _work(self):
+        analyzer = Analyzer()
+        while not self.do_stop:
+            try:
+                tracks, album = self._queue.get_nowait()
+            except Queue.Empty:
+                return
+
+            uris = [tr.get_loc_for_io() for tr in tracks]
+            try:
+                results, album_result = analyzer.analyze(uris, album,
+                                                         self._stopped)
+            except AnalysisError as e:
+                if self.do_stop:
+                    return
+                logger.warning('ReplayGain analysis failed: %s', e)
+                with self._lock:
+                    self.failed += len(tracks)
+            else:
+                store_results(tracks, results, album_result, self.write_tags)
+
+            with self._lock:
+                self._done += len(tracks)
+                progress = int(self._done * 100.0 / self._total)
+                save = time.time() - self._last_save > SAVE_INTERVAL
+                if save:
+                    self._last_save = time.time()
+            GLib.idle_add(self.emit, 'progress-update', progress)
+            if save:
+                self._save()
+
+    def _save(self):
+        if self.collection is not None:
+            self.collection.save_to_location()
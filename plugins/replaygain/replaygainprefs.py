@@ -29,6 +29,8 @@ from xlgui.preferences import widgets
 from xl import xdg
 from xl.nls import gettext as _
 
+import analysis
+
 name = _('ReplayGain')
 basedir = os.path.dirname(os.path.realpath(__file__))
 ui = os.path.join(basedir, "replaygainprefs_pane.ui")
@@ -49,4 +51,13 @@ class FallbackGainPreference(widgets.SpinPreference):
     default = 0
     name = 'replaygain/fallback-gain'
 
+class AnalysisJobsPreference(widgets.SpinPreference):
+    name = 'replaygain/analysis-jobs'
+
+    def __init__(self, preferences, widget):
+        self.default = analysis.get_job_count()
+        widgets.SpinPreference.__init__(self, preferences, widget)
 
+class AnalysisWriteTagsPreference(widgets.CheckPreference):
+    default = False
+    name = 'replaygain/analysis-write-tags'
@@ -0,0 +1,71 @@
+import array
+import math
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import wave
+
+from gi.repository import Gio
+from gi.repository import Gst
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                '..', '..', '..', 'plugins', 'bpm'))
+import bpmdetect
+
+Gst.init(None)
+HAVE_ELEMENTS = all(Gst.ElementFactory.find(elem) for elem in
+        ('uridecodebin', 'audioconvert', 'bpmdetect', 'fakesink'))
+
+RATE = 44100
+
+
+def write_clicks(path, bpm, seconds):
+    # a short burst of a sine tone on every beat
+    samples = array.array('h', [0] * (RATE * seconds))
+    beat = int(RATE * 60.0 / bpm)
+    for start in range(0, len(samples), beat):
+        for i in range(min(RATE // 100, len(samples) - start)):
+            samples[start + i] = int(20000 * math.sin(2 * math.pi * 1000 * i / RATE))
+    f = wave.open(path, 'wb')
+    f.setnchannels(1)
+    f.setsampwidth(2)
+    f.setframerate(RATE)
+    f.writeframes(samples.tostring())
+    f.close()
+
+
+@unittest.skipUnless(HAVE_ELEMENTS, "GStreamer bpmdetect is not available")
+class TestBPMDetector(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def uri(self, name):
+        return Gio.File.new_for_path(os.path.join(self.tempdir, name)).get_uri()
+
+    def test_detect(self):
+        write_clicks(os.path.join(self.tempdir, 'clicks.wav'), 120, 20)
+        detector = bpmdetect.BPMDetector()
+        bpm = detector.detect(self.uri('clicks.wav'))
+        self.assertTrue(bpm is not None)
+        # allow for the detector picking half or double the tempo
+        self.assertTrue(55 < bpm < 245, bpm)
+
+        # the pipeline can be reused
+        self.assertEqual(detector.detect(self.uri('clicks.wav')), bpm)
+
+    def test_error(self):
+        detector = bpmdetect.BPMDetector()
+        self.assertRaises(bpmdetect.BPMDetectError, detector.detect,
+                          self.uri('missing.wav'))
+
+    def test_stopped(self):
+        write_clicks(os.path.join(self.tempdir, 'clicks.wav'), 120, 20)
+        detector = bpmdetect.BPMDetector()
+        self.assertRaises(bpmdetect.BPMDetectError, detector.detect,
+                          self.uri('clicks.wav'), lambda: True)
@@ -0,0 +1,155 @@
+import array
+import imp
+import math
+import os
+import shutil
+import tempfile
+import unittest
+import wave
+
+from gi.repository import Gio
+from gi.repository import Gst
+
+from xl.trax import track
+
+analysis = imp.load_source('replaygain_analysis', os.path.join(
+    os.path.dirname(__file__), '..', '..', '..', 'plugins', 'replaygain',
+    'analysis.py'))
+
+Gst.init(None)
+HAVE_ELEMENTS = all(Gst.ElementFactory.find(elem)
+                    for elem in analysis.NEEDED_ELEMS)
+
+RATE = 44100
+
+
+def clear_all_tracks():
+    for key in track.Track._Track__tracksdict.keys():
+        del track.Track._Track__tracksdict[key]
+
+
+def write_sine(path, amplitude, seconds=3):
+    samples = array.array('h', [int(32767 * amplitude *
+                          math.sin(2 * math.pi * 440 * i / RATE))
+                          for i in range(RATE * seconds)])
+    f = wave.open(path, 'wb')
+    f.setnchannels(1)
+    f.setsampwidth(2)
+    f.setframerate(RATE)
+    f.writeframes(samples.tostring())
+    f.close()
+
+
+class TestJobs(unittest.TestCase):
+
+    def setUp(self):
+        self.tracks = []
+        for album in ('a', 'b'):
+            for i in range(3):
+                tr = track.Track('file:///rg/%s/%d.ogg' % (album, i),
+                                 scan=False)
+                tr.set_tag_raw('album', u'Album %s' % album)
+                self.tracks.append(tr)
+        self.single = track.Track('file:///rg/single.ogg', scan=False)
+        self.tracks.append(self.single)
+
+    def tearDown(self):
+        clear_all_tracks()
+
+    def test_tracks(self):
+        self.tracks[0].set_tag_raw(analysis.TRACK_GAIN, -3.0)
+        jobs = analysis.get_jobs(self.tracks)
+        self.assertEqual(jobs, [([tr], False) for tr in self.tracks[1:]])
+
+    def test_albums(self):
+        # the whole album of a selected track is analyzed
+        jobs = analysis.get_jobs([self.tracks[4], self.single], albums=True,
+                                 collection=self.tracks)
+        self.assertEqual(jobs, [([self.single], False),
+                                (self.tracks[3:6], True)])
+
+    def test_albums_skip_analyzed(self):
+        for tr in self.tracks[:3]:
+            tr.set_tag_raw(analysis.ALBUM_GAIN, -3.0)
+        self.single.set_tag_raw(analysis.TRACK_GAIN, -3.0)
+        # one track of the second album is missing its album gain
+        for tr in self.tracks[3:5]:
+            tr.set_tag_raw(analysis.ALBUM_GAIN, -3.0)
+        jobs = analysis.get_jobs(self.tracks, albums=True)
+        self.assertEqual(jobs, [(self.tracks[3:6], True)])
+
+    def test_albums_by_directory(self):
+        other = track.Track('file:///rg/other/0.ogg', scan=False)
+        other.set_tag_raw('album', u'Album a')
+        jobs = analysis.get_jobs(self.tracks[:3] + [other], albums=True)
+        self.assertEqual(jobs, [(self.tracks[:3], True), ([other], True)])
+
+    def test_store_results(self):
+        tracks = self.tracks[:2]
+        analysis.store_results(tracks, [(-3.0, 0.5), (-6.0, 0.75)],
+                               album=(-4.5, 0.75))
+        self.assertEqual(analysis.get_stored_gain(tracks[0]), -4.5)
+        self.assertEqual(analysis.get_stored_gain(tracks[0], False), -3.0)
+        self.assertEqual(tracks[1].get_tag_raw(analysis.TRACK_PEAK), 0.75)
+        self.assertEqual(tracks[1].get_tag_raw(analysis.ALBUM_PEAK), 0.75)
+        self.assertEqual(tracks[0].get_tag_raw('replaygain_track_gain'),
+                         None)
+        self.assertEqual(analysis.get_jobs(tracks, albums=True), [])
+
+    def test_store_results_without_album(self):
+        analysis.store_results([self.single], [(-3.0, 0.5)])
+        self.assertEqual(analysis.get_stored_gain(self.single), -3.0)
+        self.assertEqual(self.single.get_tag_raw(analysis.ALBUM_GAIN), None)
+
+
+@unittest.skipUnless(HAVE_ELEMENTS, "GStreamer rganalysis is not available")
+class TestAnalyzer(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.uris = []
+        for name, amplitude in (('loud', 0.5), ('quiet', 0.25)):
+            path = os.path.join(self.tempdir, '%s.wav' % name)
+            write_sine(path, amplitude)
+            self.uris.append(Gio.File.new_for_path(path).get_uri())
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        clear_all_tracks()
+
+    def test_tracks(self):
+        analyzer = analysis.Analyzer()
+        results, album = analyzer.analyze(self.uris[:1])
+        self.assertEqual(album, None)
+        self.assertAlmostEqual(results[0][1], 0.5, places=2)
+
+        # the pipeline can be reused
+        results, album = analyzer.analyze(self.uris[1:])
+        self.assertAlmostEqual(results[0][1], 0.25, places=2)
+
+    def test_album(self):
+        results, album = analysis.Analyzer().analyze(self.uris, album=True)
+        (loud_gain, loud_peak), (quiet_gain, quiet_peak) = results
+        self.assertAlmostEqual(loud_peak, 0.5, places=2)
+        self.assertAlmostEqual(quiet_peak, 0.25, places=2)
+        self.assertTrue(quiet_gain > loud_gain)
+        gain, peak = album
+        self.assertAlmostEqual(peak, 0.5, places=2)
+        self.assertTrue(loud_gain <= gain <= quiet_gain)
+
+    def test_error(self):
+        self.assertRaises(analysis.AnalysisError,
+                          analysis.Analyzer().analyze,
+                          [self.uris[0] + '.missing'])
+
+    def test_thread(self):
+        tracks = [track.Track(uri, scan=False) for uri in self.uris]
+        for tr in tracks:
+            tr.set_tag_raw('album', u'Album')
+        jobs = analysis.get_jobs(tracks) + analysis.get_jobs(tracks, True)
+        thread = analysis.AnalysisThread(jobs, job_count=2)
+        thread.run()
+        self.assertEqual(thread.failed, 0)
+        for tr in tracks:
+            self.assertTrue(tr.get_tag_raw(analysis.TRACK_GAIN) is not None)
+            self.assertTrue(tr.get_tag_raw(analysis.ALBUM_GAIN) is not None)
@@ -0,0 +1,229 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from gi.repository import Gio
+
+from xl import collection, settings
+from xl.trax import track
+
+
+def clear_all_tracks():
+    for key in track.Track._Track__tracksdict.keys():
+        del track.Track._Track__tracksdict[key]
+
+
+MUSIC = os.path.join(os.path.dirname(__file__), '..', 'data', 'music',
+        'testartist')
+
+
+class ImageCache(object):
+
+    def __init__(self):
+        self.dirs = {}
+
+    def is_image(self, name):
+        return name.endswith('.jpg')
+
+    def set(self, uri, fileinfo, names):
+        self.dirs[uri] = names
+
+
+class TestLibraryScan(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.music = os.path.join(self.tempdir, 'music')
+        shutil.copytree(MUSIC, self.music)
+        self.workers = settings.get_option('collection/scan_workers', 0)
+        self.collection = collection.Collection('test')
+        self.library = collection.Library(
+                Gio.File.new_for_path(self.music).get_uri())
+        self.collection.add_library(self.library)
+
+    def tearDown(self):
+        settings.set_option('collection/scan_workers', self.workers)
+        collection.COLLECTIONS.discard(self.collection)
+        shutil.rmtree(self.tempdir)
+        clear_all_tracks()
+
+    def scan(self, workers, force_update=False):
+        settings.set_option('collection/scan_workers', workers)
+        self.library.rescan(force_update=force_update)
+        return sorted(os.path.basename(tr.get_loc_for_io())
+                for tr in self.collection)
+
+    def get_track(self, name):
+        for tr in self.collection:
+            if tr.get_loc_for_io().endswith('/' + name):
+                return tr
+
+    def test_scan(self):
+        self.assertEqual(self.scan(1), ['1-black.ogg', '1-woot.ogg',
+                '2-foo.ogg', '2-white.ogg', '3-baz.ogg'])
+        self.assertEqual(self.get_track('2-foo.ogg').get_tag_raw('artist'),
+                [u'TestArtist'])
+
+    def test_scan_with_workers(self):
+        self.library.worker_chunk_size = 2
+        self.assertEqual(self.scan(2), ['1-black.ogg', '1-woot.ogg',
+                '2-foo.ogg', '2-white.ogg', '3-baz.ogg'])
+        self.assertEqual(self.get_track('2-foo.ogg').get_tag_raw('artist'),
+                [u'TestArtist'])
+
+    def test_workers_skip_unreadable_files(self):
+        with open(os.path.join(self.music, 'first', '3-bad.ogg'), 'wb') as f:
+            f.write('this is not an ogg file')
+        self.assertEqual(self.scan(2), ['1-black.ogg', '1-woot.ogg',
+                '2-foo.ogg', '2-white.ogg', '3-baz.ogg'])
+
+    def test_removed_files(self):
+        self.scan(2)
+        shutil.rmtree(os.path.join(self.music, 'second'))
+        self.assertEqual(self.scan(2), ['1-black.ogg', '2-white.ogg'])
+        os.remove(os.path.join(self.music, 'first', '2-white.ogg'))
+        self.assertEqual(self.scan(1), ['1-black.ogg'])
+
+    def test_removed_directory_of_unchanged_parent(self):
+        self.scan(1)
+        stat = os.stat(self.music)
+        shutil.rmtree(os.path.join(self.music, 'second'))
+        os.utime(self.music, (stat.st_atime, stat.st_mtime))
+        self.assertEqual(self.scan(1), ['1-black.ogg', '2-white.ogg'])
+
+    def test_cancel_keeps_unseen_tracks(self):
+        self.scan(1)
+        index = self.collection.directory_index
+        set_dir = index.set
+        def set_and_cancel(*args):
+            set_dir(*args)
+            self.collection.stop_scan()
+        index.set = set_and_cancel
+        try:
+            # stopped after listing the library's top directory
+            self.assertEqual(self.scan(1, force_update=True),
+                    ['1-black.ogg', '1-woot.ogg', '2-foo.ogg',
+                    '2-white.ogg', '3-baz.ogg'])
+        finally:
+            del index.set
+        self.assertFalse(self.library.scanning)
+
+    def test_image_cache(self):
+        cache = ImageCache()
+        previous = collection._image_cache
+        collection.set_image_cache(cache)
+        try:
+            with open(os.path.join(self.music, 'first', 'cover.jpg'),
+                    'wb') as f:
+                f.write('not really a jpeg')
+            self.scan(1)
+        finally:
+            collection.set_image_cache(previous)
+        first = Gio.File.new_for_path(os.path.join(self.music, 'first'))
+        self.assertEqual(cache.dirs[first.get_uri()], ['cover.jpg'])
+
+    def scan_items(self):
+        self.library._scan_seen = set()
+        self.library._scan_failed = []
+        libloc = Gio.File.new_for_uri(self.library.location)
+        return dict((item[0], item[5]) for item in
+                self.library._scan_items(libloc, False, False) if item[3])
+
+    def test_unchanged_directories_skipped(self):
+        self.scan(1)
+        first = Gio.File.new_for_path(os.path.join(self.music, 'first'))
+        self.assertEqual(self.scan_items()[first.get_uri()], 2)
+
+    def test_nontracks_do_not_prevent_skipping(self):
+        with open(os.path.join(self.music, 'first', '3-bad.ogg'), 'wb') as f:
+            f.write('this is not an ogg file')
+        self.scan(1)
+        first = Gio.File.new_for_path(os.path.join(self.music, 'first'))
+        self.assertEqual(self.scan_items()[first.get_uri()], 3)
+
+    def test_nontracks_persisted(self):
+        with open(os.path.join(self.music, 'first', '3-bad.ogg'), 'wb') as f:
+            f.write('this is not an ogg file')
+        location = os.path.join(self.tempdir, 'music.db')
+        self.collection = collection.Collection('test', location)
+        self.collection.add_library(self.library)
+        self.scan(1)
+        self.collection.save_to_location()
+        self.collection.close()
+        collection.COLLECTIONS.discard(self.collection)
+
+        self.collection = collection.Collection('test', location)
+        self.library = self.collection.get_libraries()[0]
+        first = Gio.File.new_for_path(os.path.join(self.music, 'first'))
+        self.assertEqual(self.scan_items()[first.get_uri()], 3)
+
+    def test_monitor_invalidates_directory(self):
+        self.scan(1)
+        first = Gio.File.new_for_path(os.path.join(self.music, 'first'))
+        self.library.monitor.on_location_changed(None,
+                first.get_child('1-black.ogg'), None,
+                Gio.FileMonitorEvent.ATTRIBUTE_CHANGED)
+        self.assertEqual(self.collection.directory_index.get(
+                first.get_uri()), None)
+        self.assertEqual(self.scan_items()[first.get_uri()], 0)
+
+
+class TestDirectoryIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.location = os.path.join(self.tempdir, 'music.db-dirs')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_persisted(self):
+        index = collection.DirectoryIndex(self.location)
+        index.set('file:///music', 1.0, 2, ['file:///music/a'], [])
+        index.set('file:///music/a', 2.0, 2, [],
+                ['file:///music/a/1.ogg', 'file:///music/a/2.ogg'])
+        index.add_nontrack('file:///music/a/2.ogg')
+        index.save()
+
+        index = collection.DirectoryIndex(self.location)
+        self.assertEqual(index.get('file:///music/a'), (2.0, 2, (),
+                ('file:///music/a/1.ogg', 'file:///music/a/2.ogg')))
+        self.assertTrue(index.is_nontrack('file:///music/a/2.ogg'))
+        self.assertFalse(index.is_nontrack('file:///music/a/1.ogg'))
+        self.assertEqual(index.count_entries('file:///music'), 5)
+
+    def test_invalidate(self):
+        index = collection.DirectoryIndex(self.location)
+        index.set('file:///music', 1.0, 1, [], ['file:///music/1.ogg'])
+        index.add_nontrack('file:///music/1.ogg')
+        index.save()
+        index.invalidate('file:///music')
+        index.save()
+
+        index = collection.DirectoryIndex(self.location)
+        self.assertEqual(index.get('file:///music'), None)
+        self.assertFalse(index.is_nontrack('file:///music/1.ogg'))
+
+    def test_remove_tree(self):
+        index = collection.DirectoryIndex()
+        index.set('file:///music', 1.0, 2, ['file:///music/a'], [])
+        index.set('file:///music/a', 1.0, 0, [], [])
+        index.set('file:///music2', 1.0, 0, [], [])
+        index.remove_tree('file:///music')
+        self.assertEqual(index.get('file:///music/a'), None)
+        self.assertNotEqual(index.get('file:///music2'), None)
+
+    def test_nontracks_of_removed_files_dropped(self):
+        index = collection.DirectoryIndex()
+        index.set('file:///music', 1.0, 1, [], ['file:///music/1.ogg'])
+        index.add_nontrack('file:///music/1.ogg')
+        index.set('file:///music', 2.0, 0, [], [])
+        self.assertFalse(index.is_nontrack('file:///music/1.ogg'))
+
+    def test_broken_index_is_dropped(self):
+        with open(self.location, 'wb') as f:
+            f.write('this is not a journal')
+        index = collection.DirectoryIndex(self.location)
+        self.assertEqual(index.get('file:///music'), None)
+        self.assertFalse(os.path.exists(self.location))
@@ -0,0 +1,86 @@
+import time
+import unittest
+from cStringIO import StringIO
+
+from xl import common
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_limit(self):
+        cache = common.LRUCache(3)
+        for i in range(3):
+            cache[i] = str(i)
+        cache[0]
+        cache[3] = '3'
+        self.assertEqual(cache.keys(), [2, 0, 3])
+        self.assertFalse(1 in cache)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_replace(self):
+        cache = common.LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache['a'] = 3
+        cache['c'] = 4
+        self.assertEqual(cache.items(), [('a', 3), ('c', 4)])
+        del cache['a']
+        self.assertEqual(len(cache), 1)
+        self.assertRaises(KeyError, cache.__delitem__, 'a')
+
+    def test_stats(self):
+        cache = common.LRUCache(2)
+        cache['a'] = 1
+        cache['a']
+        cache.get('b')
+        self.assertEqual(cache.keys(), ['a'])
+        self.assertEqual(cache.stats(), {'items': 1, 'bytes': 0,
+                'hits': 1, 'misses': 1, 'evictions': 0, 'expirations': 0})
+
+    def test_max_bytes(self):
+        cache = common.LRUCache(max_bytes=10)
+        cache['a'] = 'x' * 4
+        cache['b'] = 'x' * 4
+        cache['c'] = 'x' * 4
+        self.assertEqual(cache.keys(), ['b', 'c'])
+        self.assertEqual(cache.size, 8)
+        cache['b'] = 'x'
+        self.assertEqual(cache.size, 5)
+        cache['d'] = 'x' * 20
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+    def test_ttl(self):
+        cache = common.LRUCache(ttl=0.05)
+        cache['a'] = 1
+        self.assertEqual(cache['a'], 1)
+        time.sleep(0.06)
+        self.assertFalse('a' in cache)
+        self.assertEqual(cache.keys(), [])
+        self.assertRaises(KeyError, cache.__getitem__, 'a')
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_limited_cache(self):
+        cache = common.LimitedCache(2)
+        cache.update({'a': 1, 'b': 2})
+        cache['c'] = 3
+        self.assertEqual(len(cache.cache), 2)
+        self.assertEqual(cache.cache['c'], 3)
+
+    def test_cached(self):
+        calls = []
+
+        @common.cached(2, name='test_common.double')
+        def double(x):
+            calls.append(x)
+            return x * 2
+
+        self.assertEqual([double(1), double(1), double(2), double(3),
+                double(1)], [2, 2, 4, 6, 2])
+        self.assertEqual(calls, [1, 2, 3, 1])
+
+        out = StringIO()
+        common.dump_cache_stats(out)
+        line = [l for l in out.getvalue().splitlines()
+                if l.startswith('test_common.double')][0]
+        self.assertEqual(line.split()[1:6], ['2', '0', '1', '4', '2'])
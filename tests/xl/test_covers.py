@@ -0,0 +1,424 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from gi.repository import Gio
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from xl import covers
+from xl.trax import track
+
+
+def clear_all_tracks():
+    for key in track.Track._Track__tracksdict.keys():
+        del track.Track._Track__tracksdict[key]
+
+
+class TestCoverThumbnails(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.scaled = []
+        self.scale_cover = covers.scale_cover
+        covers.scale_cover = self.fake_scale_cover
+        self.manager = covers.CoverManager(self.tempdir)
+        self.track = track.Track('file:///covers/1.ogg')
+        self.track.set_tag_raw('album', [u'Album'])
+
+    def tearDown(self):
+        covers.scale_cover = self.scale_cover
+        shutil.rmtree(self.tempdir)
+        clear_all_tracks()
+
+    def fake_scale_cover(self, data, size):
+        self.scaled.append(size)
+        return '%s@%d' % (data, size)
+
+    def set_cover(self, data):
+        self.manager.set_cover(self.track, self.manager.db.add_data(data))
+
+    def test_no_cover(self):
+        self.assertEqual(self.manager.get_cover_thumbnail(self.track, 48),
+                None)
+        self.assertEqual(self.manager.get_cover_thumbnail(self.track, 48,
+                use_default=True),
+                '%s@48' % self.manager.get_default_cover())
+
+    def test_thumbnail_is_stored(self):
+        self.set_cover('one')
+        get = self.manager.get_cover_thumbnail
+        self.assertEqual(get(self.track, 90), 'one@100')
+        self.assertEqual(get(self.track, 100), 'one@100')
+        self.assertEqual(get(self.track, 20), 'one@48')
+        self.assertEqual(self.scaled, [100, 48])
+
+        # sizes above the largest thumbnail are not stored
+        self.assertEqual(get(self.track, 500), 'one@500')
+        self.assertEqual(get(self.track, 500), 'one@500')
+        self.assertEqual(self.scaled, [100, 48, 500, 500])
+
+    def test_set_cover_invalidates(self):
+        self.set_cover('one')
+        self.manager.get_cover_thumbnail(self.track, 100)
+        self.set_cover('two')
+        self.assertEqual(self.manager.get_cover_thumbnail(self.track, 100),
+                'two@100')
+
+    def test_remove_cover_invalidates(self):
+        self.set_cover('one')
+        self.manager.get_cover_thumbnail(self.track, 100)
+        self.manager.remove_cover(self.track)
+        self.assertEqual(self.manager.get_cover_thumbnail(self.track, 100),
+                None)
+        self.set_cover('one')
+        self.assertEqual(self.manager.get_cover_thumbnail(self.track, 100),
+                'one@100')
+        self.assertEqual(self.scaled, [100, 100])
+
+
+class FileMethod(covers.CoverSearchMethod):
+    """
+        A cover source that is not cached, like local files
+    """
+    use_cache = False
+    name = 'testfile'
+
+    def __init__(self):
+        self.data = {}
+        self.mtimes = {}
+
+    def get_cover_data(self, db_string):
+        return self.data.get(db_string)
+
+    def get_cover_mtime(self, db_string):
+        return self.mtimes.get(db_string)
+
+
+class TestUncachedThumbnails(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.scaled = []
+        self.scale_cover = covers.scale_cover
+        covers.scale_cover = self.fake_scale_cover
+        self.manager = covers.CoverManager(self.tempdir)
+        self.method = FileMethod()
+        self.manager.on_provider_added(self.method)
+        self.track = track.Track('file:///covers/1.ogg')
+        self.track.set_tag_raw('album', [u'Album'])
+
+    def tearDown(self):
+        covers.scale_cover = self.scale_cover
+        shutil.rmtree(self.tempdir)
+        clear_all_tracks()
+
+    def fake_scale_cover(self, data, size):
+        self.scaled.append(size)
+        return '%s@%d' % (data, size)
+
+    def set_file(self, data, mtime):
+        self.method.data['cover.jpg'] = data
+        self.method.mtimes['cover.jpg'] = mtime
+        self.manager.set_cover(self.track, 'testfile:cover.jpg')
+
+    def test_modified_source(self):
+        self.set_file('one', 1000)
+        get = self.manager.get_cover_thumbnail
+        self.assertEqual(get(self.track, 100), 'one@100')
+        self.method.data['cover.jpg'] = 'two'
+        self.assertEqual(get(self.track, 100), 'one@100')
+        self.method.mtimes['cover.jpg'] = 2000
+        self.assertEqual(get(self.track, 100), 'two@100')
+        self.assertEqual(get(self.track, 100), 'two@100')
+        self.assertEqual(self.scaled, [100, 100])
+
+
+class TestCoverStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.store = self.open_store()
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tempdir)
+
+    def open_store(self, limit=None):
+        store = covers.CoverStore(self.tempdir, limit)
+        store.open()
+        return store
+
+    def reopen(self, limit=None):
+        self.store.close()
+        self.store = self.open_store(limit)
+
+    def files(self):
+        return sorted(os.listdir(self.store.cache.cache_dir))
+
+    def test_save_and_reload(self):
+        key = ('album', (u'A',))
+        db_string = self.store.add_data('data')
+        self.store[key] = db_string
+        self.store[('album', (u'B',))] = 'localfile:/b.jpg'
+        self.reopen()
+        self.assertEqual(self.store.get(key), db_string)
+        self.assertEqual(self.store.get_data(db_string), 'data')
+        self.assertEqual(self.store[('album', (u'B',))], 'localfile:/b.jpg')
+        self.assertFalse(('album', (u'C',)) in self.store)
+
+    def test_shared_data(self):
+        db_string = self.store.add_data('data')
+        self.assertEqual(self.store.add_data('data'), db_string)
+        self.store[('album', (u'A',))] = db_string
+        self.store[('album', (u'B',))] = db_string
+        self.assertEqual(len(self.files()), 1)
+
+        del self.store[('album', (u'A',))]
+        self.reopen()
+        self.assertEqual(self.store.get_data(db_string), 'data')
+        self.store[('album', (u'B',))] = self.store.add_data('other')
+        self.assertEqual(self.store.get_data(db_string), None)
+        self.assertEqual(len(self.files()), 1)
+
+    def test_save_keeps_read_entries(self):
+        read = self.store.add_data('read')
+        self.store[('album', (u'A',))] = read
+        self.reopen()
+        self.assertEqual(self.store.get_data(read), 'read')
+        written = self.store.add_data('written')
+        self.store[('album', (u'B',))] = written
+        self.store.save()
+        self.assertEqual(self.store._blobs.keys(), [read[6:]])
+
+    def test_evict_fetched(self):
+        old = self.store.add_data('a' * 10, fetched=True)
+        self.store[('album', (u'A',))] = old
+        chosen = self.store.add_data('b' * 10)
+        self.store[('album', (u'B',))] = chosen
+        self.reopen(limit=15)
+
+        new = self.store.add_data('c' * 10, fetched=True)
+        self.store[('album', (u'C',))] = new
+        self.assertEqual(self.store.evict(keep=[new]),
+                [(('album', (u'A',)), old)])
+        self.assertEqual(self.store.get(('album', (u'A',))), None)
+        self.assertEqual(self.store.get_data(chosen), 'b' * 10)
+        self.assertEqual(self.store.get_data(new), 'c' * 10)
+        self.assertEqual(self.store.evict(), [])
+
+    def test_import_pickle(self):
+        self.store.close()
+        shutil.rmtree(self.tempdir)
+        cache = covers.Cacher(os.path.join(self.tempdir, 'cache'))
+        used = cache.add('used')
+        cache.add('leaked')
+        with open(os.path.join(self.tempdir, 'covers.db'), 'wb') as f:
+            pickle.dump({('album', (u'A',)): 'cache:%s' % used,
+                    ('album', (u'B',)): 'localfile:/b.jpg'}, f)
+
+        self.store = self.open_store()
+        self.assertEqual(self.store.get(('album', (u'A',))), 'cache:%s' % used)
+        self.assertEqual(self.store.get(('album', (u'B',))), 'localfile:/b.jpg')
+        self.assertEqual(self.files(), [used])
+
+
+class StubSearch(covers.CoverSearchMethod):
+
+    use_cache = True
+
+    def __init__(self, name, found=True, delay=0.02, **kwargs):
+        self.name = name
+        self.found = found
+        self.delay = delay
+        self.__dict__.update(kwargs)
+        self.lock = threading.Lock()
+        self.searched = []
+        self.started = []
+        self.running = 0
+        self.peak = 0
+
+    def find_covers(self, track, limit=-1):
+        with self.lock:
+            self.searched.append(track)
+            self.started.append(time.time())
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+        if not self.found:
+            return []
+        return [track.get_tag_raw('album', join=True)]
+
+    def get_cover_data(self, db_string):
+        return 'image of %s' % db_string
+
+
+class TestCoverFetchScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.manager = covers.CoverManager(self.tempdir)
+        self.manager.methods = {}
+        self.manager.order = []
+        self.stopper = threading.Event()
+        self.scheduler = covers.CoverFetchScheduler(self.manager,
+                workers=4, stopper=self.stopper)
+        self.fetched = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        clear_all_tracks()
+
+    def add_method(self, method):
+        self.manager.on_provider_added(method)
+        return method
+
+    def make_tracks(self, albums):
+        tracks = []
+        for i, album in enumerate(albums):
+            tr = track.Track('file:///fetch/%d.ogg' % i)
+            tr.set_tag_raw('album', [album])
+            tracks.append(tr)
+        return tracks
+
+    def on_fetched(self, track, data):
+        self.fetched.append((track, data))
+
+    def test_fetch_concurrently(self):
+        stub = self.add_method(StubSearch('stub', max_concurrent=3))
+        tracks = self.make_tracks([u'Album %d' % i for i in range(12)])
+        self.scheduler.fetch(tracks, self.on_fetched)
+
+        self.assertEqual(stub.peak, 3)
+        self.assertEqual(sorted(self.fetched),
+                sorted((tr, 'image of ' + tr.get_tag_raw('album')[0])
+                    for tr in tracks))
+        self.assertEqual(self.manager.get_cover(tracks[0], set_only=True),
+                'image of Album 0')
+
+    def test_providers_in_order(self):
+        missing = self.add_method(StubSearch('missing', found=False))
+        stub = self.add_method(StubSearch('stub'))
+        tracks = self.make_tracks([u'A', u'B'])
+        self.scheduler.fetch(tracks, self.on_fetched)
+
+        self.assertEqual(len(missing.searched), 2)
+        self.assertEqual(len(stub.searched), 2)
+        self.assertEqual(sorted(data for tr, data in self.fetched),
+                ['image of A', 'image of B'])
+
+    def test_same_album_searched_once(self):
+        stub = self.add_method(StubSearch('stub'))
+        tracks = self.make_tracks([u'A', u'A', u'B'])
+        self.scheduler.fetch(tracks, self.on_fetched)
+
+        self.assertEqual(len(stub.searched), 2)
+        self.assertEqual(len(self.fetched), 3)
+
+        # albums with a cover are not searched again
+        self.scheduler.fetch(tracks)
+        self.assertEqual(len(stub.searched), 2)
+
+    def test_rate_limit(self):
+        stub = self.add_method(StubSearch('stub', delay=0,
+                max_concurrent=4, min_interval=0.05))
+        self.scheduler.fetch(self.make_tracks([u'A', u'B', u'C', u'D']))
+
+        started = sorted(stub.started)
+        for first, second in zip(started, started[1:]):
+            self.assertTrue(second - first >= 0.045)
+
+    def test_stop(self):
+        stub = self.add_method(StubSearch('stub', max_concurrent=1))
+
+        def on_fetched(track, data):
+            self.fetched.append(track)
+            self.stopper.set()
+
+        self.scheduler.fetch(self.make_tracks([u'A', u'B', u'C', u'D']),
+                on_fetched)
+        self.assertEqual(len(self.fetched), 1)
+        self.assertTrue(len(stub.searched) < 4)
+
+
+class StubTime(object):
+
+    def __init__(self, tv_sec):
+        self.tv_sec = tv_sec
+        self.tv_usec = 0
+
+
+class StubFileInfo(object):
+
+    def __init__(self, name, file_type, mtime=0):
+        self.name = name
+        self.file_type = file_type
+        self.mtime = mtime
+
+    def get_name(self):
+        return self.name
+
+    def get_file_type(self):
+        return self.file_type
+
+    def get_modification_time(self):
+        return StubTime(self.mtime)
+
+
+class StubDirectory(object):
+
+    def __init__(self, uri, names):
+        self.uri = uri
+        self.names = names
+        self.mtime = 1
+        self.listed = 0
+
+    def get_uri(self):
+        return self.uri
+
+    def query_info(self, attributes, flags, cancellable):
+        return StubFileInfo(None, Gio.FileType.DIRECTORY, self.mtime)
+
+    def enumerate_children(self, attributes, flags, cancellable):
+        self.listed += 1
+        return [StubFileInfo(name, Gio.FileType.REGULAR)
+                for name in self.names]
+
+
+class TestDirectoryImageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = covers.DirectoryImageCache()
+        self.cache.check_interval = 0
+        self.dir = StubDirectory('file:///music/album',
+                ['01.ogg', 'cover.JPG', 'back.png'])
+
+    def test_listed_once(self):
+        self.assertEqual(self.cache.get(self.dir), ('cover.JPG', 'back.png'))
+        self.assertEqual(self.cache.get(self.dir), ('cover.JPG', 'back.png'))
+        self.assertEqual(self.dir.listed, 1)
+
+    def test_modified_directory_listed_again(self):
+        self.cache.get(self.dir)
+        self.dir.mtime = 2
+        self.dir.names = ['01.ogg']
+        self.assertEqual(self.cache.get(self.dir), ())
+        self.assertEqual(self.dir.listed, 2)
+
+    def test_set_and_invalidate(self):
+        info = self.dir.query_info(None, None, None)
+        self.cache.set(self.dir.get_uri(), info, ['folder.jpg'])
+        self.assertEqual(self.cache.get(self.dir), ('folder.jpg',))
+        self.assertEqual(self.dir.listed, 0)
+
+        self.cache.remove_tree('file:///music')
+        self.assertEqual(self.cache.get(self.dir), ('cover.JPG', 'back.png'))
+        self.assertEqual(self.dir.listed, 1)
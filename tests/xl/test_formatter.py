@@ -0,0 +1,107 @@
+import unittest
+
+from xl import event
+from xl import formatter
+from xl import providers
+from xl.trax import track
+
+
+def clear_all_tracks():
+    for key in track.Track._Track__tracksdict.keys():
+        del track.Track._Track__tracksdict[key]
+
+
+class CountingTagFormatter(formatter.TagFormatter):
+
+    def __init__(self):
+        formatter.TagFormatter.__init__(self, 'counted')
+        self.calls = []
+
+    def format(self, track, parameters):
+        self.calls.append(parameters)
+        return u'#%s' % parameters.get('x', '')
+
+
+class TestFormatter(unittest.TestCase):
+
+    def test_substitutions(self):
+        f = formatter.Formatter(u'$a ${a} ${b:pad=3, padstring=0} '
+                                u'${c:prefix=[, suffix=]} ${c:x=1} $$ $d ${d}')
+        f._substitutions = {
+            'a': u'A',
+            'b': u'7',
+            'c': lambda **kwargs: u','.join(sorted(kwargs)),
+        }
+        self.assertEqual(f.format(), u'A A 007  x $ $d ${d}')
+
+    def test_template_parsed_once(self):
+        f = formatter.Formatter(u'$a')
+        plan = f._compile()
+        f._substitutions = {'a': u'1'}
+        self.assertEqual(f.format(), u'1')
+        self.assertTrue(f._compile() is plan)
+
+        f._template.template = u'<$a>'
+        self.assertEqual(f.format(), u'<1>')
+        self.assertFalse(f._compile() is plan)
+
+    def test_extract(self):
+        f = formatter.Formatter(u'$a ${b:c, d=e\\,f}')
+        extractions = f.extract()
+        self.assertEqual(extractions, {
+            'a': ('a', {}),
+            'b:c, d=e\\,f': ('b', {'c': True, 'd': 'e,f'}),
+        })
+        # changes to the extractions do not leak into the format
+        extractions['a'][1]['pad'] = 5
+        self.assertEqual(f.extract()['a'], ('a', {}))
+
+
+class TestTrackFormatter(unittest.TestCase):
+
+    def setUp(self):
+        self.tracks = []
+        for i in range(3):
+            tr = track.Track('file:///formatter/%d.ogg' % i)
+            tr.set_tag_raw('title', [u'Title %d' % i])
+            tr.set_tag_raw('tracknumber', [u'%d/3' % (i + 1)])
+            self.tracks.append(tr)
+        # other tests replace the event manager
+        for type in ('added', 'removed'):
+            event.add_callback(self.on_providers_changed,
+                    'tag-formatting_provider_%s' % type)
+        self.counted = CountingTagFormatter()
+        providers.register('tag-formatting', self.counted)
+
+    def tearDown(self):
+        providers.unregister('tag-formatting', self.counted)
+        for type in ('added', 'removed'):
+            event.remove_callback(self.on_providers_changed,
+                    'tag-formatting_provider_%s' % type)
+        clear_all_tracks()
+
+    def on_providers_changed(self, *args):
+        formatter._on_tag_formatters_changed(*args)
+
+    def test_format(self):
+        f = formatter.TrackFormatter(u'${tracknumber:pad=2, padstring=0} '
+                                     u'- $title$missing')
+        self.assertEqual(f.format(self.tracks[1]), u'02 - Title 1')
+        self.assertRaises(TypeError, f.format, u'not a track')
+
+    def test_format_tracks(self):
+        f = formatter.TrackFormatter(u'$title ${counted:x=1, prefix=<}')
+        self.assertEqual(f.format_tracks(self.tracks),
+                [f.format(tr) for tr in self.tracks])
+        self.assertEqual(f.format_tracks(self.tracks)[2], u'Title 2 <#1')
+        self.assertEqual(f.format_tracks([]), [])
+        # tag formatters get all parameters
+        self.assertEqual(self.counted.calls[0], {'x': '1', 'prefix': '<'})
+
+    def test_provider_changes(self):
+        f = formatter.TrackFormatter(u'$counted')
+        self.assertEqual(f.format(self.tracks[0]), u'#')
+        providers.unregister('tag-formatting', self.counted)
+        self.assertEqual(f.format(self.tracks[0]), u'')
+        providers.register('tag-formatting', self.counted)
+        self.assertEqual(f.format(self.tracks[0]), u'#')
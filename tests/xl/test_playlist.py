@@ -0,0 +1,319 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from xl import playlist
+from xl.trax import track
+
+
+def clear_all_tracks():
+    for key in track.Track._Track__tracksdict.keys():
+        del track.Track._Track__tracksdict[key]
+
+
+class TestPlaylistPositions(unittest.TestCase):
+
+    def setUp(self):
+        self.tracks = [track.Track('file:///playlist/%d.ogg' % i)
+                for i in range(5)]
+        a, b, c, d, e = self.tracks
+        self.pl = playlist.Playlist('test', [a, b, a, c])
+
+    def tearDown(self):
+        clear_all_tracks()
+
+    def check(self):
+        # the index must agree with a plain scan of the playlist
+        items = list(self.pl)
+        for tr in self.tracks:
+            positions = [i for i, x in enumerate(items) if x is tr]
+            self.assertEqual(self.pl.get_positions(tr), positions)
+            self.assertEqual(self.pl.count(tr), len(positions))
+            self.assertEqual(tr in self.pl, bool(positions))
+            if positions:
+                self.assertEqual(self.pl.index(tr), positions[0])
+            else:
+                self.assertRaises(ValueError, self.pl.index, tr)
+
+    def test_lookups(self):
+        a, b, c, d, e = self.tracks
+        self.check()
+        self.assertEqual(self.pl.index(a, 1), 2)
+        self.assertEqual(self.pl.index(a, -2), 2)
+        self.assertRaises(ValueError, self.pl.index, a, 1, 2)
+        self.assertRaises(ValueError, self.pl.index, a, 3)
+
+    def test_changes(self):
+        a, b, c, d, e = self.tracks
+        self.check()
+        self.pl.extend([d, a])
+        self.check()
+        self.pl.append(e)
+        self.check()
+        del self.pl[-2:]
+        self.check()
+        self.pl.pop(len(self.pl) - 1)
+        self.check()
+        self.pl[0:0] = [e]
+        self.check()
+        del self.pl[1]
+        self.check()
+        self.pl[1:2] = [d]
+        self.check()
+        self.pl.randomize()
+        self.check()
+        self.pl.clear()
+        self.check()
+
+
+class TestPlaylistNext(unittest.TestCase):
+
+    def setUp(self):
+        self.tracks = [track.Track('file:///next/%d.ogg' % i)
+                for i in range(4)]
+        self.pl = playlist.Playlist('next', self.tracks)
+
+    def tearDown(self):
+        clear_all_tracks()
+
+    def test_mode_changed_after_get_next(self):
+        self.pl.current_position = 0
+        self.assertEqual(self.pl.get_next(), self.tracks[1])
+        self.pl.repeat_mode = 'track'
+        self.assertEqual(self.pl.next(), self.tracks[0])
+
+    def test_repeat_enabled_on_last_track(self):
+        self.pl.current_position = 3
+        self.assertEqual(self.pl.get_next(), None)
+        self.pl.repeat_mode = 'all'
+        self.assertEqual(self.pl.next(), self.tracks[0])
+
+    def test_next_track_removed(self):
+        self.pl.current_position = 0
+        self.assertEqual(self.pl.get_next(), self.tracks[1])
+        del self.pl[1]
+        self.assertEqual(self.pl.next(), self.tracks[2])
+
+    def test_track_inserted(self):
+        extra = track.Track('file:///next/extra.ogg')
+        self.pl.current_position = 0
+        self.assertEqual(self.pl.get_next(), self.tracks[1])
+        self.pl[1:1] = [extra]
+        self.assertEqual(self.pl.next(), extra)
+
+
+class TestPlaylistShuffle(unittest.TestCase):
+
+    def setUp(self):
+        self.tracks = []
+        for album in range(4):
+            for number in (3, 1, 2):
+                tr = track.Track('file:///shuffle/%d-%d.ogg' % (album, number))
+                tr.set_tag_raw('album', [u'Album %d' % album])
+                tr.set_tag_raw('tracknumber', [u'%d' % number])
+                self.tracks.append(tr)
+        self.pl = playlist.Playlist('shuffle', self.tracks)
+
+    def tearDown(self):
+        clear_all_tracks()
+
+    def play_all(self, mode):
+        self.pl.shuffle_mode = mode
+        # the first track of the first album
+        self.pl.current_position = 1
+        played = [self.pl.current]
+        while True:
+            tr = self.pl.next()
+            if tr is None:
+                break
+            played.append(tr)
+        return played
+
+    def test_track(self):
+        played = self.play_all('track')
+        self.assertEqual(sorted(played), sorted(self.tracks))
+
+    def test_weighted(self):
+        played = self.play_all('weighted')
+        self.assertEqual(sorted(played), sorted(self.tracks))
+
+    def test_album(self):
+        played = self.play_all('album')
+        self.assertEqual(sorted(played), sorted(self.tracks))
+        # albums are played in full, in track order
+        albums = [tr.get_tag_raw('album')[0] for tr in played]
+        numbers = [tr.get_tag_raw('tracknumber')[0] for tr in played]
+        self.assertEqual(albums[:3], [u'Album 0'] * 3)
+        self.assertEqual(numbers, [u'1', u'2', u'3'] * 4)
+        for i in range(0, 12, 3):
+            self.assertEqual(len(set(albums[i:i + 3])), 1)
+
+    def test_appended_tracks_are_played(self):
+        self.pl.shuffle_mode = 'track'
+        self.pl.current_position = 0
+        played = [self.pl.current]
+        extra = track.Track('file:///shuffle/extra.ogg')
+        for i in range(5):
+            played.append(self.pl.next())
+        self.pl.append(extra)
+        while True:
+            tr = self.pl.next()
+            if tr is None:
+                break
+            played.append(tr)
+        self.assertEqual(sorted(played), sorted(self.tracks + [extra]))
+
+    def test_prev(self):
+        self.pl.shuffle_mode = 'track'
+        self.pl.current_position = 0
+        played = [self.pl.current]
+        for i in range(3):
+            played.append(self.pl.next())
+        self.assertEqual(self.pl.prev(), played[2])
+        self.assertEqual(self.pl.prev(), played[1])
+        self.assertEqual(len(self.pl.get_shuffle_history()), 1)
+
+    def test_weights(self):
+        heavy = self.tracks[5]
+        pool = playlist._ShufflePool(lambda tr: 1000 if tr is heavy else 1)
+        for tr in self.tracks:
+            pool.append(tr)
+        chosen = [pool.choose_track() for i in range(200)]
+        self.assertTrue(chosen.count(5) > 150)
+
+        pool.mark_played(5)
+        chosen = set(pool.choose_track() for i in range(200))
+        self.assertFalse(5 in chosen)
+        for position in range(len(self.tracks)):
+            pool.mark_played(position)
+        self.assertEqual(pool.choose_track(), -1)
+        self.assertEqual(pool.pop_played(), len(self.tracks) - 1)
+        self.assertEqual(pool.choose_track(), len(self.tracks) - 1)
+
+
+class TestPlaylistFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.location = os.path.join(self.tempdir, 'file.playlist')
+        self.tracks = [track.Track('file:///file/%d.ogg' % i)
+                for i in range(5)]
+        self.pl = playlist.Playlist('file', self.tracks[:3])
+        self.pl.current_position = 1
+        self.pl.shuffle_mode = 'track'
+        self.pl.save_to_location(self.location)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        clear_all_tracks()
+
+    def load(self, lazy=False):
+        pl = playlist.Playlist('loaded')
+        pl.load_from_location(self.location, lazy)
+        return pl
+
+    def test_load(self):
+        pl = self.load()
+        self.assertTrue(pl.loaded)
+        self.assertEqual(list(pl), self.tracks[:3])
+        self.assertEqual(pl.current_position, 1)
+        self.assertEqual(pl.shuffle_mode, 'track')
+        self.assertEqual(pl.name, 'file')
+
+    def test_chunks(self):
+        lines = ['%s\t\n' % tr.get_loc_for_io() for tr in self.tracks]
+        chunks = list(playlist._read_tracks(lines, chunk_size=2))
+        self.assertEqual(chunks, [self.tracks[:2], self.tracks[2:4],
+                self.tracks[4:]])
+
+    def test_lazy_load(self):
+        pl = self.load(lazy=True)
+        self.assertFalse(pl.loaded)
+        self.assertEqual(pl.name, 'file')
+        self.assertEqual(pl.shuffle_mode, 'track')
+        self.assertFalse(pl.loaded)
+
+        self.assertEqual(pl.current_position, 1)
+        self.assertTrue(pl.loaded)
+        self.assertEqual(list(pl), self.tracks[:3])
+
+    def test_lazy_load_other_thread(self):
+        pl = self.load(lazy=True)
+        reading = threading.Event()
+        release = threading.Event()
+        read_tracks = playlist._read_tracks
+        def slow_read_tracks(lines):
+            reading.set()
+            release.wait()
+            return read_tracks(lines)
+        positions = []
+        loader = threading.Thread(target=pl.load_tracks)
+        other = threading.Thread(
+                target=lambda: positions.append(pl.current_position))
+
+        playlist._read_tracks = slow_read_tracks
+        try:
+            loader.start()
+            reading.wait()
+            other.start()
+            # the other thread waits for the tracks to be read
+            other.join(0.2)
+            release.set()
+            loader.join()
+            other.join()
+        finally:
+            playlist._read_tracks = read_tracks
+        self.assertEqual(positions, [1])
+        self.assertEqual(list(pl), self.tracks[:3])
+
+    def test_lazy_save(self):
+        pl = self.load(lazy=True)
+        pl.name = 'renamed'
+        pl.save_to_location(self.location)
+        self.assertFalse(pl.loaded)
+        self.assertEqual(list(pl), self.tracks[:3])
+        self.assertEqual(self.load().name, 'renamed')
+
+    def test_lazy_file_removed(self):
+        manager = playlist.PlaylistManager(self.tempdir)
+        pl = manager.get_playlist('file', lazy=True)
+        manager.remove_playlist('file')
+        self.assertFalse(os.path.exists(self.location))
+        self.assertEqual(list(pl), self.tracks[:3])
+
+    def test_incremental_save(self):
+        a, b, c, d, e = self.tracks
+        written = []
+        self.pl.append(d)
+        self.pl.save_to_location(self.location)
+        self.assertEqual(list(self.load()), [a, b, c, d])
+
+        # only the appended track is written
+        get_loc_for_io = track.Track.get_loc_for_io
+        def counting_get_loc_for_io(tr):
+            written.append(tr)
+            return get_loc_for_io(tr)
+        track.Track.get_loc_for_io = counting_get_loc_for_io
+        try:
+            self.pl.append(e)
+            self.pl.save_to_location(self.location)
+            self.assertEqual(written, [e])
+            # other changes rewrite the file
+            del self.pl[1]
+            self.pl.save_to_location(self.location)
+            self.assertEqual(written, [e, a, c, d, e])
+        finally:
+            track.Track.get_loc_for_io = get_loc_for_io
+
+        pl = self.load()
+        self.assertEqual(list(pl), [a, c, d, e])
+        self.assertEqual(pl.current_position, 0)
+
+    def test_changed_file_is_rewritten(self):
+        other = playlist.Playlist('other', self.tracks[3:])
+        other.save_to_location(self.location)
+        self.pl.append(self.tracks[4])
+        self.pl.save_to_location(self.location)
+        self.assertEqual(list(self.load()), self.tracks[:3] + [self.tracks[4]])
@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from xl import settings
+
+
+class TestSettingsCache(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = settings.SettingsManager(None)
+
+    def test_values(self):
+        values = {
+            'test/int': 3,
+            'test/float': 0.5,
+            'test/bool': False,
+            'test/unicode': u'text',
+            'test/list': [u'a', ('b', 2), [3]],
+            'test/dict': {'a': [1, 2], u'b': None},
+        }
+        for option, value in values.iteritems():
+            self.settings.set_option(option, value)
+        for i in range(2):
+            for option, value in values.iteritems():
+                self.assertEqual(self.settings.get_option(option), value)
+        self.assertEqual(self.settings.get_option('test/missing', 5), 5)
+
+    def test_invalidation(self):
+        self.assertEqual(self.settings.get_option('test/value'), None)
+        self.settings.set_option('test/value', 1)
+        self.assertEqual(self.settings.get_option('test/value'), 1)
+        self.settings.set_option('test/Value', 2)
+        self.assertEqual(self.settings.get_option('test/value'), 2)
+        self.assertEqual(self.settings.get_option('test/VALUE'), 2)
+        self.settings.remove_option('test/value')
+        self.assertEqual(self.settings.get_option('test/Value', 3), 3)
+
+        clone = self.settings.clone()
+        clone.get_option('test/other')
+        self.settings.set_option('test/other', 4)
+        self.settings.copy_settings(clone)
+        self.assertEqual(clone.get_option('test/other'), 4)
+
+    def test_values_are_copied(self):
+        self.settings.set_option('test/list', [[1], {'a': 2}])
+        value = self.settings.get_option('test/list')
+        value[0].append(2)
+        value[1]['b'] = 3
+        value.append(4)
+        self.assertEqual(self.settings.get_option('test/list'), [[1], {'a': 2}])
+
+    def test_no_eval(self):
+        self.settings.set_option('test/list', [])
+        self.settings.set('test', 'list', 'L: [__import__("os")]')
+        self.assertEqual(self.settings.get_option('test/list', []), '')
+
+
+class TestSettingsSave(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.timeouts = []
+        self.timeout_add = settings.GLib.timeout_add
+        self.source_remove = settings.GLib.source_remove
+        settings.GLib.timeout_add = self.fake_timeout_add
+        settings.GLib.source_remove = self.fake_source_remove
+        self.settings = settings.SettingsManager(
+                os.path.join(self.tempdir, 'settings.ini'))
+        self.settings._timeout_save = lambda: None
+        del self.timeouts[:]
+
+    def tearDown(self):
+        settings.GLib.timeout_add = self.timeout_add
+        settings.GLib.source_remove = self.source_remove
+        shutil.rmtree(self.tempdir)
+
+    def fake_timeout_add(self, timeout, function, *args):
+        self.timeouts.append(function)
+        return len(self.timeouts)
+
+    def fake_source_remove(self, source):
+        self.timeouts[source - 1] = None
+
+    def pending(self):
+        return [f for f in self.timeouts if f is not None]
+
+    def test_burst_saved_once(self):
+        for volume in range(10):
+            self.settings.set_option('player/volume', volume / 10.0)
+        pending = self.pending()
+        self.assertEqual(len(pending), 1)
+        pending[0]()
+        loaded = settings.SettingsManager(self.settings.location)
+        self.assertEqual(loaded.get_option('player/volume'), 0.9)
+
+    def test_unchanged_value_not_saved(self):
+        self.settings.set_option('player/volume', 0.5)
+        self.pending()[0]()
+        del self.timeouts[:]
+        self.settings.set_option('player/volume', 0.5)
+        self.assertEqual(self.pending(), [])
@@ -0,0 +1,66 @@
+"""
+    Measures how many tracks per second TracksMatcher checks for a few
+    typical queries, compared to evaluating its matcher tree directly
+    as it was done before matchers were compiled.
+
+    Usage: python -m tests.xl.trax.bench_search [size]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from xl.trax import search
+from xl.trax.track import Track
+
+from tests.xl.trax.test_search_compiled import reference_match
+
+DEFAULT_SIZE = 50000
+KEYWORD_TAGS = ['artist', 'albumartist', 'album', 'title']
+QUERIES = [
+    u'foo',
+    u'artist 12',
+    u'artist==artist 3',
+    u'album=album 7 ! genre==rock',
+    u'date>1990 date<2000 title~^title 1',
+]
+
+
+def make_tracks(size):
+    tracks = []
+    for i in xrange(size):
+        tr = Track(u'file:///music/%d.ogg' % i, scan=False)
+        tr.set_tag_raw('artist', [u'Artist %d' % (i // 120)])
+        tr.set_tag_raw('album', [u'Album %d' % (i // 12)])
+        tr.set_tag_raw('title', [u'Title %d' % i])
+        tr.set_tag_raw('genre', [(u'Rock', u'Jazz', u'Pop')[i % 3]])
+        tr.set_tag_raw('date', [u'%d' % (1970 + i % 40)])
+        tracks.append(search.SearchResultTrack(tr))
+    return tracks
+
+
+def rate(func, matcher, srtrs):
+    start = time.time()
+    for srtr in srtrs:
+        func(matcher, srtr)
+    return len(srtrs) / (time.time() - start)
+
+
+def main(argv):
+    size = int(argv[1]) if len(argv) > 1 else DEFAULT_SIZE
+    srtrs = make_tracks(size)
+    compiled = lambda matcher, srtr: matcher.match(srtr)
+    print("%d tracks, tracks per second" % size)
+    for query in QUERIES:
+        matcher = search.TracksMatcher(query, case_sensitive=False,
+                keyword_tags=KEYWORD_TAGS)
+        old = rate(reference_match, matcher, srtrs)
+        cold = rate(compiled, matcher, srtrs)
+        warm = rate(compiled, matcher, srtrs)
+        print("  %-36s tree %9d   compiled %9d   memoized %9d"
+                % (query, old, cold, warm))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
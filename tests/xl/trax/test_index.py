@@ -0,0 +1,156 @@
+import threading
+import unittest
+
+from xl import settings
+from xl.trax import index
+from xl.trax import search
+from xl.trax import track
+from xl.trax import trackdb
+from xl.trax import util as trax_util
+
+
+def clear_all_tracks():
+    for key in track.Track._Track__tracksdict.keys():
+        del track.Track._Track__tracksdict[key]
+
+
+ARTISTS = [u'Foo', u'foo bar', u'B\xe9la', None, u'Baz']
+ALBUMS = [u'Alpha', u'Beta', u'Gamma']
+KEYWORD_TAGS = ['artist', 'album', 'title']
+
+
+class TestTagIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.db = trackdb.TrackDB()
+        tracks = []
+        for i in range(30):
+            tr = track.Track('file:///index/%d.ogg' % i)
+            artist = ARTISTS[i % len(ARTISTS)]
+            if artist is not None:
+                tr.set_tag_raw('artist', [artist])
+            tr.set_tag_raw('album', [ALBUMS[i % len(ALBUMS)]])
+            tr.set_tag_raw('title', [u'Song %d' % i])
+            tracks.append(tr)
+        self.tracks = tracks
+        self.db.add_tracks(tracks)
+
+    def tearDown(self):
+        self.db.tag_index.clear()
+        clear_all_tracks()
+
+    def linear(self, string):
+        return set(srtr.track for srtr in search.search_tracks_from_string(
+                iter(self.tracks), string, case_sensitive=False,
+                keyword_tags=KEYWORD_TAGS))
+
+    def indexed(self, string):
+        return set(srtr.track for srtr in search.search_tracks_from_string(
+                self.db, string, case_sensitive=False,
+                keyword_tags=KEYWORD_TAGS))
+
+    def assertSameResults(self, string):
+        self.assertEqual(self.linear(string), self.indexed(string), string)
+
+    def test_same_results(self):
+        for string in [u'artist==foo', u'artist=foo', u'artist=bar',
+                u'artist=bel', u'artist==__null__', u'! artist==foo',
+                u'artist~^fo', u'artist~^fo*', u'artist~^foo|baz',
+                u'artist==foo | album==beta', u'artist=foo album=gam',
+                u'title=song 1', u'foo', u'al', u'title<"Song 3"']:
+            self.assertSameResults(string)
+
+    def test_candidates_are_narrowed(self):
+        matcher = search.TracksMatcher(u'album==beta', case_sensitive=False)
+        candidates = self.db.tag_index.candidates([matcher])
+        self.assertEqual(len(candidates), 10)
+
+    def test_tracks_added_and_removed(self):
+        self.indexed(u'album==beta')
+        tr = track.Track('file:///index/new.ogg')
+        tr.set_tag_raw('album', [u'Beta'])
+        self.db.add_tracks([tr])
+        self.assertTrue(tr in self.indexed(u'album==beta'))
+        self.db.remove_tracks([tr])
+        self.assertFalse(tr in self.indexed(u'album==beta'))
+
+    def test_tracks_added_while_indexing(self):
+        new = track.Track('file:///index/new.ogg')
+        new.set_tag_raw('album', [u'Beta'])
+        adder = threading.Thread(target=self.db.add_tracks, args=([new],))
+        calls = []
+        search_value = index.search_value
+        def adding_search_value(tr, tag):
+            calls.append(tr)
+            if len(calls) == 10:
+                adder.start()
+                adder.join(0.1)
+            return search_value(tr, tag)
+
+        index.search_value = adding_search_value
+        try:
+            first = self.indexed(u'album==beta')
+        finally:
+            index.search_value = search_value
+        adder.join()
+        self.tracks.append(new)
+        self.assertTrue(first <= self.linear(u'album==beta'))
+        self.assertSameResults(u'album==beta')
+
+    def test_tag_changed(self):
+        self.assertSameResults(u'album==delta')
+        self.tracks[0].set_tag_raw('album', [u'Delta'])
+        self.assertEqual(self.indexed(u'album==delta'), set([self.tracks[0]]))
+        self.assertSameResults(u'album==alpha')
+
+    def test_literal_prefix(self):
+        self.assertEqual(index._literal_prefix(u'^foo'), u'foo')
+        self.assertEqual(index._literal_prefix(u'^foo?'), u'fo')
+        self.assertEqual(index._literal_prefix(u'^a|b'), None)
+        self.assertEqual(index._literal_prefix(u'foo'), None)
+
+
+class TestSortedTracks(unittest.TestCase):
+
+    def setUp(self):
+        self.db = trackdb.TrackDB()
+        self.tracks = []
+        for i in range(20):
+            tr = track.Track('file:///sorted/%d.ogg' % i)
+            tr.set_tag_raw('artist', [ARTISTS[i % len(ARTISTS)] or u'Nobody'])
+            tr.set_tag_raw('tracknumber', [u'%d' % (20 - i)])
+            self.tracks.append(tr)
+        self.db.add_tracks(self.tracks)
+
+    def tearDown(self):
+        self.db._sorted_tracks.clear()
+        clear_all_tracks()
+
+    def assertSorted(self, fields):
+        expected = trax_util.sort_tracks(fields + ['__loc'], self.db)
+        self.assertEqual(self.db.get_sorted_tracks(fields), expected)
+
+    def test_sorted(self):
+        self.assertSorted(['artist', 'tracknumber'])
+        self.assertSorted(['tracknumber'])
+
+    def test_kept_up_to_date(self):
+        self.assertSorted(['artist'])
+        self.tracks[3].set_tag_raw('artist', [u'Aardvark'])
+        new = track.Track('file:///sorted/new.ogg')
+        new.set_tag_raw('artist', [u'Zebra'])
+        self.db.add_tracks([new])
+        self.db.remove_tracks([self.tracks[5]])
+        self.assertSorted(['artist'])
+        self.assertEqual(self.db.get_sorted_tracks(['artist'])[-1], new)
+
+    def test_strip_list_change(self):
+        strip_list = settings.get_option('collection/strip_list', [])
+        try:
+            self.tracks[0].set_tag_raw('artist', [u'The Apples'])
+            settings.set_option('collection/strip_list', [u'the'])
+            self.assertSorted(['artist'])
+            settings.set_option('collection/strip_list', [])
+            self.assertSorted(['artist'])
+        finally:
+            settings.set_option('collection/strip_list', strip_list)
@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from xl.trax import journal
+
+
+class TestTrackJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.location = os.path.join(self.tempdir, 'music.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def open_journal(self, **kwargs):
+        jrnl = journal.TrackJournal(self.location, **kwargs)
+        jrnl.open()
+        return jrnl
+
+    def test_new_file_is_journal(self):
+        self.open_journal().close()
+        self.assertTrue(journal.is_journal(self.location))
+
+    def test_not_a_journal(self):
+        with open(self.location, 'wb') as f:
+            f.write('this is not a journal')
+        jrnl = journal.TrackJournal(self.location)
+        self.assertRaises(journal.JournalError, jrnl.open)
+
+    def test_write_and_reload(self):
+        jrnl = self.open_journal()
+        jrnl.write([('name', u'Collection'),
+                    ('tracks-1', ({'__loc': u'file:///a'}, 1, {}))])
+        jrnl.write([('tracks-2', ({'__loc': u'file:///b'}, 2, {}))])
+        jrnl.close()
+
+        jrnl = self.open_journal()
+        self.assertEqual(sorted(jrnl.keys()),
+                ['name', 'tracks-1', 'tracks-2'])
+        self.assertEqual(jrnl.get('name'), u'Collection')
+        self.assertEqual([k for k, v in jrnl.iteritems('tracks-')],
+                ['tracks-1', 'tracks-2'])
+        jrnl.close()
+
+    def test_newest_record_wins(self):
+        jrnl = self.open_journal()
+        jrnl.write([('_key', 1)])
+        jrnl.write([('_key', 2)])
+        jrnl.close()
+        jrnl = self.open_journal()
+        self.assertEqual(jrnl.get('_key'), 2)
+        jrnl.close()
+
+    def test_delete(self):
+        jrnl = self.open_journal()
+        jrnl.write([('tracks-1', 'a'), ('tracks-2', 'b')])
+        jrnl.write(deletes=['tracks-1', 'tracks-3'])
+        jrnl.close()
+        jrnl = self.open_journal()
+        self.assertEqual(jrnl.keys(), ['tracks-2'])
+        self.assertEqual(jrnl.get('tracks-1', 'missing'), 'missing')
+        jrnl.close()
+
+    def test_truncated_record_is_discarded(self):
+        jrnl = self.open_journal()
+        jrnl.write([('tracks-1', 'a')])
+        jrnl.close()
+        size = os.path.getsize(self.location)
+        with open(self.location, 'ab') as f:
+            f.write('p\x00\x00\x00')
+
+        jrnl = self.open_journal()
+        self.assertEqual(jrnl.get('tracks-1'), 'a')
+        jrnl.close()
+        self.assertEqual(os.path.getsize(self.location), size)
+
+    def test_compact(self):
+        jrnl = self.open_journal(compact_min_size=0)
+        for i in range(10):
+            jrnl.write([('tracks-1', i), ('tracks-2', -i)])
+        self.assertTrue(jrnl.needs_compaction())
+        size = os.path.getsize(self.location)
+
+        jrnl.compact()
+        self.assertFalse(jrnl.needs_compaction())
+        self.assertTrue(os.path.getsize(self.location) < size)
+        self.assertEqual(jrnl.get('tracks-1'), 9)
+        jrnl.write([('tracks-3', 3)])
+        jrnl.close()
+
+        jrnl = self.open_journal()
+        self.assertEqual(dict(jrnl.iteritems()),
+                {'tracks-1': 9, 'tracks-2': -9, 'tracks-3': 3})
+        jrnl.close()
+
+    def test_compact_while_writing(self):
+        jrnl = self.open_journal(compact_min_size=0)
+        jrnl.write([('tracks-%d' % i, 0) for i in range(20)])
+
+        def compact():
+            for unused in range(20):
+                jrnl.compact()
+        thread = threading.Thread(target=compact)
+        thread.start()
+        for n in range(1, 51):
+            jrnl.write([('tracks-%d' % i, n) for i in range(20)],
+                    ['tracks-%d' % n])
+        thread.join()
+
+        self.assertEqual(jrnl.get('tracks-0'), 50)
+        jrnl.close()
+        jrnl = self.open_journal()
+        self.assertEqual(dict(jrnl.iteritems()),
+                dict(('tracks-%d' % i, 50) for i in range(20)))
+        jrnl.close()
+
+    def test_create_replaces_file(self):
+        jrnl = self.open_journal()
+        jrnl.write([('old', 1)])
+        jrnl.close()
+        jrnl = journal.TrackJournal.create(self.location, [('new', 2)])
+        self.assertEqual(jrnl.keys(), ['new'])
+        jrnl.close()
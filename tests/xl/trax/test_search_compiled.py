@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from xl.trax import search
+from xl.trax import track
+
+
+def clear_all_tracks():
+    for key in track.Track._Track__tracksdict.keys():
+        del track.Track._Track__tracksdict[key]
+
+
+def reference_match(matcher, srtrack):
+    """
+        How TracksMatcher.match evaluated its matchers before they were
+        compiled
+    """
+    for ma in matcher.matchers:
+        if not ma.match(srtrack):
+            break
+        if ma.tag is not None:
+            if ma.tag not in srtrack.on_tags:
+                srtrack.on_tags.append(ma.tag)
+        elif hasattr(ma, 'tags'):
+            for t in ma.tags:
+                if t not in srtrack.on_tags:
+                    srtrack.on_tags.append(t)
+    else:
+        return True
+    return False
+
+
+TAGS = [
+    {'artist': [u'Foo'], 'album': [u'Bar'], 'title': [u'Baz'],
+        'date': [u'1999'], '__playcount': 3},
+    {'artist': [u'foo bar', u'Other'], 'album': [u'The Album'],
+        'tracknumber': [u'4/12'], '__rating': 60.0},
+    {'artist': [u'Béla Fleck'], 'album': [u'Ünïcode'], 'title': [u'Æther'],
+        'date': [u'2010-05-01']},
+    {'album': [u'Bar'], 'title': [u'foo'], 'bpm': [u'128']},
+    {'artist': [u'FOO'], 'genre': [u'Rock', u'Pop'], '__length': 241.5},
+    {},
+]
+
+QUERIES = [
+    u'foo', u'FOO', u'bar', u'foo bar', u'"foo bar"', u'bela', u'béla',
+    u'artist==foo', u'artist==Foo', u'artist=oo', u'artist==__null__',
+    u'title==__null__', u'album=bar', u'! foo', u'! artist=foo',
+    u'foo | baz', u'( foo | album=album ) ! title=baz',
+    u'artist~^f', u'artist~"^foo b"', u'artist~r$', u'album~^ü',
+    u'date>2000', u'date<2000', u'date<"x"', u'__playcount>2',
+    u'__playcount<1', u'__rating==60', u'__length>200', u'__length<100',
+    u'tracknumber==4', u'tracknumber>3', u'bpm>100', u'bpm<100',
+    u'genre==rock', u'genre==pop', u'unicode', u'aether', u'æther',
+    u'', u'__loc~t', u'title=~', u'artist==',
+]
+
+KEYWORD_TAGS = ['artist', 'album', 'title']
+
+
+class TestCompiledMatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tracks = []
+        for i, tags in enumerate(TAGS):
+            tr = track.Track('file:///compiled/%d.ogg' % i)
+            for tag, values in tags.iteritems():
+                tr.set_tag_raw(tag, values)
+            self.tracks.append(tr)
+
+    def tearDown(self):
+        clear_all_tracks()
+
+    def assertEquivalent(self, matcher):
+        for tr in self.tracks:
+            expected = search.SearchResultTrack(tr)
+            result = search.SearchResultTrack(tr)
+            expected_match = reference_match(matcher, expected)
+            # twice, the second time uses values memoized on the track
+            for unused in range(2):
+                result.on_tags = []
+                self.assertEqual(matcher.match(result), expected_match,
+                        (tr.list_tags(), matcher.matchers))
+            if expected_match:
+                self.assertEqual(sorted(result.on_tags),
+                        sorted(expected.on_tags))
+
+    def test_queries(self):
+        for query in QUERIES:
+            for case_sensitive in (True, False):
+                matcher = search.TracksMatcher(query,
+                        case_sensitive=case_sensitive,
+                        keyword_tags=KEYWORD_TAGS)
+                self.assertEquivalent(matcher)
+
+    def test_tracks_in_list(self):
+        matcher = search.TracksMatcher(u'foo', case_sensitive=False,
+                keyword_tags=KEYWORD_TAGS)
+        matcher.append_matcher(search.TracksInList(self.tracks[:3]))
+        self.assertEquivalent(matcher)
+        matcher.prepend_matcher(search.TracksNotInList(self.tracks[1:2]),
+                or_match=True)
+        self.assertEquivalent(matcher)
+
+    def test_tag_change_invalidates(self):
+        matcher = search.TracksMatcher(u'artist=qux', case_sensitive=False)
+        srtr = search.SearchResultTrack(self.tracks[0])
+        self.assertFalse(matcher.match(srtr))
+        self.tracks[0].set_tag_raw('artist', u'Qux')
+        self.assertTrue(matcher.match(srtr))
+
+    def test_custom_matcher(self):
+        class Matcher(object):
+            tag = 'custom'
+            def __init__(self, result):
+                self.result = result
+            def match(self, srtrack):
+                return self.result
+        for result in (True, False):
+            matcher = search.TracksMatcher(u'album=bar',
+                    case_sensitive=False)
+            matcher.append_matcher(Matcher(result))
+            self.assertEquivalent(matcher)
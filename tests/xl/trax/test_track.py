@@ -19,6 +19,7 @@ except ImportError:
 
 import xl.trax.track as track
 import xl.settings as settings
+import xl.common as common
 
 from tests.xl.trax import test_data
 
@@ -433,6 +434,63 @@ class TestTrack(unittest.TestCase):
         tr.set_tag_raw('coverart', u'foobar')
         self.assertEqual(tr.get_tag_sort('coverart'), ret)
 
+    def test_pooled_values_shared(self):
+        tr1 = track.Track('/foo')
+        tr2 = track.Track('/bar')
+        tr1.set_tag_raw('genre', u'Rock')
+        tr2.set_tag_raw('genre', u''.join([u'Ro', u'ck']))
+        self.assertTrue(tr1.get_tag_raw('genre')[0] is
+                tr2.get_tag_raw('genre')[0])
+
+    def test_value_pool_bounded(self):
+        pool = track._value_pool
+        track._value_pool = common.LRUCache(2)
+        try:
+            tr = track.Track('/foo')
+            tr.set_tag_raw('genre', u'Rock')
+            tr.set_tag_raw('album', u'Foo')
+            tr.set_tag_raw('artist', u'Bar')
+            self.assertEqual(sorted(track._value_pool.keys()),
+                    [u'Bar', u'Foo'])
+            self.assertEqual(tr.get_tag_raw('genre'), [u'Rock'])
+        finally:
+            track._value_pool = pool
+
+    def test_unpickles_pooled(self):
+        tr1 = track.Track(_unpickles={'__loc': u'file:///foo',
+            'album': [u'Foo'], 'title': [u'Bar']})
+        tr2 = track.Track(_unpickles={'__loc': u'file:///bar',
+            'album': [u''.join([u'F', u'oo'])], 'title': [u'Bar']})
+        self.assertTrue(tr1.get_tag_raw('album')[0] is
+                tr2.get_tag_raw('album')[0])
+        self.assertEqual(tr2.get_tag_raw('title'), [u'Bar'])
+
+    def test_get_sort_tag_cached(self):
+        tr = track.Track('/foo')
+        tr.set_tag_raw('artist', u'foo')
+        self.assertEqual(tr.get_tag_sort('artist'), u'foo foo foo foo')
+        self.mox.StubOutWithMock(track.Track, 'format_sort')
+        self.mox.ReplayAll()
+        self.assertEqual(tr.get_tag_sort('artist'), u'foo foo foo foo')
+        self.mox.VerifyAll()
+
+    def test_get_sort_tag_set_tag_raw(self):
+        tr = track.Track('/foo')
+        tr.set_tag_raw('artist', u'foo')
+        self.assertEqual(tr.get_tag_sort('albumartist'), u'foo foo foo foo')
+        tr.set_tag_raw('artist', u'bar')
+        self.assertEqual(tr.get_tag_sort('albumartist'), u'bar bar bar bar')
+
+    def test_get_sort_tag_cuts_changed(self):
+        tr = track.Track('/foo')
+        tr.set_tag_raw('artist', u'the foo')
+        self.assertEqual(tr.get_tag_sort('artist'),
+                u'foo the foo the foo the foo')
+        settings.set_option('collection/strip_list', [])
+        track.Track._the_cuts_cb(None, None, 'collection/strip_list')
+        self.assertEqual(tr.get_tag_sort('artist'),
+                u'the foo the foo the foo the foo')
+
     ## Display Tags
     def test_get_display_tag_loc(self):
         tr = track.Track('/foo')
@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from xl import event
+from xl.trax import track
+from xl.trax import trackdb
+
+
+def clear_all_tracks():
+    for key in track.Track._Track__tracksdict.keys():
+        del track.Track._Track__tracksdict[key]
+
+
+class TestTrackDBChanges(unittest.TestCase):
+
+    def setUp(self):
+        self.db = trackdb.TrackDB()
+        self.tracks = [track.Track('file:///trackdb/%d.ogg' % i)
+                for i in range(10)]
+        self.events = []
+        event.add_callback(self.on_event, 'tracks_added', self.db)
+        event.add_callback(self.on_event, 'tracks_removed', self.db)
+
+    def tearDown(self):
+        event.remove_callback(self.on_event, 'tracks_added', self.db)
+        event.remove_callback(self.on_event, 'tracks_removed', self.db)
+        clear_all_tracks()
+
+    def on_event(self, type, db, locations):
+        self.events.append((type, sorted(locations)))
+
+    def locs(self, tracks):
+        return sorted(tr.get_loc_for_io() for tr in tracks)
+
+    def test_add_tracks_single_event(self):
+        self.db.add_tracks(self.tracks)
+        self.assertEqual(self.events,
+                [('tracks_added', self.locs(self.tracks))])
+        self.assertEqual(self.db.get_count(), 10)
+
+    def test_readd_gets_new_key(self):
+        self.db.add_tracks(self.tracks[:1])
+        key = self.db.tracks[self.tracks[0].get_loc_for_io()]._key
+        self.db.add_tracks(self.tracks[:1])
+        self.assertEqual(self.db._deleted_keys, [key])
+        self.assertEqual(self.db.get_count(), 1)
+
+    def test_remove_tracks_single_event(self):
+        self.db.add_tracks(self.tracks)
+        del self.events[:]
+        self.db.remove_tracks(self.tracks[:4] + [track.Track('file:///x')])
+        self.assertEqual(self.events,
+                [('tracks_removed', self.locs(self.tracks[:4]))])
+        self.assertEqual(self.db.get_count(), 6)
+
+    def test_transaction(self):
+        self.db.add_tracks(self.tracks[:5])
+        del self.events[:]
+        with self.db.transaction():
+            with self.db.transaction():
+                self.db.add_tracks(self.tracks[5:8])
+            self.db.add(self.tracks[8])
+            self.db.remove_tracks(self.tracks[:2])
+            # added and removed again: never reported
+            self.db.remove(self.tracks[8])
+            self.assertEqual(self.events, [])
+        self.assertEqual(self.events, [
+                ('tracks_removed', self.locs(self.tracks[:2])),
+                ('tracks_added', self.locs(self.tracks[5:8]))])
+
+    def test_transaction_remove_and_readd(self):
+        self.db.add_tracks(self.tracks[:2])
+        del self.events[:]
+        with self.db.transaction():
+            self.db.remove(self.tracks[0])
+            self.db.add(self.tracks[0])
+            self.db.add(self.tracks[1])
+            self.db.remove(self.tracks[1])
+        self.assertEqual(self.events, [
+                ('tracks_removed', self.locs(self.tracks[:2])),
+                ('tracks_added', self.locs(self.tracks[:1]))])
+
+    def test_transaction_error_still_commits(self):
+        try:
+            with self.db.transaction():
+                self.db.add_tracks(self.tracks[:3])
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(self.events,
+                [('tracks_added', self.locs(self.tracks[:3]))])
+        self.assertEqual(self.db._transaction_depth, 0)
+
+
+class TestTrackDBStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.location = os.path.join(self.tempdir, 'music.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        clear_all_tracks()
+
+    def test_save_and_load(self):
+        db = trackdb.TrackDB('test', location=self.location)
+        db.add_tracks([track.Track('file:///trackdb/%d.ogg' % i)
+                for i in range(3)])
+        db.save_to_location()
+
+        # the attributes of a database are not shared with others
+        trackdb.TrackDB('other')
+        db = trackdb.TrackDB('test', location=self.location)
+        self.assertEqual(db.pickle_attrs, ['tracks', 'name', '_key'])
+        self.assertEqual(db.get_count(), 3)
@@ -0,0 +1,7 @@
+"""
+    Micro-benchmarks for performance sensitive parts of Exaile.
+
+    Run them from the top of the source tree, e.g.::
+
+        python -m tools.benchmarks.trackdb_storage
+"""
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+    Measures BPM detection of generated songs with the bpm plugin's
+    batch thread, using 1 up to the given number of parallel pipelines.
+
+    Requires GStreamer with the bpmdetect and wavenc elements.
+
+    Usage: python -m tools.benchmarks.bpm_detection [jobs] [tracks]
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from gi.repository import Gst
+
+from xl.trax import track
+
+DEFAULT_JOBS = 4
+DEFAULT_TRACKS = 16
+TRACK_SECONDS = 30
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'plugins', 'bpm'))
+import bpmbatch
+
+
+class BenchmarkThread(bpmbatch.BPMDetectThread):
+    """
+        Keeps the results instead of writing them to the files
+    """
+    def _store(self, batch):
+        self.detected += len(batch)
+
+
+def make_tracks(directory, count):
+    tracks = []
+    for i in range(count):
+        path = os.path.join(directory, '%02d.wav' % i)
+        # ticks give the detector something to find
+        pipe = Gst.parse_launch('audiotestsrc wave=ticks freq=%d '
+                'num-buffers=%d ! audioconvert ! wavenc ! '
+                'filesink location="%s"' % (1 + i % 3,
+                TRACK_SECONDS * 44100 // 1024, path))
+        pipe.set_state(Gst.State.PLAYING)
+        pipe.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE,
+                Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        pipe.set_state(Gst.State.NULL)
+        tracks.append(track.Track(path, scan=False))
+    return tracks
+
+
+def main(argv):
+    jobs = int(argv[1]) if len(argv) > 1 else DEFAULT_JOBS
+    count = int(argv[2]) if len(argv) > 2 else DEFAULT_TRACKS
+    Gst.init(None)
+    directory = tempfile.mkdtemp()
+    try:
+        tracks = make_tracks(directory, count)
+        audio = count * TRACK_SECONDS
+        for n in range(1, jobs + 1):
+            thread = BenchmarkThread(tracks, job_count=n)
+            start = time.time()
+            thread.run()
+            elapsed = time.time() - start
+            print("%2d pipelines %8.2fs   %6.1fx realtime" % (n, elapsed,
+                    audio / elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
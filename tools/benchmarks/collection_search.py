@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+    Compares searching a collection by scanning every track with
+    searching it through the tag index of xl.trax.TrackDB.
+
+    For each collection size this reports the median latency of a few
+    typical panel searches, with and without the index. The first
+    indexed search of a tag also builds the index for that tag; that
+    cost is reported separately.
+
+    Usage: python -m tools.benchmarks.collection_search [size ...]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from xl.trax import search
+from xl.trax.track import Track
+from xl.trax.trackdb import TrackDB
+
+DEFAULT_SIZES = (10000, 100000)
+REPEAT = 5
+KEYWORD_TAGS = ['artist', 'albumartist', 'album', 'title']
+
+QUERIES = [
+    u'artist=="Artist 42"',
+    u'album="Album 12"',
+    u'artist~"^artist 7"',
+    u'genre==Jazz date==1999',
+    u'title=title 123',
+]
+
+
+def make_tracks(size):
+    tracks = []
+    for i in xrange(size):
+        tr = Track(u'file:///music/Artist %d/Album %d/%02d - Title %d.ogg'
+                % (i // 120, i // 12, i % 12, i), scan=False)
+        tr.set_tag_raw('artist', [u'Artist %d' % (i // 120)])
+        tr.set_tag_raw('album', [u'Album %d' % (i // 12)])
+        tr.set_tag_raw('title', [u'Title %d' % i])
+        tr.set_tag_raw('genre', [(u'Rock', u'Jazz', u'Pop')[i % 3]])
+        tr.set_tag_raw('date', [u'%d' % (1970 + i % 40)])
+        tracks.append(tr)
+    return tracks
+
+
+def timed_search(trackiter, query):
+    matchers = [search.TracksMatcher(query, case_sensitive=False,
+            keyword_tags=KEYWORD_TAGS)]
+    start = time.time()
+    for unused in search.search_tracks(trackiter, matchers):
+        pass
+    return time.time() - start
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def run(size):
+    tracks = make_tracks(size)
+    db = TrackDB()
+    db.add_tracks(tracks)
+
+    print("%d tracks" % size)
+    for query in QUERIES:
+        first = timed_search(db, query)
+        linear = median([timed_search(iter(tracks), query)
+                for unused in xrange(REPEAT)])
+        indexed = median([timed_search(db, query)
+                for unused in xrange(REPEAT)])
+        print("  %-26s linear %8.4fs   indexed %8.4fs   (first %.4fs)"
+                % (query, linear, indexed, first))
+
+
+def main(argv):
+    sizes = [int(a) for a in argv[1:]] or DEFAULT_SIZES
+    for size in sizes:
+        run(size)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
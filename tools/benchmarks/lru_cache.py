@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+    Compares xl.common.LRUCache with the deque based LimitedCache it
+    replaced.
+
+    For each cache size this reports the time per lookup and per
+    insertion, with keys drawn so that about 80% of the lookups hit.
+
+    Usage: python -m tools.benchmarks.lru_cache [size ...]
+"""
+
+from __future__ import print_function
+
+import random
+import sys
+import time
+from collections import deque
+from UserDict import DictMixin
+
+from xl import common
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+OPERATIONS = 100000
+
+
+class DequeCache(DictMixin):
+    """
+        The former xl.common.LimitedCache
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.order = deque()
+        self.cache = dict()
+
+    def __getitem__(self, item):
+        val = self.cache[item]
+        self.order.remove(item)
+        self.order.append(item)
+        return val
+
+    def __setitem__(self, item, value):
+        self.cache[item] = value
+        if item in self.order:
+            self.order.remove(item)
+        self.order.append(item)
+        while len(self.cache) > self.limit:
+            del self.cache[self.order.popleft()]
+
+    def keys(self):
+        return self.cache.keys()
+
+
+def run_ops(cache, keys):
+    start = time.time()
+    for key in keys:
+        try:
+            cache[key]
+        except KeyError:
+            cache[key] = key
+    return (time.time() - start) / len(keys)
+
+
+def run(size):
+    rnd = random.Random(size)
+    # 80% of the keys come from a working set that fits in the cache
+    keys = [rnd.randrange(size) if rnd.random() < 0.8
+            else rnd.randrange(size, size * 10) for i in xrange(OPERATIONS)]
+
+    old = run_ops(DequeCache(size), keys)
+    new = run_ops(common.LRUCache(size), keys)
+    print("%6d items   deque %8.2fus   LRUCache %8.2fus   %6.1fx" % (
+            size, old * 1e6, new * 1e6, old / new))
+
+
+def main(argv):
+    sizes = [int(a) for a in argv[1:]] or DEFAULT_SIZES
+    for size in sizes:
+        run(size)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
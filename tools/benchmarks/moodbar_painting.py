@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+    Measures painting moodbar data to a Cairo surface with the moodbar
+    plugin's painter, against copying the pixels one at a time.
+
+    Requires pycairo.
+
+    Usage: python -m tools.benchmarks.moodbar_painting [calls]
+"""
+
+from __future__ import print_function
+
+import os
+import random
+import sys
+import time
+
+import cairo
+
+DEFAULT_CALLS = 1000
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'plugins', 'moodbar'))
+import painter
+
+
+class PixelMoodbarPainter(painter.MoodbarPainter):
+    """
+        Copies every pixel separately
+    """
+    def paint(self, data):
+        surf = cairo.ImageSurface(cairo.FORMAT_RGB24, 1000, 1)
+        arr = surf.get_data()
+        for p in xrange(0, 1000):
+            p4 = p * 4
+            p3 = p * 3
+            arr[p4 + 0] = data[p3 + 2]
+            arr[p4 + 1] = data[p3 + 1]
+            arr[p4 + 2] = data[p3 + 0]
+        return surf
+
+
+def per_call(moodbar_painter, data, calls):
+    start = time.time()
+    for i in xrange(calls):
+        moodbar_painter.paint(data)
+    return (time.time() - start) / calls
+
+
+def main(argv):
+    calls = int(argv[1]) if len(argv) > 1 else DEFAULT_CALLS
+    data = bytes(bytearray(random.randrange(256) for i in xrange(3000)))
+    old_painter = PixelMoodbarPainter()
+    new_painter = painter.MoodbarPainter()
+    if old_painter.paint(data).get_data()[:] != \
+            new_painter.paint(data).get_data()[:]:
+        print("painters disagree")
+        return
+    old = per_call(old_painter, data, calls)
+    new = per_call(new_painter, data, calls)
+    print("per pixel %8.1fus   bulk %8.1fus   %6.1fx" % (old * 1e6,
+            new * 1e6, old / new))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+    Measures reading and writing xl.playlist.Playlist files.
+
+    For each number of tracks this reports the time to load a playlist
+    with all its tracks, to load it lazily (attributes only), to save
+    it in full and to save it after appending a single track.
+
+    Usage: python -m tools.benchmarks.playlist_files [tracks ...]
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from xl import playlist
+from xl.trax import track
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+
+def make_tracks(count):
+    tracks = []
+    for i in xrange(count):
+        tr = track.Track('file:///benchmark/%d.ogg' % i)
+        tr.set_tag_raw('title', [u'Title %d' % i])
+        tr.set_tag_raw('artist', [u'Artist %d' % (i % 50)])
+        tracks.append(tr)
+    return tracks
+
+
+def timed(function, *args):
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+
+def load(location, lazy):
+    playlist.Playlist('benchmark').load_from_location(location, lazy)
+
+
+def run(count, location):
+    pl = playlist.Playlist('benchmark', make_tracks(count))
+    full_save = timed(pl.save_to_location, location)
+    pl.append(track.Track('file:///benchmark/extra.ogg'))
+    append_save = timed(pl.save_to_location, location)
+    full_load = timed(load, location, False)
+    lazy_load = timed(load, location, True)
+    print("%6d tracks   load %8.2fms   lazy load %8.2fms   "
+          "save %8.2fms   save appended %8.2fms" % (count, full_load * 1e3,
+            lazy_load * 1e3, full_save * 1e3, append_save * 1e3))
+
+
+def main(argv):
+    sizes = [int(a) for a in argv[1:]] or DEFAULT_SIZES
+    tempdir = tempfile.mkdtemp()
+    try:
+        for size in sizes:
+            run(size, os.path.join(tempdir, 'playlist%d' % size))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
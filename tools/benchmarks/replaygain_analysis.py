@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+    Measures ReplayGain analysis of an album with the replaygain
+    plugin's analysis thread, using 1 up to the given number of
+    parallel pipelines.
+
+    The album is made of generated WAV files, so GStreamer with the
+    rganalysis and wavenc elements is required.
+
+    Usage: python -m tools.benchmarks.replaygain_analysis [jobs] [tracks]
+"""
+
+from __future__ import print_function
+
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from gi.repository import Gst
+
+from xl.trax import track
+
+DEFAULT_JOBS = 4
+DEFAULT_TRACKS = 16
+# length of a generated track, in buffers of 1024 samples
+TRACK_BUFFERS = 44100 * 30 // 1024
+
+analysis = imp.load_source('replaygain_analysis', os.path.join(
+    os.path.dirname(__file__), '..', '..', 'plugins', 'replaygain',
+    'analysis.py'))
+
+
+def make_tracks(directory, count):
+    tracks = []
+    for i in range(count):
+        path = os.path.join(directory, '%02d.wav' % i)
+        pipe = Gst.parse_launch('audiotestsrc wave=%d num-buffers=%d ! '
+                'audioconvert ! wavenc ! filesink location="%s"' % (
+                i % 10, TRACK_BUFFERS, path))
+        pipe.set_state(Gst.State.PLAYING)
+        pipe.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE,
+                Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        pipe.set_state(Gst.State.NULL)
+        tr = track.Track(path, scan=False)
+        tr.set_tag_raw('album', u'Benchmark')
+        tracks.append(tr)
+    return tracks
+
+
+def clear_results(tracks):
+    for tr in tracks:
+        for tag in (analysis.TRACK_GAIN, analysis.TRACK_PEAK,
+                    analysis.ALBUM_GAIN, analysis.ALBUM_PEAK):
+            tr.set_tag_raw(tag, None)
+
+
+def run(tracks, albums, jobs):
+    clear_results(tracks)
+    thread = analysis.AnalysisThread(analysis.get_jobs(tracks, albums),
+                                     job_count=jobs)
+    start = time.time()
+    thread.run()
+    return time.time() - start
+
+
+def main(argv):
+    jobs = int(argv[1]) if len(argv) > 1 else DEFAULT_JOBS
+    count = int(argv[2]) if len(argv) > 2 else DEFAULT_TRACKS
+    Gst.init(None)
+    directory = tempfile.mkdtemp()
+    try:
+        tracks = make_tracks(directory, count)
+        album = run(tracks, True, 1)
+        print("album, one pipeline  %8.2fs" % album)
+        for n in range(1, jobs + 1):
+            elapsed = run(tracks, False, n)
+            print("tracks, %2d pipelines %8.2fs   %6.1fx" % (n, elapsed,
+                    album / elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+    Measures xl.settings.SettingsManager.get_option for the kinds of
+    values options have.
+
+    For each kind this reports the time per call when every call
+    decodes the stored string (as before values were cached) and
+    with the cache of decoded values.
+
+    Usage: python -m tools.benchmarks.settings_options [calls]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from xl import settings
+
+DEFAULT_CALLS = 100000
+VALUES = (
+    ('int', 42),
+    ('bool', True),
+    ('unicode', u'${artist} - ${title}'),
+    ('list', [u'tracknumber', u'title', u'artist', u'album', u'__length']),
+    ('dict', {'width': 200, 'columns': [u'title', u'artist']}),
+)
+
+
+class UncachedSettingsManager(settings.SettingsManager):
+    """
+        Decodes the value on every call
+    """
+    def get_option(self, option, default=None):
+        self._cache.clear()
+        return settings.SettingsManager.get_option(self, option, default)
+
+
+def per_call(manager, option, calls):
+    get_option = manager.get_option
+    start = time.time()
+    for i in xrange(calls):
+        get_option(option)
+    return (time.time() - start) / calls
+
+
+def main(argv):
+    calls = int(argv[1]) if len(argv) > 1 else DEFAULT_CALLS
+    uncached = UncachedSettingsManager(None)
+    cached = settings.SettingsManager(None)
+    for name, value in VALUES:
+        option = 'benchmark/%s' % name
+        uncached.set_option(option, value)
+        cached.set_option(option, value)
+        old = per_call(uncached, option, calls)
+        new = per_call(cached, option, calls)
+        print("%-8s decoded %8.2fus   cached %8.2fus   %6.1fx" % (name,
+                old * 1e6, new * 1e6, old / new))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+    Measures the cost of formatting tracks with
+    xl.formatter.TrackFormatter.
+
+    For each number of tracks this reports the time per track when the
+    format is parsed on every call (as before formats were compiled),
+    when calling format() for each track and when formatting all tracks
+    with format_tracks().
+
+    Usage: python -m tools.benchmarks.track_formatting [tracks ...]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from xl import formatter
+from xl.trax import track
+
+DEFAULT_SIZES = (100, 1000, 10000)
+FORMATS = (
+    u'$tracknumber',
+    u'$title',
+    u'${artist:compilate}',
+    u'$album',
+    u'$__length',
+    u'${tracknumber:pad=2, padstring=0} - $title (${artist:prefix=by })',
+)
+
+
+class UncompiledFormatter(formatter.TrackFormatter):
+    """
+        Parses the format for every track
+    """
+    def format(self, track, markup_escape=False):
+        self._plan = None
+        return formatter.TrackFormatter.format(self, track, markup_escape)
+
+
+def make_tracks(count):
+    tracks = []
+    for i in xrange(count):
+        tr = track.Track('file:///benchmark/%d.ogg' % i)
+        tr.set_tag_raw('title', [u'Title %d' % i])
+        tr.set_tag_raw('artist', [u'Artist %d' % (i % 50)])
+        tr.set_tag_raw('album', [u'Album %d' % (i % 200)])
+        tr.set_tag_raw('tracknumber', [u'%d/12' % (i % 12 + 1)])
+        tr.set_tag_raw('__length', 180 + i % 120)
+        tracks.append(tr)
+    return tracks
+
+
+def per_track(function, tracks):
+    start = time.time()
+    for format in FORMATS:
+        function(format, tracks)
+    return (time.time() - start) / len(tracks)
+
+
+def uncompiled(format, tracks):
+    f = UncompiledFormatter(format)
+    return [f.format(tr) for tr in tracks]
+
+
+def compiled(format, tracks):
+    f = formatter.TrackFormatter(format)
+    return [f.format(tr) for tr in tracks]
+
+
+def batch(format, tracks):
+    return formatter.TrackFormatter(format).format_tracks(tracks)
+
+
+def run(count):
+    tracks = make_tracks(count)
+    old = per_track(uncompiled, tracks)
+    single = per_track(compiled, tracks)
+    many = per_track(batch, tracks)
+    print("%6d tracks   parsed %8.2fus   format %8.2fus   "
+          "format_tracks %8.2fus   %5.1fx" % (count, old * 1e6,
+            single * 1e6, many * 1e6, old / many))
+
+
+def main(argv):
+    sizes = [int(a) for a in argv[1:]] or DEFAULT_SIZES
+    for size in sizes:
+        run(size)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
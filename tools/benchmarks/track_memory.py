@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+    Measures how much memory tracks loaded from a database take.
+
+    Synthetic track records are restored the same way TrackDB.load
+    restores them, and the growth of the resident set size is reported
+    per track. Pass --no-pool to disable value pooling and see how much
+    it saves.
+
+    Usage: python -m tools.benchmarks.track_memory [--no-pool] [size]
+"""
+
+from __future__ import print_function
+
+import gc
+import os
+import resource
+import sys
+
+from xl.trax import track
+from xl.trax.trackdb import TrackHolder
+
+DEFAULT_SIZE = 200000
+GENRES = [u'Rock', u'Pop', u'Jazz', u'Classical', u'Electronic', u'Folk']
+
+
+def make_tags(i):
+    # unpickled records never share strings, so build new ones
+    artist = u'Artist %d' % (i // 120)
+    album = u'Album %d' % (i // 12)
+    return {
+        '__loc': u'file:///music/%s/%s/%02d - Title %d.ogg' % (
+            artist, album, i % 12, i),
+        'artist': [artist],
+        'albumartist': [u'Artist %d' % (i // 120)],
+        'album': [album],
+        'title': [u'Title %d' % i],
+        'tracknumber': [u'%d/12' % (i % 12 + 1)],
+        'genre': [GENRES[i % len(GENRES)] + u''],
+        'date': [u'%d' % (1970 + (i // 12) % 40)],
+        '__length': 241.5,
+        '__bitrate': 192000,
+        '__modified': 1300000000.0 + i,
+        '__date_added': 1300000000.0 + i,
+        '__basedir': '/music/Artist %d/Album %d' % (i // 120, i // 12),
+    }
+
+
+def rss():
+    """
+        Returns the current resident set size in bytes
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except IOError:
+        # peak value in kilobytes, good enough as memory only grows here
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def main(argv):
+    args = argv[1:]
+    if '--no-pool' in args:
+        args.remove('--no-pool')
+        track.POOLED_TAGS = frozenset()
+    size = int(args[0]) if args else DEFAULT_SIZE
+
+    gc.collect()
+    before = rss()
+    tracks = {}
+    for i in xrange(size):
+        tr = track.Track(_unpickles=make_tags(i))
+        tracks[tr.get_loc_for_io()] = TrackHolder(tr, i)
+    gc.collect()
+    used = rss() - before
+
+    print("%d tracks: %.1f MiB, %d bytes per track" % (
+        size, used / 1048576.0, used // size))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+    Compares the shelve storage formerly used by TrackDB with the
+    journal in xl.trax.journal.
+
+    For each collection size this reports the time needed for a full
+    save, for saving after 1% of the tracks changed, and for loading
+    every track record back.
+
+    Usage: python -m tools.benchmarks.trackdb_storage [size ...]
+"""
+
+from __future__ import print_function
+
+import os
+import shelve
+import shutil
+import sys
+import tempfile
+import time
+
+from xl import common
+from xl.trax import journal
+
+DEFAULT_SIZES = (10000, 100000, 500000)
+
+
+def make_record(i):
+    tags = {
+        '__loc': u'file:///music/Artist %d/Album %d/%02d - Title %d.ogg' % (
+            i // 120, i // 12, i % 12, i),
+        'artist': [u'Artist %d' % (i // 120)],
+        'albumartist': [u'Artist %d' % (i // 120)],
+        'album': [u'Album %d' % (i // 12)],
+        'title': [u'Title %d' % i],
+        'tracknumber': [u'%d/12' % (i % 12 + 1)],
+        'genre': [u'Rock'],
+        'date': [u'1999'],
+        '__length': 241.5,
+        '__bitrate': 192000,
+        '__modified': 1300000000.0 + i,
+        '__date_added': 1300000000.0 + i,
+        '__basedir': '/music/Artist %d/Album %d' % (i // 120, i // 12),
+    }
+    return ('tracks-%d' % i, (tags, i, {}))
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def shelve_save(location, records):
+    pdata = shelve.open(location, flag='c', protocol=common.PICKLE_PROTOCOL)
+    for key, value in records:
+        pdata[key] = value
+    pdata.sync()
+    pdata.close()
+
+
+def shelve_load(location):
+    pdata = shelve.open(location, flag='c', protocol=common.PICKLE_PROTOCOL)
+    for k in (x for x in pdata.keys() if x.startswith('tracks-')):
+        pdata[k]
+    pdata.close()
+
+
+def journal_save(location, records):
+    journal.TrackJournal.create(location, records).close()
+
+
+def journal_append(location, records):
+    jrnl = journal.TrackJournal(location)
+    jrnl.open()
+    jrnl.write(records)
+    jrnl.close()
+
+
+def journal_load(location):
+    jrnl = journal.TrackJournal(location)
+    jrnl.open()
+    for unused in jrnl.iteritems('tracks-'):
+        pass
+    jrnl.close()
+
+
+def run(size, tmpdir):
+    records = [make_record(i) for i in xrange(size)]
+    dirty = records[::100]
+
+    shelf = os.path.join(tmpdir, 'shelve-%d.db' % size)
+    jrnl = os.path.join(tmpdir, 'journal-%d.db' % size)
+
+    # the shelve backend rewrites changed keys in place, but TrackDB
+    # had to visit and pickle every dirty track on every save
+    results = [
+        ('full save', timed(shelve_save, shelf, records),
+                timed(journal_save, jrnl, records)),
+        ('1% dirty save', timed(shelve_save, shelf, dirty),
+                timed(journal_append, jrnl, dirty)),
+        ('load', timed(shelve_load, shelf), timed(journal_load, jrnl)),
+    ]
+
+    print("%d tracks" % size)
+    for name, old, new in results:
+        print("  %-14s shelve %8.3fs   journal %8.3fs" % (name, old, new))
+
+
+def main(argv):
+    sizes = [int(a) for a in argv[1:]] or DEFAULT_SIZES
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for size in sizes:
+            run(size, tmpdir)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
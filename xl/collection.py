@@ -40,11 +40,15 @@ from gi.repository import GLib
 from gi.repository import GObject
 from gi.repository import Gio
 import logging
+import multiprocessing
 import os
 import os.path
 import shutil
+import signal
+import sys
 import threading
 import time
+import traceback
 
 from xl.nls import gettext as _
 from xl import (
@@ -55,11 +59,26 @@ from xl import (
     trax,
     xdg
 )
+from xl.trax import journal
 
 logger = logging.getLogger(__name__)
 
 COLLECTIONS = set()
 
+#: The :class:`xl.covers.DirectoryImageCache` that is told about the
+#  images in the directories the scanner lists; set by :mod:`xl.covers`
+_image_cache = None
+
+def set_image_cache(cache):
+    """
+        Sets the cache of image files in directories that scans and the
+        library monitor keep up to date
+
+        :param cache: a :class:`xl.covers.DirectoryImageCache`, or None
+    """
+    global _image_cache
+    _image_cache = cache
+
 def get_collection_by_loc(loc):
     """
         gets the collection by a location.
@@ -73,6 +92,67 @@ def get_collection_by_loc(loc):
             return c
     return None
 
+def _get_mtime(fileinfo):
+    """
+        Returns the modification time stored in a :class:`Gio.FileInfo`
+        as a float, in the form stored in the '__modified' tag
+    """
+    mtime = fileinfo.get_modification_time()
+    return mtime.tv_sec + (mtime.tv_usec/100000.0)
+
+def _init_scan_worker():
+    """
+        Sets up a scan worker process
+    """
+    # interrupting exaile must not kill the workers halfway through
+    # a file; they are terminated when the scan ends
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _get_parent_uri(uri):
+    """
+        Returns the uri of the directory containing a file
+    """
+    return uri.rsplit('/', 1)[0]
+
+def _read_tags_worker(item):
+    """
+        Reads the tags of a file found by :meth:`Library.rescan`. This
+        runs in a scan worker process, so it must not use Gio or touch
+        any Track objects.
+
+        Workers are forked from a process that runs other threads, which
+        may have held locks at that time, so nothing is logged here
+        either; errors are sent back to the scan thread instead.
+
+        :param item: a (uri, path, mtime, is_dir, read, skipped) tuple,
+            see :meth:`Library._scan_items`
+        :returns: (item, tags, error) where tags is None if the file was
+            not read, False if it could not be read, and a (tags,
+            supported_tags) tuple otherwise (see
+            :meth:`xl.trax.Track._set_read_tags`). error is the
+            traceback of a failed read, or None.
+    """
+    uri, path, mtime, is_dir, read, skipped = item
+    if not read:
+        return item, None, None
+    try:
+        f = metadata.get_format_for_path(path)
+        if f is None:
+            return item, False, None
+        ntags = f.read_all()
+        # make sure the result survives the trip back to the scanner
+        for tag, values in ntags.iteritems():
+            if isinstance(values, list):
+                ntags[tag] = [v if isinstance(v, (basestring, int, long,
+                    float)) else unicode(v) for v in values]
+        if f.others:
+            supported_tags = None
+        else:
+            supported_tags = f.tag_mapping.keys()
+        return item, (ntags, supported_tags), None
+    except Exception:
+        return item, False, traceback.format_exc()
+
 class CollectionScanThread(common.ProgressThread):
     """
         Scans the collection
@@ -120,6 +200,176 @@ class CollectionScanThread(common.ProgressThread):
         else:
             self.emit('done')
 
+class DirectoryIndex(object):
+    """
+        Remembers the state of every directory of the libraries of a
+        :class:`Collection` as of the last scan: its modification time,
+        the number of entries, its subdirectories and the files it
+        contained.
+
+        A directory's modification time changes whenever entries are
+        added, removed or renamed in it, so the scan does not need to
+        list directories whose time did not change. Files that are
+        modified in place are noticed by the library monitor, or by a
+        forced rescan.
+
+        Files in indexed directories that turned out not to be tracks
+        are remembered too, so they do not force the directory to be
+        listed again.
+
+        The index is stored in a journal (see :mod:`xl.trax.journal`)
+        next to the collection, so that only directories that changed
+        are written when it is saved.
+    """
+    #: journal key of the non-track files; it cannot be a uri
+    NONTRACKS_KEY = 'nontracks'
+
+    def __init__(self, location=None):
+        """
+            :param location: the file to store the index in. If None,
+                the index is kept in memory only.
+        """
+        self.location = location
+        self._dirs = {}
+        # directory uri -> set of file uris
+        self._nontracks = {}
+        self._changed = set()
+        self._removed = set()
+        self._nontracks_changed = False
+        self._journal = None
+        self._lock = threading.RLock()
+        if location:
+            self.load()
+
+    def load(self):
+        """
+            Loads the index from its location
+        """
+        try:
+            self._journal = journal.TrackJournal(self.location)
+            self._journal.open()
+            self._dirs = dict(self._journal.iteritems())
+            for uri in self._dirs.pop(self.NONTRACKS_KEY, ()):
+                self._nontracks.setdefault(_get_parent_uri(uri),
+                        set()).add(uri)
+        except Exception:
+            logger.exception("Failed to load directory index, "
+                    "libraries will be fully rescanned")
+            if self._journal is not None:
+                self._journal.close()
+            self._journal = None
+            self._dirs = {}
+            self._nontracks = {}
+            try:
+                os.remove(self.location)
+            except OSError:
+                pass
+
+    def save(self):
+        """
+            Writes the directories that changed since the last save
+        """
+        with self._lock:
+            if not self.location or not (self._changed or
+                    self._removed or self._nontracks_changed):
+                return
+            puts = [(uri, self._dirs[uri]) for uri in self._changed]
+            if self._nontracks_changed:
+                puts.append((self.NONTRACKS_KEY, tuple(uri
+                        for files in self._nontracks.itervalues()
+                        for uri in files)))
+            deletes = list(self._removed)
+            self._changed = set()
+            self._removed = set()
+            self._nontracks_changed = False
+        try:
+            if self._journal is None:
+                self._journal = journal.TrackJournal(self.location)
+                self._journal.open()
+            self._journal.write(puts, deletes)
+            if self._journal.needs_compaction():
+                self._journal.compact()
+        except Exception:
+            logger.exception("Failed to save directory index")
+
+    def get(self, uri):
+        """
+            Returns the (mtime, entry count, subdirectory uris, file
+            uris) recorded for a directory, or None
+        """
+        return self._dirs.get(uri)
+
+    def set(self, uri, mtime, count, subdirs, files):
+        """
+            Records the state of a directory
+        """
+        with self._lock:
+            self._dirs[uri] = (mtime, count, tuple(subdirs), tuple(files))
+            self._changed.add(uri)
+            self._removed.discard(uri)
+            nontracks = self._nontracks.get(uri)
+            if nontracks and not nontracks.issubset(files):
+                nontracks.intersection_update(files)
+                self._nontracks_changed = True
+
+    def invalidate(self, uri):
+        """
+            Forgets a directory, so that it is listed again by the next
+            scan
+        """
+        with self._lock:
+            if self._dirs.pop(uri, None) is not None:
+                self._changed.discard(uri)
+                self._removed.add(uri)
+            # they are read again when the directory is listed
+            if self._nontracks.pop(uri, None):
+                self._nontracks_changed = True
+
+    def remove_tree(self, uri):
+        """
+            Forgets a directory and all its subdirectories
+        """
+        prefix = uri.rstrip('/') + '/'
+        with self._lock:
+            for key in [k for k in self._dirs
+                    if k == uri or k.startswith(prefix)]:
+                self.invalidate(key)
+
+    def add_nontrack(self, uri):
+        """
+            Records that a file in an indexed directory is not a track
+        """
+        with self._lock:
+            files = self._nontracks.setdefault(_get_parent_uri(uri), set())
+            if uri not in files:
+                files.add(uri)
+                self._nontracks_changed = True
+
+    def is_nontrack(self, uri):
+        """
+            Whether a file was found not to be a track
+        """
+        return uri in self._nontracks.get(_get_parent_uri(uri), ())
+
+    def count_entries(self, uri):
+        """
+            Returns the number of entries below a directory, as of the
+            last scan, or None if the directory is not indexed
+        """
+        entry = self._dirs.get(uri)
+        if entry is None:
+            return None
+        count = 1
+        pending = [entry]
+        while pending:
+            mtime, entries, subdirs, files = pending.pop()
+            count += entries
+            for sub in subdirs:
+                subentry = self._dirs.get(sub)
+                if subentry is not None:
+                    pending.append(subentry)
+        return count
+
 class Collection(trax.TrackDB):
     """
         Manages a persistent track database.
@@ -148,11 +398,24 @@ class Collection(trax.TrackDB):
         self._running_total_count = 0
         self._frozen = False
         self._libraries_dirty = False
-        pickle_attrs += ['_serial_libraries']
+        self.directory_index = DirectoryIndex(
+                location + '-dirs' if location else None)
+        pickle_attrs = pickle_attrs + ['_serial_libraries']
         trax.TrackDB.__init__(self, name, location=location,
                 pickle_attrs=pickle_attrs)
         COLLECTIONS.add(self)
 
+    def save_to_location(self, location=None):
+        """
+            Saves the collection, and the index of its directories
+            if it is saved to its own location.
+
+            See :meth:`xl.trax.TrackDB.save_to_location`
+        """
+        trax.TrackDB.save_to_location(self, location)
+        if not location or location == self.location:
+            self.directory_index.save()
+
     def freeze_libraries(self):
         """
             Prevents "libraries_modified" events from being sent from individual
@@ -217,6 +480,8 @@ class Collection(trax.TrackDB):
             if tr.startswith(location):
                 to_rem.append(self.tracks[tr]._track)
         self.remove_tracks(to_rem)
+        self.directory_index.remove_tree(
+                Gio.File.new_for_uri(library.location).get_uri())
 
         self.serialize_libraries()
         self._dirty = True
@@ -457,6 +722,14 @@ class LibraryMonitor(GObject.GObject):
         """
             Updates the library on changes of the location
         """
+        # make sure the next scan looks at the directory again, even if
+        # its modification time did not change
+        index = self.__library.collection.directory_index
+        parent = gfile.get_parent()
+        if parent is not None:
+            index.invalidate(parent.get_uri())
+            if _image_cache is not None:
+                _image_cache.invalidate(parent.get_uri())
         
         if event == Gio.FileMonitorEvent.CHANGES_DONE_HINT:
             self.__process_change_queue(gfile)
@@ -502,6 +775,9 @@ class LibraryMonitor(GObject.GObject):
                         removed_tracks += [track]
 
             self.__library.collection.remove_tracks(removed_tracks)
+            index.remove_tree(gfile.get_uri())
+            if _image_cache is not None:
+                _image_cache.remove_tree(gfile.get_uri())
 
             # Remove obsolete monitors
             removed_directories = [d for d in self.__monitors \
@@ -532,6 +808,14 @@ class Library(object):
         5
         >>>
     """
+    #: number of new tracks to collect before adding them to the
+    #  collection during a rescan
+    add_batch_size = 200
+    #: number of files handed to a scan worker at once
+    worker_chunk_size = 16
+    #: number of chunks per worker that are read ahead of the scan
+    worker_read_ahead = 2
+
     def __init__(self, location, monitored=False, scan_interval=0, startup_scan=False):
         """
             Sets up the Library
@@ -554,6 +838,9 @@ class Library(object):
 
         self.collection = None
         self.set_rescan_interval(scan_interval)
+        self._scan_added = None
+        self._scan_seen = None
+        self._scan_failed = None
 
     def set_location(self, location):
         """
@@ -634,8 +921,15 @@ class Library(object):
         """
             Counts the number of files present in this directory
         """
+        libloc = Gio.File.new_for_uri(self.location)
+        if self.collection:
+            count = self.collection.directory_index.count_entries(
+                    libloc.get_uri())
+            if count is not None:
+                return count
+
         count = 0
-        for file in common.walk(Gio.File.new_for_uri(self.location)):
+        for file in common.walk(libloc):
             if self.collection:
                 if self.collection._scan_stopped:
                     break
@@ -699,7 +993,8 @@ class Library(object):
 
         ccheck[basedir][album].append(artist)
 
-    def update_track(self, gloc, force_update=False):
+    def update_track(self, gloc, force_update=False, mtime=None,
+            tags=None):
         """
             Rescan the track at a given location
 
@@ -707,36 +1002,245 @@ class Library(object):
             :type gloc: :class:`Gio.File`
             :param force_update: Force update of file (default only updates file
                                  when mtime has changed)
+            :param mtime: the modification time of the file, if it is
+                already known
+            :param tags: tags read by a scan worker (see
+                :func:`_read_tags_worker`). If None, the tags are read
+                from the file if needed.
 
             returns: the Track object, None if it could not be updated
         """
         uri = gloc.get_uri()
         if not uri: # we get segfaults if this check is removed
             return None
-        mtime = gloc.query_info("time::modified", Gio.FileQueryInfoFlags.NONE, None).get_modification_time()
-        mtime = mtime.tv_sec + (mtime.tv_usec/100000.0)
+        if mtime is None:
+            mtime = _get_mtime(gloc.query_info("time::modified",
+                Gio.FileQueryInfoFlags.NONE, None))
         tr = self.collection.get_track_by_loc(uri)
         if tr:
             if force_update or tr.get_tag_raw('__modified') < mtime:
-                tr.read_tags()
+                self._read_tags(tr, tags, mtime)
                 tr.set_tag_raw('__modified', mtime)
         else:
-            tr = trax.Track(uri)
+            tr = trax.Track(uri, scan=False)
+            if tr._init:
+                self._read_tags(tr, tags, mtime)
             if tr._scan_valid == True:
                 tr.set_tag_raw('__date_added', time.time())
-                self.collection.add(tr)
+                self._add_scanned_track(tr)
                 tr.set_tag_raw('__modified', mtime)
 
             # Track already existed. This fixes trax.get_tracks_from_uri
             # on windows, unknown why fix isnt needed on linux.
             elif not tr._init:
-                self.collection.add(tr)
+                self._add_scanned_track(tr)
         return tr
 
+    def _read_tags(self, tr, tags, mtime):
+        """
+            Updates a track with tags from a scan worker, or reads them
+            from the file if no worker read them
+        """
+        if tags is None:
+            tr.read_tags()
+        elif tags is False:
+            tr._scan_valid = False
+        else:
+            tr._set_read_tags(tags[0], tags[1], mtime)
+
+    def _add_scanned_track(self, tr):
+        """
+            Adds a track to the collection. During a rescan, tracks are
+            collected and added in batches.
+        """
+        if self._scan_added is None:
+            self.collection.add(tr)
+        else:
+            self._scan_added.append(tr)
+            if len(self._scan_added) >= self.add_batch_size:
+                self._flush_scanned_tracks()
+
+    def _flush_scanned_tracks(self):
+        if self._scan_added:
+            self.collection.add_tracks(self._scan_added)
+            self._scan_added = []
+
+    def _get_scan_workers(self):
+        """
+            Returns the number of worker processes to read tags with.
+            This is the 'collection/scan_workers' setting, or the number
+            of CPUs if it is 0.
+        """
+        workers = settings.get_option('collection/scan_workers', 0)
+        if workers <= 0:
+            # worker processes are not started on Windows unless they
+            # are explicitly requested
+            if sys.platform == 'win32':
+                return 1
+            try:
+                workers = multiprocessing.cpu_count()
+            except NotImplementedError:
+                workers = 1
+        return workers
+
+    def _read_in_pool(self, pool, workers, items):
+        """
+            Hands items from :meth:`_scan_items` to the scan workers in
+            chunks, and yields their results in walk order.
+
+            The items are produced on the calling thread, interleaved
+            with the processing of the results, and only a few chunks
+            per worker are read ahead of them.
+        """
+        pending = deque()
+        limit = max(1, workers * self.worker_read_ahead)
+        chunk = []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) < self.worker_chunk_size:
+                continue
+            pending.append(pool.map_async(_read_tags_worker, chunk))
+            chunk = []
+            if len(pending) >= limit:
+                for result in pending.popleft().get():
+                    yield result
+        if chunk:
+            pending.append(pool.map_async(_read_tags_worker, chunk))
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+
+    def _scan_items(self, libloc, force_update, read):
+        """
+            Walks the library and yields a (uri, path, mtime, is_dir,
+            read, skipped) tuple for every directory and regular file.
+
+            read is True for files whose tags need to be read, which
+            are files not in the collection yet, and files that changed
+            since they were last read (or all files if force_update is
+            set). Only local files are read by workers.
+
+            Directories that did not change since the last scan
+            according to the collection's :class:`DirectoryIndex` are
+            not listed again unless force_update is set; the number of
+            entries skipped this way is passed in skipped. All files
+            that are known to exist are added to self._scan_seen.
+        """
+        index = self.collection.directory_index
+        image_cache = _image_cache
+        try:
+            rootinfo = libloc.query_info(common.WALK_ATTRIBUTES,
+                    Gio.FileQueryInfoFlags.NONE, None)
+        except GLib.Error:
+            logger.warning("Could not read library location %s",
+                    self.location)
+            self._scan_failed.append(libloc.get_uri())
+            return
+
+        root = libloc
+        queue = deque()
+        queue.append((libloc, rootinfo))
+
+        while len(queue) > 0:
+            if self.collection._scan_stopped:
+                return
+            dir, dirinfo = queue.pop()
+            diruri = dir.get_uri()
+            dirmtime = _get_mtime(dirinfo)
+
+            entry = index.get(diruri)
+            if entry is not None and not force_update and \
+                    entry[0] == dirmtime and \
+                    all(self.collection.loc_is_member(f) or
+                        index.is_nontrack(f) for f in entry[3]):
+                unused, count, subdirs, files = entry
+                self._scan_seen.update(files)
+                for sub in subdirs:
+                    subfile = Gio.File.new_for_uri(sub)
+                    try:
+                        subinfo = subfile.query_info(common.WALK_ATTRIBUTES,
+                                Gio.FileQueryInfoFlags.NONE, None)
+                    except GLib.Error:
+                        # it was removed, but the directory's mtime did
+                        # not change. list the parent again next time.
+                        index.invalidate(diruri)
+                        index.remove_tree(sub)
+                        continue
+                    queue.append((subfile, subinfo))
+                yield (diruri, None, None, True, False, count)
+                continue
+
+            yield (diruri, None, None, True, False, 0)
+
+            count = 0
+            subdirs = []
+            files = []
+            images = []
+            try:
+                for fileinfo in dir.enumerate_children(common.WALK_ATTRIBUTES,
+                        Gio.FileQueryInfoFlags.NONE, None):
+                    count += 1
+                    fil = dir.get_child(fileinfo.get_name())
+                    # FIXME: recursive symlinks could cause an infinite loop
+                    if fileinfo.get_is_symlink():
+                        target = fileinfo.get_symlink_target()
+                        if not "://" in target and not os.path.isabs(target):
+                            fil2 = dir.get_child(target)
+                        else:
+                            fil2 = Gio.File.new_for_uri(target)
+                        # already in the collection, we'll get it anyway
+                        if fil2.has_prefix(root):
+                            continue
+                    type = fileinfo.get_file_type()
+                    if type == Gio.FileType.DIRECTORY:
+                        queue.append((fil, fileinfo))
+                        subdirs.append(fil.get_uri())
+                    elif type == Gio.FileType.REGULAR:
+                        uri = fil.get_uri()
+                        self._scan_seen.add(uri)
+                        name = fileinfo.get_name()
+                        ext = os.path.splitext(name)[1]
+                        if ext[1:].lower() in metadata.formats:
+                            files.append(uri)
+                        elif image_cache is not None and \
+                                image_cache.is_image(name):
+                            images.append(name)
+                        mtime = _get_mtime(fileinfo)
+                        path = None
+                        if read and uri:
+                            path = fil.get_path()
+                            tr = self.collection.get_track_by_loc(uri)
+                            if tr and not force_update and \
+                                    not tr.get_tag_raw('__modified') < mtime:
+                                path = None
+                        yield (uri, path, mtime, False, path is not None, 0)
+            except GLib.Error: # why doesnt gio offer more-specific errors?
+                logger.exception("Unhandled exception while walking on %s.",
+                        dir)
+                self._scan_failed.append(diruri)
+                index.invalidate(diruri)
+                continue
+
+            if entry is not None:
+                for sub in set(entry[2]) - set(subdirs):
+                    index.remove_tree(sub)
+            index.set(diruri, dirmtime, count, subdirs, files)
+            # saves listing the directory again to find its cover
+            if image_cache is not None:
+                image_cache.set(diruri, dirinfo, images)
+
     def rescan(self, notify_interval=None, force_update=False):
         """
             Rescan the associated folder and add the contained files
             to the Collection
+
+            Tags are read by a pool of worker processes (see
+            :meth:`_get_scan_workers`) while this thread walks the
+            directories; the results are applied to the collection in
+            walk order by this thread.
+
+            Unless force_update is set, directories that did not change
+            since the last scan are skipped (see :class:`DirectoryIndex`).
         """
         # TODO: use gio's cancellable support
         
@@ -748,88 +1252,133 @@ class Library(object):
 
         logger.info("Scanning library: %s", self.location)
         self.scanning = True
+
+        # listeners are told about all changes at once when the scan ends
+        with self.collection.transaction():
+            self._rescan(notify_interval, force_update)
+
+    def _rescan(self, notify_interval, force_update):
         db = self.collection
         libloc = Gio.File.new_for_uri(self.location)
 
+        self._scan_seen = set()
+        self._scan_failed = []
+
+        pool = None
+        workers = self._get_scan_workers()
+        if workers > 1:
+            try:
+                pool = multiprocessing.Pool(workers, _init_scan_worker)
+            except Exception:
+                logger.exception("Could not start scan workers")
+
+        if pool is None:
+            results = ((item, None, None) for item in
+                    self._scan_items(libloc, force_update, False))
+        else:
+            logger.debug("Reading tags with %d workers", workers)
+            results = self._read_in_pool(pool, workers,
+                    self._scan_items(libloc, force_update, True))
+
         count = 0
         dirtracks = deque()
         compilations = deque()
         ccheck = {}
-        for fil in common.walk(libloc):
-            count += 1
-            type = fil.query_info("standard::type", Gio.FileQueryInfoFlags.NONE, None).get_file_type()
-            if type == Gio.FileType.DIRECTORY:
-                if dirtracks:
-                    for tr in dirtracks:
-                        self._check_compilation(ccheck, compilations, tr)
-                    for (basedir, album) in compilations:
-                        base = basedir.replace('"', '\\"')
-                        alb = album.replace('"', '\\"')
-                        items = [ tr for tr in dirtracks if \
-                                tr.get_tag_raw('__basedir') == base and \
-                                # FIXME: this is ugly
-                                alb in "".join(
-                                    tr.get_tag_raw('album') or []).lower()
-                                ]
-                        for item in items:
-                            item.set_tag_raw('__compilation', (basedir, album))
-                dirtracks = deque()
-                compilations = deque()
-                ccheck = {}
-            elif type == Gio.FileType.REGULAR:
-                tr = self.update_track(fil, force_update=force_update)
-                if not tr:
-                    continue
-
-                if dirtracks is not None:
-                    dirtracks.append(tr)
-                    # do this so that if we have, say, a 4000-song folder
-                    # we dont get bogged down trying to keep track of them
-                    # for compilation detection. Most albums have far fewer
-                    # than 110 tracks anyway, so it is unlikely that this
-                    # restriction will affect the heuristic's accuracy.
-                    # 110 was chosen to accomodate "top 100"-style
-                    # compilations.
-                    if len(dirtracks) > 110:
-                        logger.info("Too many files, skipping "
-                                "compilation detection heuristic.")
-                        dirtracks = None
-
-            if self.collection and self.collection._scan_stopped:
-                self.scanning = False
-                logger.info("Scan canceled")
-                return
-
-            # progress update
-            if notify_interval is not None and count % notify_interval == 0:
-                event.log_event('tracks_scanned', self, count)
+        self._scan_added = []
+        try:
+            for item, tags, error in results:
+                uri, path, mtime, is_dir, read, skipped = item
+                count += 1 + skipped
+                if error is not None:
+                    logger.error("Error reading tags for %s\n%s", uri,
+                            error.rstrip())
+                if is_dir:
+                    if dirtracks:
+                        for tr in dirtracks:
+                            self._check_compilation(ccheck, compilations, tr)
+                        for (basedir, album) in compilations:
+                            base = basedir.replace('"', '\\"')
+                            alb = album.replace('"', '\\"')
+                            items = [ tr for tr in dirtracks if \
+                                    tr.get_tag_raw('__basedir') == base and \
+                                    # FIXME: this is ugly
+                                    alb in "".join(
+                                        tr.get_tag_raw('album') or []).lower()
+                                    ]
+                            for item in items:
+                                item.set_tag_raw('__compilation', (basedir, album))
+                    dirtracks = deque()
+                    compilations = deque()
+                    ccheck = {}
+                else:
+                    tr = self.update_track(Gio.File.new_for_uri(uri),
+                            force_update=force_update, mtime=mtime,
+                            tags=tags)
+                    if not tr:
+                        continue
+                    if not tr._scan_valid and not db.loc_is_member(uri):
+                        db.directory_index.add_nontrack(uri)
+
+                    if dirtracks is not None:
+                        dirtracks.append(tr)
+                        # do this so that if we have, say, a 4000-song folder
+                        # we dont get bogged down trying to keep track of them
+                        # for compilation detection. Most albums have far fewer
+                        # than 110 tracks anyway, so it is unlikely that this
+                        # restriction will affect the heuristic's accuracy.
+                        # 110 was chosen to accomodate "top 100"-style
+                        # compilations.
+                        if len(dirtracks) > 110:
+                            logger.info("Too many files, skipping "
+                                    "compilation detection heuristic.")
+                            dirtracks = None
+
+                if self.collection and self.collection._scan_stopped:
+                    self.scanning = False
+                    logger.info("Scan canceled")
+                    return
+
+                # progress update
+                if notify_interval is not None and count % notify_interval == 0:
+                    event.log_event('tracks_scanned', self, count)
+        finally:
+            self._flush_scanned_tracks()
+            self._scan_added = None
+            if pool is not None:
+                pool.terminate()
+                pool.join()
 
         # final progress update
         if notify_interval is not None:
             event.log_event('tracks_scanned', self, count)
 
+        # the walk ended early, so tracks that were not seen may exist
+        if self.collection._scan_stopped:
+            self._scan_seen = None
+            self._scan_failed = None
+            self.scanning = False
+            logger.info("Scan canceled")
+            return
+
 
 
+        # tracks that were not seen are gone, except where a directory
+        # could not be read
+        prefix = libloc.get_uri().rstrip('/') + '/'
+        failed = tuple(uri.rstrip('/') + '/' for uri in self._scan_failed)
         removals = deque()
-        for tr in self.collection.tracks.itervalues():
-            tr = tr._track
-            loc = tr.get_loc_for_io()
-            if not loc:
+        for loc, tr in self.collection.tracks.items():
+            if not loc.startswith(prefix) or loc in self._scan_seen:
                 continue
-            gloc = Gio.File.new_for_uri(loc)
-            try:
-                if not gloc.has_prefix(libloc):
-                    continue
-            except UnicodeDecodeError:
-                logger.exception("Error decoding file location")
+            if failed and loc.startswith(failed):
                 continue
-
-            if not gloc.query_exists(None):
-                removals.append(tr)
+            removals.append(tr._track)
+        self._scan_seen = None
+        self._scan_failed = None
 
         for tr in removals:
             logger.debug(u"Removing %s"%unicode(tr))
-            self.collection.remove(tr)
+        self.collection.remove_tracks(removals)
             
         logger.info("Scan completed: %s", self.location)
         self.scanning = False
@@ -39,8 +39,10 @@ import os
 import subprocess
 import sys
 import threading
+import time
 import urllib2
 import urlparse
+import weakref
 from functools import wraps, partial
 from collections import deque
 from UserDict import DictMixin
@@ -362,59 +364,271 @@ def open_file_directory(path_or_uri):
     else:
         subprocess.Popen(["xdg-open", f.get_parent().get_parse_name()])
 
-class LimitedCache(DictMixin):
+#: All :class:`LRUCache` objects that were given a name
+_NAMED_CACHES = weakref.WeakSet()
+
+def _sizeof(value):
     """
-        Simple cache that acts much like a dict, but has a maximum # of items
+        Default size function of :class:`LRUCache`
     """
-    def __init__(self, limit):
-        self.limit = limit
-        self.order = deque()
-        self.cache = dict()
+    if isinstance(value, basestring):
+        return len(value)
+    return sys.getsizeof(value)
 
-    def __iter__(self):
-        return self.cache.__iter__()
+# fields of the entries of the linked list of LRUCache
+_PREV, _NEXT, _KEY, _VALUE, _SIZE, _EXPIRES = range(6)
 
-    def __contains__(self, item):
-        return self.cache.__contains__(item)
+class LRUCache(DictMixin):
+    """
+        Cache that acts much like a dict, but discards the least
+        recently used items when it grows too large. All operations
+        take constant time, and the cache may be used from several
+        threads.
+
+        Items can also be limited to a time to live; expired items
+        are dropped when they are accessed, or when they are the
+        least recently used ones.
+
+        Iterating over the cache or listing its keys, values or
+        items does not change the order of use, and does not count
+        as a hit.
+    """
+    def __init__(self, limit=None, max_bytes=None, ttl=None, sizeof=None,
+            name=None):
+        """
+            :param limit: the maximum number of items, or None
+            :param max_bytes: the maximum total size of the values, or
+                None. Sizes are determined by sizeof.
+            :param ttl: the number of seconds after which items
+                expire, or None
+            :param sizeof: a function returning the size of a value,
+                the length of strings and :func:`sys.getsizeof`
+                otherwise by default
+            :param name: if given, the statistics of the cache are
+                included in :func:`get_cache_stats`
+        """
+        self.limit = limit
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof or _sizeof
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.size = 0
+        self._lock = threading.Lock()
+        self._links = {}
+        # circular doubly linked list, least recently used first
+        root = self._root = []
+        root[:] = [root, root, None, None, 0, None]
+        if name is not None:
+            _NAMED_CACHES.add(self)
+
+    def __hash__(self):
+        # caches are compared by content, but registered by identity
+        return id(self)
 
-    def __delitem__(self, item):
-        del self.cache[item]
-        self.order.remove(item)
+    def __len__(self):
+        return len(self._links)
 
-    def __getitem__(self, item):
-        val = self.cache[item]
-        self.order.remove(item)
-        self.order.append(item)
-        return val
+    def __contains__(self, key):
+        with self._lock:
+            link = self._links.get(key)
+            return link is not None and not self._expired(link)
 
-    def __setitem__(self, item, value):
-        self.cache[item] = value
-        if item in self.order:
-            self.order.remove(item)
-        self.order.append(item)
-        while len(self) > self.limit:
-            del self.cache[self.order.popleft()]
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __getitem__(self, key):
+        with self._lock:
+            link = self._links.get(key)
+            if link is None or (link[_EXPIRES] is not None and
+                    self._expired(link, remove=True)):
+                self.misses += 1
+                raise KeyError(key)
+            self.hits += 1
+            # move to the end of the list, inlined as this is the
+            # most frequent operation
+            prev, next = link[_PREV], link[_NEXT]
+            prev[_NEXT] = next
+            next[_PREV] = prev
+            root = self._root
+            last = root[_PREV]
+            link[_PREV] = last
+            link[_NEXT] = root
+            last[_NEXT] = root[_PREV] = link
+            return link[_VALUE]
+
+    def __setitem__(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            link = self._links.get(key)
+            if link is not None:
+                self._unlink(link)
+                self.size -= link[_SIZE]
+            link = [None, None, key, value, size, expires]
+            self._links[key] = link
+            self._append(link)
+            self.size += size
+            self._shrink()
+
+    def __delitem__(self, key):
+        with self._lock:
+            self._remove(self._links[key])
 
     def __repr__(self):
-        '''prevent repr(self) from changing cache order'''
-        return repr(self.cache)
-        
-    def __str__(self):
-        '''prevent str(self) from changing cache order'''
-        return str(self.cache)
+        # prevent repr(self) from changing cache order
+        return repr(dict(self.items()))
 
     def keys(self):
-        return self.cache.keys()
+        with self._lock:
+            return [link[_KEY] for link in self._iter_links()]
+
+    def values(self):
+        with self._lock:
+            return [link[_VALUE] for link in self._iter_links()]
+
+    def items(self):
+        with self._lock:
+            return [(link[_KEY], link[_VALUE])
+                    for link in self._iter_links()]
+
+    def iterkeys(self):
+        return iter(self.keys())
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def clear(self):
+        with self._lock:
+            self._links.clear()
+            root = self._root
+            root[:] = [root, root, None, None, 0, None]
+            self.size = 0
+
+    def stats(self):
+        """
+            Returns the number of items, their total size, and the
+            hits, misses, evictions and expirations so far, as a dict
+        """
+        with self._lock:
+            return {
+                'items': len(self._links),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def _iter_links(self):
+        now = time.time()
+        root = self._root
+        link = root[_NEXT]
+        while link is not root:
+            expires = link[_EXPIRES]
+            if expires is None or expires > now:
+                yield link
+            link = link[_NEXT]
+
+    def _expired(self, link, remove=False):
+        expires = link[_EXPIRES]
+        if expires is None or expires > time.time():
+            return False
+        if remove:
+            self._remove(link)
+            self.expirations += 1
+        return True
+
+    def _append(self, link):
+        root = self._root
+        last = root[_PREV]
+        link[_PREV] = last
+        link[_NEXT] = root
+        last[_NEXT] = root[_PREV] = link
+
+    def _unlink(self, link):
+        prev, next = link[_PREV], link[_NEXT]
+        prev[_NEXT] = next
+        next[_PREV] = prev
+
+    def _remove(self, link):
+        self._unlink(link)
+        del self._links[link[_KEY]]
+        self.size -= link[_SIZE]
+
+    def _shrink(self):
+        root = self._root
+        while self._links and (
+                (self.limit is not None and len(self._links) > self.limit) or
+                (self.max_bytes is not None and self.size > self.max_bytes)):
+            link = root[_NEXT]
+            self._remove(link)
+            if self._expired(link):
+                self.expirations += 1
+            else:
+                self.evictions += 1
+
+def get_cache_stats():
+    """
+        Returns the statistics of all named :class:`LRUCache` objects
+
+        :returns: a list of (name, :meth:`LRUCache.stats`) tuples,
+            sorted by name
+    """
+    return sorted((cache.name, cache.stats()) for cache in list(_NAMED_CACHES))
+
+def dump_cache_stats(out=None):
+    """
+        Prints the statistics of all named :class:`LRUCache` objects
+
+        :param out: the file to print to, sys.stdout by default
+    """
+    if out is None:
+        out = sys.stdout
+    out.write("%-40s %8s %10s %8s %8s %9s %8s\n" % ('cache', 'items',
+            'bytes', 'hits', 'misses', 'evictions', 'expired'))
+    for name, stats in get_cache_stats():
+        total = stats['hits'] + stats['misses']
+        out.write("%-40s %8d %10d %8d %8d %9d %8d  %5.1f%% hits\n" % (name,
+                stats['items'], stats['bytes'], stats['hits'],
+                stats['misses'], stats['evictions'], stats['expirations'],
+                100.0 * stats['hits'] / total if total else 0))
+
+class LimitedCache(LRUCache):
+    """
+        Simple cache that acts much like a dict, but has a maximum # of items
+
+        Kept for compatibility, see :class:`LRUCache`.
+    """
+    def __init__(self, limit):
+        LRUCache.__init__(self, limit)
+
+    @property
+    def cache(self):
+        """
+            A dict of the cached items
+        """
+        return dict(self.items())
 
 class cached(object):
     """
         Decorator to make a function's results cached
         does not cache if there is an exception.
 
+        The keyword arguments are passed to :class:`LRUCache`. The
+        cache is named after the function unless a name is given.
+
         .. note:: This probably breaks on functions that modify their arguments
     """
-    def __init__(self, limit):
+    def __init__(self, limit, **kwargs):
         self.limit = limit
+        self.kwargs = kwargs
 
     @staticmethod
     def _freeze(d):
@@ -424,7 +638,9 @@ class cached(object):
         try:
             f._cache
         except AttributeError:
-            f._cache = LimitedCache(self.limit)
+            kwargs = dict(self.kwargs)
+            kwargs.setdefault('name', '%s.%s' % (f.__module__, f.__name__))
+            f._cache = LRUCache(self.limit, **kwargs)
         @wraps(f)
         def wrapper(*args, **kwargs):
             try:
@@ -458,16 +674,40 @@ def walk(root):
         :returns: a generator object
         :rtype: :class:`Gio.File`
     """
+    for fil, fileinfo in walk_with_info(root):
+        yield fil
+
+#: attributes queried by :func:`walk_with_info`
+WALK_ATTRIBUTES = "standard::type,standard::is-symlink,standard::name," \
+        "standard::symlink-target,time::modified"
+
+def walk_with_info(root):
+    """
+        Like :func:`walk`, but yields (:class:`Gio.File`,
+        :class:`Gio.FileInfo`) pairs. The file infos come from the
+        directory enumeration and hold the attributes listed in
+        :data:`WALK_ATTRIBUTES`, so no additional queries are needed
+        for the file type or modification time.
+
+        :param root: a :class:`Gio.File` representing the
+            directory to walk through
+        :returns: a generator object
+    """
+    try:
+        rootinfo = root.query_info(WALK_ATTRIBUTES,
+                Gio.FileQueryInfoFlags.NONE, None)
+    except GLib.Error:
+        logger.exception("Unhandled exception while walking on %s.", root)
+        return
+
     queue = deque()
-    queue.append(root)
+    queue.append((root, rootinfo))
 
     while len(queue) > 0:
-        dir = queue.pop()
-        yield dir
+        dir, dirinfo = queue.pop()
+        yield dir, dirinfo
         try:
-            for fileinfo in dir.enumerate_children("standard::type,"
-                    "standard::is-symlink,standard::name,"
-                    "standard::symlink-target,time::modified",
+            for fileinfo in dir.enumerate_children(WALK_ATTRIBUTES,
                     Gio.FileQueryInfoFlags.NONE, None):
                 fil = dir.get_child(fileinfo.get_name())
                 # FIXME: recursive symlinks could cause an infinite loop
@@ -482,9 +722,9 @@ def walk(root):
                         continue
                 type = fileinfo.get_file_type()
                 if type == Gio.FileType.DIRECTORY:
-                    queue.append(fil)
+                    queue.append((fil, fileinfo))
                 elif type == Gio.FileType.REGULAR:
-                    yield fil
+                    yield fil, fileinfo
         except GLib.Error: # why doesnt gio offer more-specific errors?
             logger.exception("Unhandled exception while walking on %s.", dir)
 
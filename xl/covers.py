@@ -32,8 +32,11 @@ as album art.
 from gi.repository import GLib
 from gi.repository import Gio
 import logging
+import collections
 import hashlib
 import os
+import threading
+import time
 try:
     import cPickle as pickle
 except ImportError:
@@ -41,6 +44,7 @@ except ImportError:
 
 from xl.nls import gettext as _
 from xl import (
+    collection,
     common,
     event,
     providers,
@@ -48,9 +52,16 @@ from xl import (
     trax,
     xdg
 )
+from xl.trax import journal
 
 logger = logging.getLogger(__name__)
 
+#: Sizes (in pixels) of the thumbnails kept by :class:`CoverManager`
+THUMBNAIL_SIZES = (48, 100, 300)
+
+#: Extensions of the image files that are used as local covers
+IMAGE_EXTENSIONS = frozenset(['.png', '.jpg', '.jpeg', '.gif'])
+
 
 # TODO: maybe this could go into common.py instead? could be
 # useful in other areas.
@@ -102,17 +113,523 @@ class Cacher(object):
         except OSError:
             pass
 
-    def get(self, key):
+    def get(self, key, mtime=None):
         """
             Retrieve an entry from the cache.  Returns None if the given
             key does not exist.
 
             :param key: The key to retrieve data for.
+            :param mtime: if set, entries that were not stored with
+                this modification time are not returned
         """
         path = os.path.join(self.cache_dir, key)
-        if os.path.exists(path):
-            return open(path, "rb").read()
+        try:
+            if mtime is not None and int(os.path.getmtime(path)) != mtime:
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def set(self, key, data, mtime=None):
+        """
+            Stores an entry under a key chosen by the caller, replacing
+            any previous entry.
+
+            :param key: The key to store data for.
+            :param data: The data to store, as a bytestring.
+            :param mtime: the modification time (in whole seconds) of
+                what the data was made from, see :meth:`get`
+        """
+        path = os.path.join(self.cache_dir, key)
+        with open(path + ".new", "wb") as f:
+            f.write(data)
+        if mtime is not None:
+            os.utime(path + ".new", (mtime, mtime))
+        os.rename(path + ".new", path)
+
+
+def scale_cover(data, size):
+    """
+        Scales image data down to fit into a square, keeping its
+        aspect ratio. Images that are already small enough are only
+        converted.
+
+        :param data: the raw image data
+        :param size: the width and height of the square, in pixels
+        :returns: the scaled image as PNG data, or None if the data
+            could not be read
+    """
+    def on_size_prepared(loader, width, height):
+        scale = min(1.0, size / float(max(width, height, 1)))
+        loader.set_size(max(1, int(width * scale)),
+                max(1, int(height * scale)))
+
+    # only needed here, so that loading this module does not need Gdk
+    from gi.repository import GdkPixbuf
+
+    loader = GdkPixbuf.PixbufLoader()
+    loader.connect('size-prepared', on_size_prepared)
+    try:
+        loader.write(data)
+        loader.close()
+        pixbuf = loader.get_pixbuf()
+        if pixbuf is None:
+            return None
+        success, png = pixbuf.save_to_bufferv('png', [], [])
+    except GLib.GError as e:
+        logger.warning("Could not scale cover: %s", e.message)
         return None
+    return png if success else None
+
+
+class DirectoryImageCache(object):
+    """
+        Remembers the image files found in directories, so that local
+        covers can be found without listing the directory every time.
+
+        Entries are keyed by directory URI and store the modification
+        time of the directory, which changes whenever files are added,
+        removed or renamed in it. The time is only checked again after
+        :attr:`check_interval` seconds, as even that is slow on network
+        mounts.
+
+        The collection scanner adds the directories it lists anyway,
+        and the library monitor invalidates directories that changed.
+    """
+    #: Extensions of the files that are remembered
+    extensions = IMAGE_EXTENSIONS
+    #: Seconds during which an entry is used without checking the
+    #  directory's modification time
+    check_interval = 30
+
+    def __init__(self, limit=10000):
+        """
+            :param limit: the maximum number of directories to remember
+        """
+        self._dirs = common.LRUCache(limit,
+                name='xl.covers.DirectoryImageCache')
+
+    @staticmethod
+    def _get_mtime(fileinfo):
+        mtime = fileinfo.get_modification_time()
+        return (mtime.tv_sec, mtime.tv_usec)
+
+    def is_image(self, name):
+        """
+            Whether a file name has one of the image extensions
+        """
+        return os.path.splitext(name)[1].lower() in self.extensions
+
+    def set(self, uri, fileinfo, names):
+        """
+            Records the image files in a directory
+
+            :param uri: the URI of the directory
+            :param fileinfo: a :class:`Gio.FileInfo` of the directory
+                containing its modification time
+            :param names: the names of the image files in it
+        """
+        self._dirs[uri] = (self._get_mtime(fileinfo), time.time(),
+                tuple(names))
+
+    def get(self, directory):
+        """
+            Returns the names of the image files in a directory
+
+            :param directory: the :class:`Gio.File` of the directory
+            :returns: a tuple of names, or None if the location
+                is not a readable directory
+        """
+        uri = directory.get_uri()
+        entry = self._dirs.get(uri)
+        if entry is not None and \
+                time.time() - entry[1] < self.check_interval:
+            return entry[2]
+
+        try:
+            info = directory.query_info("standard::type,time::modified",
+                    Gio.FileQueryInfoFlags.NONE, None)
+            if info.get_file_type() != Gio.FileType.DIRECTORY:
+                return None
+            if entry is not None and entry[0] == self._get_mtime(info):
+                names = entry[2]
+            else:
+                names = [fileinfo.get_name() for fileinfo in
+                        directory.enumerate_children(
+                            "standard::type,standard::name",
+                            Gio.FileQueryInfoFlags.NONE, None)
+                        if fileinfo.get_file_type() == Gio.FileType.REGULAR
+                        and self.is_image(fileinfo.get_name())]
+        except GLib.Error:
+            self.invalidate(uri)
+            return None
+
+        self.set(uri, info, names)
+        return tuple(names)
+
+    def invalidate(self, uri):
+        """
+            Forgets a directory
+        """
+        self._dirs.pop(uri, None)
+
+    def remove_tree(self, uri):
+        """
+            Forgets a directory and all its subdirectories
+        """
+        prefix = uri.rstrip('/') + '/'
+        for key in self._dirs.keys():
+            if key == uri or key.startswith(prefix):
+                self._dirs.pop(key, None)
+
+
+class CoverStore(object):
+    """
+        Persistent store for the covers that are set for albums, and
+        for the image data of covers fetched by cached methods.
+
+        The mapping from album keys to db_strings is kept in a
+        :class:`xl.trax.journal.TrackJournal`, so that opening the
+        store only reads the record headers and saving only appends
+        the entries that changed. Entries are read when they are first
+        needed.
+
+        Image data is stored once per distinct image (named by its
+        SHA-256 hash) and counts the albums that use it; it is deleted
+        when the last album stops using it. Images that were fetched
+        automatically may be evicted, least recently used first, when
+        they take up more than a configurable amount of space. The
+        covers of the affected albums are then fetched again when
+        needed.
+    """
+    def __init__(self, location, fetched_size_limit=None):
+        """
+            :param location: The directory to store data in. Image
+                data is kept in its 'cache' subdirectory.
+            :param fetched_size_limit: the maximum number of bytes
+                of fetched images to keep, or None for no limit
+        """
+        self.location = location
+        self.fetched_size_limit = fetched_size_limit
+        self.cache = Cacher(os.path.join(location, 'cache'))
+        self._journal = journal.TrackJournal(
+                os.path.join(location, 'covers.journal'))
+        # entries read from or changed since opening the journal;
+        # None marks deleted entries
+        self._covers = {}
+        self._blobs = {}
+        self._dirty_covers = set()
+        self._dirty_blobs = set()
+        self._fetched_size = 0
+
+    @staticmethod
+    def _cover_name(key):
+        return 'cover-%r' % (key,)
+
+    @staticmethod
+    def _blob_name(digest):
+        return 'blob-%s' % digest
+
+    @common.synchronized
+    def open(self):
+        """
+            Opens the store, importing the covers.db file written by
+            earlier versions if there is no store yet
+        """
+        migrate = not os.path.exists(self._journal.location)
+        self._journal.open()
+        self._fetched_size = self._journal.get('fetched_size', 0)
+        if migrate:
+            self._import_pickle(os.path.join(self.location, 'covers.db'))
+
+    @common.synchronized
+    def close(self):
+        """
+            Saves pending changes and closes the store
+        """
+        self.save()
+        self._journal.close()
+
+    def _import_pickle(self, path):
+        """
+            Imports the entries of a covers.db file
+        """
+        data = None
+        for loc in [path, path+".old", path+".new"]:
+            try:
+                with open(loc, 'rb') as f:
+                    data = pickle.load(f)
+            except (IOError, EOFError, pickle.UnpicklingError):
+                pass
+            if data:
+                break
+        if not data:
+            return
+
+        logger.info("Importing %d covers from %s", len(data), path)
+        for key, db_string in data.iteritems():
+            # the source of cached images is not known, so they are
+            # never evicted
+            self.set(key, db_string)
+        self.save()
+        self.collect_garbage()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        db_string = self.get(key)
+        if db_string is None:
+            raise KeyError(key)
+        return db_string
+
+    def __setitem__(self, key, db_string):
+        self.set(key, db_string)
+
+    def __delitem__(self, key):
+        if not self.delete(key):
+            raise KeyError(key)
+
+    @common.synchronized
+    def get(self, key, default=None):
+        """
+            Returns the db_string set for an album key
+        """
+        try:
+            db_string = self._covers[key]
+        except KeyError:
+            entry = self._journal.get(self._cover_name(key))
+            db_string = self._covers[key] = entry[1] if entry else None
+        return default if db_string is None else db_string
+
+    @common.synchronized
+    def set(self, key, db_string):
+        """
+            Sets the db_string for an album key
+        """
+        old = self.get(key)
+        if old == db_string:
+            return
+        self._covers[key] = db_string
+        self._dirty_covers.add(key)
+        self._unref(old, key)
+        self._ref(db_string, key)
+
+    @common.synchronized
+    def delete(self, key):
+        """
+            Removes the entry for an album key
+
+            :returns: True if there was an entry
+        """
+        old = self.get(key)
+        if old is None:
+            return False
+        self._covers[key] = None
+        self._dirty_covers.add(key)
+        self._unref(old, key)
+        return True
+
+    def _get_blob(self, digest):
+        try:
+            return self._blobs[digest]
+        except KeyError:
+            blob = self._blobs[digest] = \
+                    self._journal.get(self._blob_name(digest))
+            return blob
+
+    def _set_blob(self, digest, blob):
+        self._blobs[digest] = blob
+        self._dirty_blobs.add(digest)
+
+    @staticmethod
+    def _get_digest(db_string):
+        if db_string and db_string.startswith('cache:'):
+            return db_string[6:]
+        return None
+
+    def _ref(self, db_string, key):
+        digest = self._get_digest(db_string)
+        if digest is None:
+            return
+        blob = self._get_blob(digest)
+        if blob is None:
+            # an image stored by an earlier version
+            path = os.path.join(self.cache.cache_dir, digest)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+            blob = {'size': size, 'keys': [], 'fetched': False, 'used': 0}
+        blob = dict(blob, keys=blob['keys'] + [key])
+        self._set_blob(digest, blob)
+
+    def _unref(self, db_string, key):
+        digest = self._get_digest(db_string)
+        if digest is None:
+            return
+        blob = self._get_blob(digest)
+        if blob is None:
+            return
+        keys = [k for k in blob['keys'] if k != key]
+        if keys:
+            self._set_blob(digest, dict(blob, keys=keys))
+        else:
+            self._remove_blob(digest)
+
+    def _remove_blob(self, digest):
+        blob = self._get_blob(digest)
+        if blob is not None and blob['fetched']:
+            self._fetched_size -= blob['size']
+        self._set_blob(digest, None)
+        self.cache.remove(digest)
+
+    @common.synchronized
+    def add_data(self, data, fetched=False):
+        """
+            Stores image data. Nothing is written if the same data is
+            already stored.
+
+            The data is deleted again unless an album is set to use
+            it with :meth:`set`.
+
+            :param data: the image data
+            :param fetched: whether the image was found automatically,
+                and may be evicted
+            :returns: the db_string for the data
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        blob = self._get_blob(digest)
+        if blob is None:
+            self.cache.set(digest, data)
+            blob = {'size': len(data), 'keys': [], 'fetched': fetched,
+                    'used': time.time()}
+            if fetched:
+                self._fetched_size += len(data)
+            self._set_blob(digest, blob)
+        elif blob['fetched'] and not fetched:
+            # chosen explicitly, so keep it
+            self._fetched_size -= blob['size']
+            self._set_blob(digest, dict(blob, fetched=False))
+        return "cache:%s" % digest
+
+    @common.synchronized
+    def get_data(self, db_string):
+        """
+            Returns the image data stored for a db_string
+
+            :param db_string: a db_string returned by :meth:`add_data`
+        """
+        digest = self._get_digest(db_string)
+        if digest is None:
+            return None
+        blob = self._get_blob(digest)
+        if blob is not None and blob['used'] < time.time() - 24 * 3600:
+            # only used for eviction, so does not need to be exact
+            self._set_blob(digest, dict(blob, used=time.time()))
+        return self.cache.get(digest)
+
+    @common.synchronized
+    def evict(self, keep=()):
+        """
+            Removes the least recently used fetched images, until
+            they take up less than 90% of the size limit
+
+            :param keep: db_strings that must not be evicted
+            :returns: a list of (key, db_string) pairs of the removed
+                entries
+        """
+        if self.fetched_size_limit is None or \
+                self._fetched_size <= self.fetched_size_limit:
+            return []
+
+        keep = set(self._get_digest(db_string) for db_string in keep)
+        candidates = []
+        for digest, blob in self._iter_blobs():
+            if blob['fetched'] and digest not in keep:
+                candidates.append((blob['used'], digest, blob))
+        candidates.sort()
+
+        removed = []
+        target = self.fetched_size_limit * 0.9
+        for unused, digest, blob in candidates:
+            if self._fetched_size <= target:
+                break
+            db_string = "cache:%s" % digest
+            for key in blob['keys']:
+                self._covers[key] = None
+                self._dirty_covers.add(key)
+                removed.append((key, db_string))
+            self._remove_blob(digest)
+        logger.debug("Evicted %d fetched covers", len(removed))
+        return removed
+
+    def _iter_blobs(self):
+        """
+            Yields (digest, blob) for all stored images
+        """
+        prefix = self._blob_name('')
+        for name, blob in self._journal.iteritems(prefix):
+            digest = name[len(prefix):]
+            if digest not in self._blobs:
+                yield digest, blob
+        for digest, blob in self._blobs.items():
+            if blob is not None:
+                yield digest, blob
+
+    @common.synchronized
+    def save(self):
+        """
+            Writes the changed entries
+        """
+        if not self._dirty_covers and not self._dirty_blobs:
+            return
+        puts = [('fetched_size', self._fetched_size)]
+        deletes = []
+        for key in self._dirty_covers:
+            db_string = self._covers[key]
+            if db_string is None:
+                deletes.append(self._cover_name(key))
+            else:
+                puts.append((self._cover_name(key), (key, db_string)))
+        for digest in self._dirty_blobs:
+            blob = self._blobs[digest]
+            if blob is None:
+                deletes.append(self._blob_name(digest))
+            else:
+                puts.append((self._blob_name(digest), blob))
+        self._journal.write(puts, deletes)
+        self._dirty_covers.clear()
+
+        # only keep entries that were read, not the ones written
+        for digest in self._dirty_blobs:
+            del self._blobs[digest]
+        self._dirty_blobs.clear()
+
+        if self._journal.needs_compaction():
+            self.collect_garbage()
+
+    @common.synchronized
+    def collect_garbage(self):
+        """
+            Deletes image files that no album uses, and compacts the
+            journal
+        """
+        self.save()
+        live = set(digest for digest, blob in self._iter_blobs())
+        try:
+            names = os.listdir(self.cache.cache_dir)
+        except OSError:
+            names = []
+        removed = 0
+        for name in names:
+            if name not in live:
+                self.cache.remove(name)
+                removed += 1
+        if removed:
+            logger.info("Removed %d unused cover images", removed)
+        self._journal.compact()
 
 
 class CoverManager(providers.ProviderHandler):
@@ -124,12 +641,14 @@ class CoverManager(providers.ProviderHandler):
             :param location: The directory to load and store data in.
         """
         providers.ProviderHandler.__init__(self, "covers")
-        self.__cache = Cacher(os.path.join(location, 'cache'))
+        self.__thumbnails = Cacher(os.path.join(location, 'thumbnails'))
+        self.__default_thumbnails = {}
         self.location = location
         self.methods = {}
         self.order = settings.get_option(
                 'covers/preferred_order', [])
-        self.db = {}
+        self.db = CoverStore(location, settings.get_option(
+                'covers/fetched_size_limit', 256 * 1024 * 1024))
         self.load()
         for method in self.get_providers():
             self.on_provider_added(method)
@@ -248,7 +767,7 @@ class CoverManager(providers.ProviderHandler):
                 break
         return covers
 
-    def set_cover(self, track, db_string, data=None):
+    def set_cover(self, track, db_string, data=None, fetched=False):
         """
             Sets the cover for a track. This will overwrite any existing
             entry.
@@ -258,16 +777,25 @@ class CoverManager(providers.ProviderHandler):
                     cover, in "method:key" format.
             :param data: The raw cover data to store for the track.  Will
                     only be stored if the method has use_cache=True
+            :param fetched: True if the cover was found automatically
+                    rather than chosen by the user. Stored data of
+                    fetched covers is removed when the store grows
+                    too large, and fetched again when needed.
         """
+        key = self._get_track_key(track)
+        if not key:
+            return
         name = db_string.split(":", 1)[0]
         method = self.methods.get(name)
         if method and method.use_cache and data:
-            db_string = "cache:%s"%self.__cache.add(data)
-        key = self._get_track_key(track)
-        if key:
-            self.db[key] = db_string
-            self.timeout_save()
-            event.log_event('cover_set', self, track)
+            db_string = self.db.add_data(data, fetched)
+        self._remove_thumbnails(self.db.get(key))
+        self._remove_thumbnails(db_string)
+        self.db[key] = db_string
+        for unused, evicted in self.db.evict(keep=[db_string]):
+            self._remove_thumbnails(evicted)
+        self.timeout_save()
+        event.log_event('cover_set', self, track)
 
     def remove_cover(self, track):
         """
@@ -279,7 +807,7 @@ class CoverManager(providers.ProviderHandler):
         db_string = self.db.get(key)
         if db_string:
             del self.db[key]
-            self.__cache.remove(db_string)
+            self._remove_thumbnails(db_string)
             self.timeout_save()
             event.log_event('cover_removed', self, track)
 
@@ -313,11 +841,99 @@ class CoverManager(providers.ProviderHandler):
             cover = covers[0]
             data = self.get_cover_data(cover, use_default=use_default)
             if save_cover and data != self.get_default_cover():
-                self.set_cover(track, cover, data)
+                self.set_cover(track, cover, data, fetched=True)
             return data
 
         return self.get_default_cover() if use_default else None
 
+    def get_cover_thumbnail(self, track, size, set_only=True,
+            use_default=False):
+        """
+            Get a scaled down cover for a given track.
+
+            Thumbnails are stored for each cover in the sizes listed in
+            :data:`THUMBNAIL_SIZES`, so that showing many covers does
+            not require reading and scaling the full images. The
+            requested size is rounded up to the next stored size; the
+            caller scales the (small) result to the exact size. Larger
+            sizes are scaled from the full image every time.
+
+            Thumbnails of covers that are not cached, like local files,
+            are made again when their source is modified.
+
+            :param track: the Track to get the cover for.
+            :param size: the largest width or height needed, in pixels
+            :param set_only: Only retrieve covers that have been set
+                    in the db. Otherwise, covers are searched for
+                    like :meth:`get_cover` does.
+            :param use_default: If True, returns a thumbnail of the
+                    default cover instead of None when no covers are found.
+            :returns: PNG data of the thumbnail
+        """
+        for thumbnail_size in THUMBNAIL_SIZES:
+            if size <= thumbnail_size:
+                size = thumbnail_size
+                break
+        stored = size in THUMBNAIL_SIZES
+
+        db_string = self.get_db_string(track) if track is not None else None
+        if db_string is None and not set_only and track is not None:
+            data = self.get_cover(track, save_cover=True)
+            db_string = self.get_db_string(track)
+            if db_string is None and data is not None:
+                # cannot be stored for this track
+                return scale_cover(data, size)
+
+        thumbnail = None
+        if db_string is not None:
+            key = self._get_thumbnail_key(db_string, size)
+            mtime = None
+            if stored:
+                mtime = self._get_source_mtime(db_string)
+                thumbnail = self.__thumbnails.get(key, mtime)
+            if thumbnail is None:
+                data = self.get_cover_data(db_string)
+                if data is not None:
+                    thumbnail = scale_cover(data, size)
+                if thumbnail is not None and stored:
+                    self.__thumbnails.set(key, thumbnail, mtime)
+
+        if thumbnail is None and use_default:
+            thumbnail = self.__default_thumbnails.get(size)
+            if thumbnail is None:
+                thumbnail = scale_cover(self.get_default_cover(), size)
+                self.__default_thumbnails[size] = thumbnail
+        return thumbnail
+
+    def _get_thumbnail_key(self, db_string, size):
+        """
+            Returns the cache key of a thumbnail
+        """
+        if isinstance(db_string, unicode):
+            db_string = db_string.encode('utf-8')
+        return "%s-%d" % (hashlib.sha1(db_string).hexdigest(), size)
+
+    def _get_source_mtime(self, db_string):
+        """
+            Returns the modification time of the source of a cover that
+            is not cached, or None if it is not known
+        """
+        source, data = db_string.split(":", 1)
+        get_mtime = getattr(self.methods.get(source), 'get_cover_mtime',
+                None)
+        if get_mtime is None:
+            return None
+        return get_mtime(data)
+
+    def _remove_thumbnails(self, db_string):
+        """
+            Removes all stored thumbnails of a cover
+        """
+        if db_string:
+            for size in THUMBNAIL_SIZES:
+                self.__thumbnails.remove(
+                        self._get_thumbnail_key(db_string, size))
+
     def get_cover_data(self, db_string, use_default=False):
         """
             Get the raw image data for a cover.
@@ -329,7 +945,7 @@ class CoverManager(providers.ProviderHandler):
         source, data = db_string.split(":", 1)
         ret = None
         if source == "cache":
-            ret = self.__cache.get(data)
+            ret = self.db.get_data(db_string)
         else:
             method = self.methods.get(source)
             if method:
@@ -350,24 +966,7 @@ class CoverManager(providers.ProviderHandler):
         """
             Load the saved db
         """
-        path = os.path.join(self.location, 'covers.db')
-        data = None
-        for loc in [path, path+".old", path+".new"]:
-            try:
-                f = open(loc, 'rb')
-                data = pickle.load(f)
-                f.close()
-            except IOError:
-                pass
-            except EOFError:
-                try:
-                    os.remove(loc)
-                except:
-                    pass
-            if data:
-                break
-        if data:
-            self.db = data
+        self.db.open()
 
     @common.glib_wait_seconds(60)
     def timeout_save(self):
@@ -377,22 +976,10 @@ class CoverManager(providers.ProviderHandler):
         """
             Save the db
         """
-        path = os.path.join(self.location, 'covers.db')
-        try:
-            f = open(path + ".new", 'wb')
-            pickle.dump(self.db, f, common.PICKLE_PROTOCOL)
-            f.close()
-        except IOError:
-            return
         try:
-            os.rename(path, path + ".old")
-        except OSError:
-            pass # if it doesn'texist we don't care
-        os.rename(path + ".new", path)
-        try:
-            os.remove(path + ".old")
-        except OSError:
-            pass
+            self.db.save()
+        except (IOError, OSError):
+            logger.exception("Could not save the cover database")
 
     def on_provider_added(self, provider):
         self.methods[provider.name] = provider
@@ -420,6 +1007,189 @@ class CoverManager(providers.ProviderHandler):
         settings.set_option('covers/preferred_order', list(order))
 
 
+class _ProviderLimit(object):
+    """
+        Limits how many lookups may run concurrently for a search
+        method, and how often they may be started
+    """
+    def __init__(self, max_concurrent, min_interval):
+        self.semaphore = threading.BoundedSemaphore(max(1, max_concurrent))
+        self.min_interval = min_interval
+        self.next_start = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, stopper):
+        """
+            Waits until a lookup may start
+
+            :returns: False if stopper was set while waiting
+        """
+        self.semaphore.acquire()
+        if self.min_interval:
+            with self.lock:
+                now = time.time()
+                start = max(now, self.next_start)
+                self.next_start = start + self.min_interval
+            if start > now:
+                stopper.wait(start - now)
+        if stopper.is_set():
+            self.semaphore.release()
+            return False
+        return True
+
+    def release(self):
+        self.semaphore.release()
+
+
+class _FetchJob(object):
+    """
+        A cover lookup for an album, shared by all requests for it
+    """
+    __slots__ = ['done', 'data']
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = None
+
+
+class CoverFetchScheduler(object):
+    """
+        Fetches covers for many albums concurrently.
+
+        Lookups are distributed to a number of worker threads. Each
+        search method limits how many of its lookups run at the same
+        time (``max_concurrent``) and how many seconds pass at least
+        between starting two of them (``min_interval``); see
+        :class:`CoverSearchMethod`. Tracks of the same album are only
+        looked up once, also when requested by concurrent calls of
+        :meth:`fetch`.
+    """
+    def __init__(self, manager, workers=4, stopper=None):
+        """
+            :param manager: the :class:`CoverManager` to search with
+                and store found covers in
+            :param workers: the number of lookups to run at once
+            :param stopper: a :class:`threading.Event` that cancels
+                all lookups when set
+        """
+        self.manager = manager
+        self.workers = workers
+        self.stopper = stopper if stopper is not None else threading.Event()
+        self._limits = {}
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._callback_lock = threading.Lock()
+
+    def fetch(self, tracks, callback=None):
+        """
+            Finds and stores the covers for tracks. Returns when all
+            lookups are done or the scheduler was stopped.
+
+            Tracks that already have a cover set are not searched for.
+
+            :param tracks: the tracks to find covers for, usually one
+                per album
+            :param callback: called with each track and the found
+                cover data (or None) as soon as it is known. Calls are
+                made from the worker threads, but never concurrently.
+        """
+        albums = collections.OrderedDict()
+        for track in tracks:
+            key = self.manager._get_track_key(track)
+            if key is None:
+                # cannot be stored, so no need to share the lookup
+                key = track
+            albums.setdefault(key, []).append(track)
+
+        pending = collections.deque(albums.iteritems())
+        threads = []
+        for i in xrange(min(self.workers, len(pending))):
+            thread = threading.Thread(target=self._work,
+                    name='CoverFetch-%d' % i, args=(pending, callback))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+    def _work(self, pending, callback):
+        while not self.stopper.is_set():
+            try:
+                key, tracks = pending.popleft()
+            except IndexError:
+                return
+            data = self._fetch_shared(key, tracks[0])
+            if callback is not None and not self.stopper.is_set():
+                with self._callback_lock:
+                    for track in tracks:
+                        callback(track, data)
+
+    def _fetch_shared(self, key, track):
+        """
+            Looks up the cover of an album, or waits for the lookup
+            that is already running for it
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            owner = job is None
+            if owner:
+                job = self._jobs[key] = _FetchJob()
+
+        if not owner:
+            while not job.done.wait(0.5):
+                if self.stopper.is_set():
+                    return None
+            return job.data
+
+        try:
+            job.data = self._fetch(track)
+        finally:
+            with self._lock:
+                del self._jobs[key]
+            job.done.set()
+        return job.data
+
+    def _get_limit(self, method):
+        with self._lock:
+            limit = self._limits.get(method.name)
+            if limit is None:
+                limit = self._limits[method.name] = _ProviderLimit(
+                        getattr(method, 'max_concurrent', 1),
+                        getattr(method, 'min_interval', 0))
+            return limit
+
+    def _fetch(self, track):
+        """
+            Finds and stores the cover of a track
+        """
+        manager = self.manager
+        db_string = manager.get_db_string(track)
+        if db_string:
+            return manager.get_cover_data(db_string)
+
+        for method in manager._get_methods(fixed=True):
+            limit = self._get_limit(method)
+            if not limit.acquire(self.stopper):
+                return None
+            try:
+                covers = method.find_covers(track, limit=1)
+                if not covers:
+                    continue
+                db_string = "%s:%s" % (method.name, covers[0])
+                data = manager.get_cover_data(db_string)
+            except Exception:
+                logger.warning("Cover search by %s failed", method.name,
+                        exc_info=True)
+                continue
+            finally:
+                limit.release()
+
+            if data:
+                manager.set_cover(track, db_string, data, fetched=True)
+                return data
+        return None
+
+
 class CoverSearchMethod(object):
     """
         Base class for creating cover search methods.
@@ -437,6 +1207,12 @@ class CoverSearchMethod(object):
     #: Priority for fixed-position backends. Lower is earlier, non-fixed
     #  backends will always be 50.
     fixed_priority = 50
+    #: Maximum number of lookups :class:`CoverFetchScheduler` runs at
+    #  the same time for this method
+    max_concurrent = 2
+    #: Minimum number of seconds between starting two lookups in
+    #  :class:`CoverFetchScheduler`
+    min_interval = 0
     def find_covers(self, track, limit=-1):
         """
             Find the covers for a given track.
@@ -456,6 +1232,31 @@ class CoverSearchMethod(object):
         """
         raise NotImplementedError
 
+    def get_cover_mtime(self, db_string):
+        """
+            Get the modification time of a cover, in whole seconds. Only
+            used by methods with use_cache unset, so that stored
+            thumbnails of their covers are made again when it changes.
+
+            :param db_string: A method-dependent string that identifies the
+                    cover.
+            :returns: the time, or None if it is not known
+        """
+        return None
+
+
+def _get_uri_mtime(uri):
+    """
+        Returns the modification time of a file in whole seconds, or
+        None if it cannot be read
+    """
+    try:
+        info = Gio.File.new_for_uri(uri).query_info("time::modified",
+                Gio.FileQueryInfoFlags.NONE, None)
+    except GLib.Error:
+        return None
+    return info.get_modification_time().tv_sec
+
 
 class TagCoverFetcher(CoverSearchMethod):
     """
@@ -467,6 +1268,7 @@ class TagCoverFetcher(CoverSearchMethod):
     cover_tags = ["cover", "coverart"]
     fixed = True
     fixed_priority = 30
+    max_concurrent = 4
 
     def find_covers(self, track, limit=-1):
         covers = [] 
@@ -495,6 +1297,10 @@ class TagCoverFetcher(CoverSearchMethod):
 
         return covers[int(index)].data
 
+    def get_cover_mtime(self, db_string):
+        tag, index, uri = db_string.split(':', 2)
+        return _get_uri_mtime(uri)
+
 class LocalFileCoverFetcher(CoverSearchMethod):
     """
         Cover source that looks for images in the same directory as the
@@ -504,10 +1310,11 @@ class LocalFileCoverFetcher(CoverSearchMethod):
     name = "localfile"
     title = _('Local file')
     uri_types = ['file', 'smb', 'sftp', 'nfs']
-    extensions = ['.png', '.jpg', '.jpeg', '.gif']
+    extensions = IMAGE_EXTENSIONS
     preferred_names = []
     fixed = True
     fixed_priority = 31
+    max_concurrent = 4
 
     def __init__(self):
         CoverSearchMethod.__init__(self)
@@ -522,26 +1329,19 @@ class LocalFileCoverFetcher(CoverSearchMethod):
         if track.get_type() not in self.uri_types:
             return []
         basedir = Gio.File.new_for_uri(track.get_loc_for_io()).get_parent()
-        try:
-            if not basedir.query_info("standard::type", Gio.FileQueryInfoFlags.NONE, None).get_file_type() == \
-                    Gio.FileType.DIRECTORY:
-                return []
-        except GLib.Error:
+        names = IMAGE_DIRECTORIES.get(basedir)
+        if names is None:
             return []
         covers = []
-        for fileinfo in basedir.enumerate_children("standard::type"
-                ",standard::name", Gio.FileQueryInfoFlags.NONE, None):
-            gloc = basedir.get_child(fileinfo.get_name())
-            if not fileinfo.get_file_type() == Gio.FileType.REGULAR:
-                continue
-            filename = gloc.get_basename()
+        for filename in names:
             base, ext = os.path.splitext(filename)
             if ext.lower() not in self.extensions:
                 continue
+            uri = basedir.get_child(filename).get_uri()
             if base in self.preferred_names:
-                covers.insert(0, gloc.get_uri())
+                covers.insert(0, uri)
             else:
-                covers.append(gloc.get_uri())
+                covers.append(uri)
         if limit == -1:
             return covers
         else:
@@ -554,6 +1354,9 @@ class LocalFileCoverFetcher(CoverSearchMethod):
         except GLib.GError:
             return None
 
+    def get_cover_mtime(self, db_string):
+        return _get_uri_mtime(db_string)
+
     def on_option_set(self, e, settings, option):
         """
             Updates the internal settings upon option change
@@ -563,6 +1366,11 @@ class LocalFileCoverFetcher(CoverSearchMethod):
 
 
 
+#: The :class:`DirectoryImageCache` shared by the local file cover
+#  search and the collection scanner
+IMAGE_DIRECTORIES = DirectoryImageCache()
+collection.set_image_cache(IMAGE_DIRECTORIES)
+
 #: The singleton :class:`CoverManager` instance
 MANAGER = CoverManager(location=xdg.get_data_home_path("covers",
         check_exists=False))
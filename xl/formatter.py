@@ -156,6 +156,122 @@ class ParameterTemplate(Template):
 
         return self.pattern.sub(convert, self.template)
 
+def _parse_parameters(parameters):
+    """
+        Splits the parameters of a braced identifier into a dictionary
+
+        :param parameters: the parameter string, e.g. ``a=b, c``
+        :type parameters: string
+        :returns: the parameters and their arguments,
+            parameters without argument are set to True
+        :rtype: dict
+    """
+    # Split parameters on unescaped comma
+    parameters = [p.lstrip() for p in re.split(r'(?<!\\),', parameters)]
+    # Split arguments on unescaped equals sign
+    parameters = [(re.split(r'(?<!\\)=', p, 1) + [True])[:2] \
+        for p in parameters]
+    # Turn list of lists into a proper dictionary
+    parameters = dict(parameters)
+
+    # Remove now obsolete escapes
+    for p in parameters:
+        argument = parameters[p]
+
+        if type(argument) is not bool:
+            argument = argument.replace(r'\,', ',')
+            argument = argument.replace(r'\}', '}')
+            argument = argument.replace(r'\=', '=')
+            parameters[p] = argument
+
+    return parameters
+
+class _CompiledField(object):
+    """
+        A single identifier of a compiled format
+    """
+    __slots__ = ['needle', 'identifier', 'parameters', 'arguments',
+        'prefix', 'suffix', 'pad', 'padstring', 'fallback']
+
+    def __init__(self, needle, identifier, parameters, fallback):
+        self.needle = needle
+        self.identifier = identifier
+        # All parameters, as passed to tag formatters
+        self.parameters = parameters
+        # Parameters not handled by the formatter itself,
+        # as passed to callable substitutions
+        self.arguments = arguments = parameters.copy()
+        self.prefix = arguments.pop('prefix', '')
+        self.suffix = arguments.pop('suffix', '')
+        self.pad = arguments.pop('pad', 0)
+        self.padstring = arguments.pop('padstring', '')
+        # Text kept if there is no substitution
+        self.fallback = fallback
+
+class _CompiledFormat(object):
+    """
+        A parsed format string
+
+        The format is split once into literal text and the
+        fields to substitute so formatting does not need to
+        match the template pattern again.
+    """
+    __slots__ = ['source', 'parts', 'fields']
+
+    def __init__(self, template):
+        """
+            :param template: the template to compile
+            :type template: :class:`ParameterTemplate`
+        """
+        self.source = source = template.template
+        # Literal strings and indices into the fields
+        self.parts = parts = []
+        self.fields = fields = []
+        indices = {}
+        delimiter = template.delimiter
+        position = 0
+
+        for match in template.pattern.finditer(source):
+            if match.start() > position:
+                parts.append(source[position:match.start()])
+            position = match.end()
+
+            groups = match.groupdict()
+            identifier = groups['braced'] or groups['named']
+
+            # Escaped and invalid expressions become the delimiter
+            if identifier is None:
+                parts.append(delimiter)
+                continue
+
+            if groups['braced'] is None:
+                needle = identifier
+                fallback = delimiter + needle
+                parameters = {}
+            else:
+                if groups['parameters'] is None:
+                    needle = identifier
+                    parameters = {}
+                else:
+                    # Required to make multiple occurences of the same
+                    # identifier with different parameters work
+                    needle = '%s:%s' % (identifier, groups['parameters'])
+                    parameters = _parse_parameters(groups['parameters'])
+                fallback = delimiter + '{' + needle + '}'
+
+            # $name and ${name} only differ in their fallback
+            try:
+                index = indices[fallback]
+            except KeyError:
+                index = indices[fallback] = len(fields)
+                fields.append(_CompiledField(needle, identifier,
+                    parameters, fallback))
+
+            parts.append(index)
+
+        if position < len(source):
+            parts.append(source[position:])
+
 class Formatter(GObject.GObject):
     """
         A generic text formatter based on a format string
@@ -189,6 +305,7 @@ class Formatter(GObject.GObject):
 
         self._template = ParameterTemplate(format)
         self._substitutions = {}
+        self._plan = None
 
     def do_get_property(self, property):
         """
@@ -206,9 +323,22 @@ class Formatter(GObject.GObject):
         if property.name == 'format':
             if value != self._template.template:
                 self._template.template = value
+                self._plan = None
         else:
             raise AttributeError('unkown property %s' % property.name)
 
+    def _compile(self):
+        """
+            Returns the render plan for the current format,
+            parsing the format string only if it has changed
+        """
+        plan = self._plan
+
+        if plan is None or plan.source != self._template.template:
+            plan = self._plan = _CompiledFormat(self._template)
+
+        return plan
+
     def extract(self):
         """
             Retrieves the identifiers and their optional parameters
@@ -227,49 +357,8 @@ class Formatter(GObject.GObject):
             :returns: the extractions
             :rtype: dict
         """
-        matches = self._template.pattern.finditer(self._template.template)
-        extractions = {}
-
-        # Extract list of identifiers and parameters from the format string
-        for match in matches:
-            groups = match.groupdict()
-
-            # We only care about braced and named, not escaped and invalid
-            identifier = groups['braced'] or groups['named']
-
-            if identifier is None:
-                continue
-
-            identifier_parts = [identifier]
-            parameters = {}
-
-            if groups['parameters'] is not None:
-                # Split parameters on unescaped comma
-                parameters = [p.lstrip() \
-                    for p in re.split(r'(?<!\\),', groups['parameters'])]
-                # Split arguments on unescaped equals sign
-                parameters = [(re.split(r'(?<!\\)=', p, 1) + [True])[:2] \
-                    for p in parameters]
-                # Turn list of lists into a proper dictionary
-                parameters = dict(parameters)
-
-                # Remove now obsolete escapes
-                for p in parameters:
-                    argument = parameters[p]
-
-                    if type(argument) is not bool:
-                        argument = argument.replace(r'\,', ',')
-                        argument = argument.replace(r'\}', '}')
-                        argument = argument.replace(r'\=', '=')
-                        parameters[p] = argument
-
-                identifier_parts += [groups['parameters']]
-
-            # Required to make multiple occurences of the same
-            # identifier with different parameters work
-            extractions[':'.join(identifier_parts)] = (identifier, parameters)
-
-        return extractions
+        return dict((field.needle, (field.identifier, field.parameters.copy()))
+            for field in self._compile().fields)
 
     def format(self, *args):
         """
@@ -279,43 +368,59 @@ class Formatter(GObject.GObject):
             :returns: the formatted text
             :rtype: string
         """
-        extractions = self.extract()
-        substitutions = {}
+        return self._render(self._compile(), self._substitutions, args)
 
-        for needle, (identifier, parameters) in extractions.iteritems():
-            substitute = None
+    def _render(self, plan, substitutions, args=()):
+        """
+            Renders a compiled format using the given substitutions
 
-            if needle in self._substitutions:
-                substitute = self._substitutions[needle]
-            elif identifier in self._substitutions:
-                substitute = self._substitutions[identifier]
+            :param plan: the compiled format
+            :type plan: :class:`_CompiledFormat`
+            :param substitutions: values or callables for the
+                needles or identifiers of the format
+            :type substitutions: dict
+            :param args: passed on to callable substitutions
+            :returns: the formatted text
+            :rtype: string
+        """
+        values = []
 
-            if substitute is not None:
-                prefix = parameters.pop('prefix', '')
-                suffix = parameters.pop('suffix', '')
-                pad = int(parameters.pop('pad', 0))
-                padstring = parameters.pop('padstring', '')
+        for field in plan.fields:
+            if field.needle in substitutions:
+                substitute = substitutions[field.needle]
+            else:
+                substitute = substitutions.get(field.identifier)
 
-                if callable(substitute):
-                    substitute = substitute(*args, **parameters)
+            if substitute is None:
+                values.append(field.fallback)
+                continue
 
-                if pad > 0 and padstring:
-                    # Decrease pad length by value length
-                    pad = max(0, pad - len(substitute))
-                    # Retrieve the maximum multiplier for the pad string
-                    padcount = pad / len(padstring) + 1
-                    # Generate pad string
-                    padstring = padcount * padstring
-                    # Clamp pad string
-                    padstring = padstring[0:pad]
-                    substitute = '%s%s' % (padstring, substitute)
+            if callable(substitute):
+                substitute = substitute(*args, **field.arguments)
 
-                if substitute:
-                    substitute = '%s%s%s' % (prefix, substitute, suffix)
+            pad = int(field.pad)
+            padstring = field.padstring
 
-                substitutions[needle] = substitute
+            if pad > 0 and padstring:
+                # Decrease pad length by value length
+                pad = max(0, pad - len(substitute))
+                # Retrieve the maximum multiplier for the pad string
+                padcount = pad / len(padstring) + 1
+                # Generate pad string
+                padstring = padcount * padstring
+                # Clamp pad string
+                padstring = padstring[0:pad]
+                substitute = '%s%s' % (padstring, substitute)
 
-        return self._template.safe_substitute(substitutions)
+            if substitute:
+                substitute = '%s%s%s' % (field.prefix, substitute, field.suffix)
+
+            # We use this idiom instead of str() because the latter
+            # will fail if val is a Unicode containing non-ASCII
+            values.append('%s' % (substitute,))
+
+        return ''.join([values[part] if part.__class__ is int else part
+            for part in plan.parts])
 
 class ProgressTextFormatter(Formatter):
     """
@@ -371,6 +476,35 @@ class ProgressTextFormatter(Formatter):
 
         return Formatter.format(self)
 
+_TAG_FORMATTERS = {}
+
+def _get_tag_formatter(tag):
+    """
+        Returns the registered formatter provider for a tag
+
+        :param tag: the name of the tag
+        :type tag: string
+        :returns: the provider or None
+        :rtype: :class:`TagFormatter`
+    """
+    try:
+        return _TAG_FORMATTERS[tag]
+    except KeyError:
+        provider = _TAG_FORMATTERS[tag] = \
+            providers.get_provider('tag-formatting', tag)
+        return provider
+
+def _on_tag_formatters_changed(type, manager, ptuple):
+    """
+        Forgets the formatter providers looked up so far
+    """
+    _TAG_FORMATTERS.clear()
+
+event.add_callback(_on_tag_formatters_changed,
+    'tag-formatting_provider_added')
+event.add_callback(_on_tag_formatters_changed,
+    'tag-formatting_provider_removed')
+
 class TrackFormatter(Formatter):
     """
         A formatter for track data
@@ -392,23 +526,47 @@ class TrackFormatter(Formatter):
             raise TypeError('First argument to format() needs '
                             'to be of type xl.trax.Track')
 
-        extractions = self.extract()
-        self._substitutions = {}
+        return self.format_tracks([track], markup_escape)[0]
 
-        for identifier, (tag, parameters) in extractions.iteritems():
-            provider = providers.get_provider('tag-formatting', tag)
+    def format_tracks(self, tracks, markup_escape=False):
+        """
+            Returns the formatted text for each of several tracks
 
-            if provider is None:
-                substitute = track.get_tag_display(tag)
-            else:
-                substitute = provider.format(track, parameters)
+            The format and the tag formatters it needs are
+            looked up once for all tracks.
+
+            :param tracks: the tracks to take data from
+            :type tracks: iterable of :class:`xl.trax.Track`
+            :param markup_escape: whether to escape markup-like
+                characters in tag values
+            :type markup_escape: bool
+            :returns: the formatted texts, in the order of the tracks
+            :rtype: list of strings
+        """
+        plan = self._compile()
+        fields = [(field.needle, field.parameters,
+                   _get_tag_formatter(field.identifier), field.identifier)
+                  for field in plan.fields]
+        render = self._render
+        results = []
 
-            if markup_escape:
-                substitute = GLib.markup_escape_text(substitute).decode('utf-8')
+        for track in tracks:
+            substitutions = {}
 
-            self._substitutions[identifier] = substitute
+            for needle, parameters, provider, tag in fields:
+                if provider is None:
+                    substitute = track.get_tag_display(tag)
+                else:
+                    substitute = provider.format(track, parameters)
 
-        return Formatter.format(self)
+                if markup_escape:
+                    substitute = GLib.markup_escape_text(substitute).decode('utf-8')
+
+                substitutions[needle] = substitute
+
+            results.append(render(plan, substitutions))
+
+        return results
 
 class TagFormatter():
     """
@@ -429,7 +587,8 @@ class TagFormatter():
 
             :param track: the track to get the tag from
             :type track: :class:`xl.trax.Track`
-            :param parameters: optionally passed parameters
+            :param parameters: optionally passed parameters,
+                shared between calls and thus not to be modified
             :type parameters: dictionary
             :returns: the formatted value
             :rtype: string
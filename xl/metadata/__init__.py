@@ -93,7 +93,16 @@ def get_format(loc):
     loc = Gio.File.new_for_uri(loc).get_path()
     if not loc:
         return None
-        
+
+    return get_format_for_path(loc)
+
+def get_format_for_path(loc):
+    """
+        Like get_format, but takes a local path. Does not use Gio, so
+        it is safe to call from collection scan worker processes.
+
+        :param loc: The path as returned by Gio.File.get_path()
+    """
     # XXX: The path that we get from GIO is, for some reason, in UTF-8.
     # Bug? Intended? No idea.
     
@@ -28,8 +28,10 @@
 from gi.repository import GLib
 from gi.repository import Gst
 
+import collections
 import logging
 import os
+import time
 import urlparse
 
 from xl import common
@@ -42,6 +44,7 @@ from .sink import create_device
 from xl.player.engine import ExaileEngine
 from xl.player.track_fader import TrackFader
 
+logger = logging.getLogger(__name__)
 
 
 class ExaileGstEngine(ExaileEngine):
@@ -52,6 +55,7 @@ class ExaileGstEngine(ExaileEngine):
         * gapless playback
         * crossfading (requires gst-plugins-bad)
         * Dynamic audio device switching at runtime
+        * prefetching of the next track, so that it starts quickly
         
         Notes about crossfading:
         
@@ -77,6 +81,18 @@ class ExaileGstEngine(ExaileEngine):
           installed). Create multiple AudioStream objects, and they have a
           DynamicAudioSink object hooked up to an interaudiosink.
                 
+        Prefetching:
+        
+        When a track starts, the start of the next track from the queue is
+        read in the background, so that its file (and its cover) are in the
+        page cache when it is played. This helps a lot with network shares.
+        Optionally, the next track is also pre-rolled in a paused third
+        AudioStream, which is swapped in when the track is played. This
+        keeps the audio device open twice, so it is disabled by default.
+        
+        The time from a play request until the stream is PLAYING is kept,
+        see :meth:`get_start_latencies`.
+        
         You can register plugins to modify the output audio via the following
         providers:
         
@@ -102,6 +118,13 @@ class ExaileGstEngine(ExaileEngine):
         self.user_fade_enabled = False
         self.user_fade_duration = 1000 
         
+        # Prefetching of the next track; size is in KiB
+        self.prefetch_size = 4096
+        self.preroll_enabled = False
+        
+        # (seconds, prerolled) for the most recent track starts
+        self.start_latencies = collections.deque(maxlen=100)
+        
         # Key: option name; value: attribute on self
         options = {
             '%s/crossfading' % self.name: 'crossfade_enabled',
@@ -112,7 +135,10 @@ class ExaileGstEngine(ExaileEngine):
             '%s/custom_sink_pipe' % self.name: 'custom_sink_pipe',
             
             '%s/user_fade_enabled' % self.name: 'user_fade_enabled',
-            '%s/user_fade' % self.name: 'user_fade_duration'
+            '%s/user_fade' % self.name: 'user_fade_duration',
+            
+            '%s/prefetch_size' % self.name: 'prefetch_size',
+            '%s/preroll_next' % self.name: 'preroll_enabled'
         }
         
         self.settings_unsubscribe = common.subscribe_for_settings(self.name, options, self)
@@ -133,6 +159,9 @@ class ExaileGstEngine(ExaileEngine):
         if name in ['audiosink_device', 'audiosink', 'custom_sink_pipe']:
             self._reconfigure_sink()
         
+        if name in ['crossfade_enabled', 'preroll_enabled']:
+            self._reconfigure_preroll()
+        
     #
     # API
     #
@@ -143,7 +172,9 @@ class ExaileGstEngine(ExaileEngine):
         
         self.main_stream = AudioStream(self)
         self.other_stream = None
+        self.preroll_stream = None
         self.crossfade_out = None
+        self.prefetched_track = None
         
         self.player.engine_load_volume()
         
@@ -170,6 +201,15 @@ class ExaileGstEngine(ExaileEngine):
         
         self.main_stream.reconfigure_fader(cf_duration, cf_duration)
     
+    def _reconfigure_preroll(self):
+        
+        # Crossfading uses the second stream already
+        if self.preroll_stream is not None and \
+                (self.crossfade_enabled or not self.preroll_enabled):
+            self.logger.info("Preroll: disabled")
+            self.preroll_stream.destroy()
+            self.preroll_stream = None
+    
     def _reconfigure_sink(self):
         
         self.logger.info("Reconfiguring audiosinks")
@@ -177,6 +217,11 @@ class ExaileGstEngine(ExaileEngine):
         self.main_stream.reconfigure_sink()
         if self.other_stream is not None:
             self.other_stream.reconfigure_sink()
+        
+        # The prerolled track would play on the old sink
+        if self.preroll_stream is not None:
+            self.preroll_stream.destroy()
+            self.preroll_stream = None
     
     def destroy(self, permanent=True):
         
@@ -185,6 +230,10 @@ class ExaileGstEngine(ExaileEngine):
         if self.other_stream is not None:
             self.other_stream.destroy()
         
+        if self.preroll_stream is not None:
+            self.preroll_stream.destroy()
+            self.preroll_stream = None
+        
         if permanent:
             self.settings_unsubscribe()
         
@@ -241,17 +290,32 @@ class ExaileGstEngine(ExaileEngine):
         self.main_stream.set_user_volume(volume)
         if self.other_stream is not None:
             self.other_stream.set_user_volume(volume)
+        if self.preroll_stream is not None:
+            self.preroll_stream.set_user_volume(volume)
             
     def stop(self):
         if self.other_stream is not None:
             self.other_stream.stop()
         
+        # Don't keep the audio device busy while stopped
+        if self.preroll_stream is not None:
+            self.preroll_stream.stop(emit_eos=False)
+        
         prior_track = self.main_stream.stop(emit_eos=False)
         self.player.engine_notify_track_end(prior_track, True)
     
     def unpause(self):
         self.main_stream.unpause()
     
+    def get_start_latencies(self):
+        '''
+            :returns: a list of (seconds, prerolled) tuples for the most
+                      recent track starts, from the request to play a track
+                      until its stream was playing. prerolled is True when
+                      the track had been pre-rolled.
+        '''
+        return list(self.start_latencies)
+    
     #
     # Engine private functions
     #
@@ -295,13 +359,78 @@ class ExaileGstEngine(ExaileEngine):
                                   self.crossfade_duration/1000.0,
                                   self.crossfade_duration/1000.0)
             self.other_stream.fader.fade_out_on_play()
-        elif self.user_fade_enabled and not autoadvance:
-            self.main_stream.play(track, start_at, paused, already_queued,
-                                  self.user_fade_duration/1000.0)
         else:
-            self.main_stream.play(track, start_at, paused, already_queued)
+            preroll_stream = self.preroll_stream
+            if preroll_stream is not None and not already_queued and \
+                    preroll_stream.prerolled_track is track:
+                self.main_stream.stop(emit_eos=False)
+                self.main_stream, self.preroll_stream = \
+                    preroll_stream, self.main_stream
+            
+            if self.user_fade_enabled and not autoadvance:
+                self.main_stream.play(track, start_at, paused, already_queued,
+                                      self.user_fade_duration/1000.0)
+            else:
+                self.main_stream.play(track, start_at, paused, already_queued)
         
         self.player.engine_notify_track_start(track)
+        
+        GLib.idle_add(self._prefetch_next_track)
+    
+    def _prefetch_next_track(self):
+        '''
+            Prepares the track that will probably be played next
+        '''
+        
+        queue = self.player.queue
+        if queue is None:
+            return
+        
+        track = queue.get_next()
+        if track is None:
+            return
+        
+        if self.prefetch_size > 0 and track is not self.prefetched_track:
+            self.prefetched_track = track
+            _warm_track(track, self.prefetch_size * 1024)
+        
+        if self.preroll_enabled and not self.crossfade_enabled:
+            if self.preroll_stream is None:
+                self.preroll_stream = AudioStream(self)
+                self.preroll_stream.set_user_volume(
+                    self.main_stream.get_user_volume())
+            if self.preroll_stream.prerolled_track is not track:
+                self.preroll_stream.preroll(track)
+    
+    def _record_start_latency(self, latency, prerolled):
+        
+        self.start_latencies.append((latency, prerolled))
+        self.logger.debug("Track started in %.1fms%s", latency * 1000,
+                          " (prerolled)" if prerolled else "")
+
+
+@common.threaded
+def _warm_track(track, size):
+    '''
+        Reads the start of a track and its cover, so that they come from
+        the page cache (or the gvfs cache) when the track is played.
+        The tags of a track are at the start of the file for most formats,
+        so they are warmed as well.
+    '''
+    
+    if track.is_local():
+        try:
+            with open(track.get_local_path(), 'rb') as f:
+                while size > 0 and f.read(min(size, 65536)):
+                    size -= 65536
+        except (IOError, OSError, TypeError) as e:
+            logger.debug("Could not prefetch track: %s", e)
+    
+    import xl.covers
+    try:
+        xl.covers.MANAGER.get_cover(track, set_only=True)
+    except Exception:
+        logger.debug("Could not prefetch cover", exc_info=True)
 
 
 class AudioStream(object):
@@ -323,6 +452,13 @@ class AudioStream(object):
         self.current_track = None
         self.buffered_track = None
         
+        # track that is prerolled (paused, but not played yet) by this stream
+        self.prerolled_track = None
+        
+        # when a request to play was made, to measure the start latency
+        self.start_time = None
+        self.start_prerolled = False
+        
         # This exists because if there is a sink error, it doesn't
         # really make sense to recreate the sink -- it'll just fail
         # again. Instead, wait for the user to try to play a track,
@@ -406,7 +542,11 @@ class AudioStream(object):
              fade_in_duration=None, fade_out_duration=None):
         '''fade duration is in seconds'''
         
-        if not already_queued:
+        # A prerolled stream is set up already, it only needs to start
+        prerolled = self.prerolled_track is track and not already_queued
+        self.prerolled_track = None
+        
+        if not already_queued and not prerolled:
             self.stop(emit_eos=False)
             
             # For the moment, the only safe time to add/remove elements
@@ -421,6 +561,10 @@ class AudioStream(object):
         if self.needs_sink:
             self.reconfigure_sink()
         
+        if not already_queued and not paused:
+            self.start_time = time.time()
+            self.start_prerolled = prerolled
+        
         self.current_track = track
         self.last_position = 0
         self.buffered_track = None
@@ -430,7 +574,7 @@ class AudioStream(object):
         
         
         # This is only set for gapless playback
-        if not already_queued:
+        if not already_queued and not prerolled:
             self.playbin.set_property("uri", uri)
             if urlparse.urlsplit(uri)[0] == "cdda":
                 self.notify_id = self.playbin.connect('source-setup',
@@ -452,6 +596,31 @@ class AudioStream(object):
         if paused:
             self.fader.pause()
     
+    def preroll(self, track):
+        '''
+            Sets up the stream to play track, and pauses it. The track
+            starts quickly when it is played with :meth:`play`.
+        '''
+        
+        self.stop(emit_eos=False)
+        
+        if self.audio_filters.setup_elements():
+            self.playbin.props.audio_filter = self.audio_filters
+        else:
+            self.playbin.props.audio_filter = None
+        
+        if self.needs_sink:
+            self.reconfigure_sink()
+        
+        uri = track.get_loc_for_io()
+        if urlparse.urlsplit(uri)[0] == "cdda":
+            return
+        
+        self.logger.debug("Prerolling %s", common.sanitize_url(uri))
+        self.prerolled_track = track
+        self.playbin.set_property("uri", uri)
+        self.playbin.set_state(Gst.State.PAUSED)
+    
     def seek(self, value):
         '''value is in seconds'''
         
@@ -489,6 +658,8 @@ class AudioStream(object):
     def stop(self, emit_eos=True):
         prior_track = self.current_track
         self.current_track = None
+        self.prerolled_track = None
+        self.start_time = None
         self.playbin.set_state(Gst.State.NULL)
         self.fader.stop()
         
@@ -557,7 +728,10 @@ class AudioStream(object):
             
             current = self.current_track
             
-            if not current.is_local():
+            if current is None:
+                # A prerolled track, this is handled once it plays
+                pass
+            elif not current.is_local():
                 gst_utils.parse_stream_tags(current, message.parse_tag())
             
             if current and not current.get_tag_raw('__length'):
@@ -590,6 +764,14 @@ class AudioStream(object):
             # state changes.
             if message.src == self.audio_sink:
                 self.playbin.notify("volume")
+            
+            elif message.src == self.playbin and self.start_time is not None:
+                new_state = message.parse_state_changed()[1]
+                if new_state == Gst.State.PLAYING:
+                    latency = time.time() - self.start_time
+                    self.start_time = None
+                    self.engine._record_start_latency(latency,
+                                                      self.start_prerolled)
         
         elif message.type == Gst.MessageType.ERROR:
             
@@ -608,6 +790,13 @@ class AudioStream(object):
                     if debug_info.startswith('playsink'):
                         message_text += _(': Possible audio device error, is it plugged in?')
             
+            if self.current_track is None and self.prerolled_track is not None:
+                # Not playing yet, so this will be retried if the track
+                # is played
+                self.logger.warning("Preroll error: %s", message_text)
+                self.stop(emit_eos=False)
+                return True
+            
             self.logger.error("Playback error: %s", message_text)
             self.logger.debug("- Extra error info: %s", debug_info)
             
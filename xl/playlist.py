@@ -30,16 +30,20 @@ in playlists as well as methods to import and export from various file formats.
 """
 
 from __future__ import with_statement
+import bisect
 import cgi
 from collections import namedtuple
 from datetime import datetime, timedelta
 from gi.repository import Gio
+import itertools
 import logging
 import os
 import random
+import threading
 import time
 import urlparse
 import urllib
+import weakref
 
 try:
     import cPickle as pickle
@@ -858,6 +862,302 @@ class XSPFConverter(FormatConverter):
         return playlist
 providers.register('playlist-format-converter', XSPFConverter())
 
+def _get_shuffle_weight_func():
+    """
+        Returns a function giving the weight of a track
+        for weighted shuffle, as set by ``playlist/shuffle_weight``
+    """
+    if settings.get_option('playlist/shuffle_weight', 'rating') == 'playcount':
+        def weight(track):
+            try:
+                return 1 + int(track.get_tag_raw('__playcount') or 0)
+            except (TypeError, ValueError):
+                return 1
+    else:
+        def weight(track):
+            return 1 + track.get_rating()
+    return weight
+
+class _ShufflePool(object):
+    """
+        Tracks which positions of a playlist were already played
+        in a shuffle run and chooses the next one
+
+        Unplayed positions are kept in an array from which entries
+        are removed by swapping in the last one, so choosing and
+        removing a position takes constant time. Albums with unplayed
+        tracks are kept the same way. Weighted choices use a binary
+        indexed tree of the weights and take logarithmic time.
+    """
+    def __init__(self, weight=None):
+        """
+            :param weight: a function returning the weight of a
+                track, or None for choices with equal probability
+        """
+        self.weight = weight
+        # Unplayed positions and their index in the array
+        self.unplayed = []
+        self.slots = {}
+        # Played positions, most recent last
+        self.played = []
+        # Album of each position and its sort key within the album
+        self.album_of = []
+        self.sort_keys = []
+        # Album -> sorted list of (sort key, position)
+        self.albums = {}
+        # Albums with unplayed tracks, their index and unplayed count
+        self.album_pool = []
+        self.album_slots = {}
+        self.album_unplayed = {}
+        # Weight of each track, and of each position while unplayed
+        self.track_weights = []
+        self.weights = []
+        # Binary indexed tree of the weights of the positions
+        self.tree = [0]
+        self.total = 0
+
+    def append(self, track):
+        """
+            Adds an unplayed track at the next position
+        """
+        position = len(self.album_of)
+        album = track.get_tag_raw('album')
+        album = tuple(album) if album else None
+        sort_key = (track.get_tag_sort('discnumber'),
+            track.get_tag_sort('tracknumber'), position)
+        self.album_of.append(album)
+        self.sort_keys.append(sort_key)
+
+        if album is not None:
+            bisect.insort(self.albums.setdefault(album, []),
+                (sort_key, position))
+
+        if self.weight is not None:
+            weight = self.weight(track)
+            self.track_weights.append(weight)
+            self.weights.append(weight)
+            self.total += weight
+            # The new node covers the positions after its lowest set bit
+            tree = self.tree
+            index = len(tree)
+            lowest = index - (index & -index)
+            child = index - 1
+            while child > lowest:
+                weight += tree[child]
+                child -= child & -child
+            tree.append(weight)
+
+        self.__add_unplayed(position)
+
+    def mark_played(self, position):
+        """
+            Removes a position from the unplayed ones
+        """
+        slot = self.slots.pop(position, None)
+
+        if slot is None:
+            return
+
+        last = self.unplayed.pop()
+        if last != position:
+            self.unplayed[slot] = last
+            self.slots[last] = slot
+        self.played.append(position)
+
+        album = self.album_of[position]
+        if album is not None:
+            self.album_unplayed[album] -= 1
+            if not self.album_unplayed[album]:
+                del self.album_unplayed[album]
+                slot = self.album_slots.pop(album)
+                last = self.album_pool.pop()
+                if last != album:
+                    self.album_pool[slot] = last
+                    self.album_slots[last] = slot
+
+        if self.weight is not None:
+            self.__update_weight(position, -self.weights[position])
+
+    def pop_played(self):
+        """
+            Returns the most recently played position to the
+            unplayed ones
+
+            :returns: the position, or -1 if none was played
+        """
+        if not self.played:
+            return -1
+
+        position = self.played.pop()
+        self.__add_unplayed(position)
+        return position
+
+    def choose_track(self):
+        """
+            Chooses a random unplayed position
+
+            :returns: the position, or -1 if all were played
+        """
+        if not self.unplayed:
+            return -1
+
+        if self.weight is None or self.total <= 0:
+            return random.choice(self.unplayed)
+
+        # Find the position at which the prefix sum of
+        # the weights exceeds a random value
+        value = random.randrange(self.total)
+        tree = self.tree
+        size = len(tree) - 1
+        position = 0
+        step = 1
+        while step * 2 <= size:
+            step *= 2
+        while step:
+            if position + step <= size and tree[position + step] <= value:
+                position += step
+                value -= tree[position]
+            step //= 2
+        return position
+
+    def choose_album_track(self, current_position):
+        """
+            Chooses the next unplayed track of the album at the
+            current position, or the first unplayed track of a
+            random album with unplayed tracks
+
+            :returns: the position, or -1 if all were played
+        """
+        slots = self.slots
+
+        if 0 <= current_position < len(self.album_of):
+            album = self.album_of[current_position]
+            if album is not None:
+                tracks = self.albums[album]
+                index = bisect.bisect_right(tracks,
+                    (self.sort_keys[current_position], current_position))
+                for sort_key, position in tracks[index:]:
+                    if position in slots:
+                        return position
+
+        if not self.album_pool:
+            return -1
+
+        album = random.choice(self.album_pool)
+        for sort_key, position in self.albums[album]:
+            if position in slots:
+                return position
+        return -1
+
+    def __add_unplayed(self, position):
+        if position in self.slots:
+            return
+
+        self.slots[position] = len(self.unplayed)
+        self.unplayed.append(position)
+
+        album = self.album_of[position]
+        if album is not None:
+            count = self.album_unplayed.get(album, 0)
+            self.album_unplayed[album] = count + 1
+            if not count:
+                self.album_slots[album] = len(self.album_pool)
+                self.album_pool.append(album)
+
+        if self.weight is not None and not self.weights[position]:
+            self.__update_weight(position, self.track_weights[position])
+
+    def __update_weight(self, position, delta):
+        self.weights[position] += delta
+        self.total += delta
+        tree = self.tree
+        index = position + 1
+        while index < len(tree):
+            tree[index] += delta
+            index += index & -index
+
+def _read_track_lines(f):
+    """
+        Yields the track lines of a playlist file, leaving the file
+        at the end marker which is followed by the attributes
+    """
+    while True:
+        offset = f.tell()
+        line = f.readline()
+        if line == "EOF\n" or line == "":
+            f.seek(offset)
+            return
+        yield line
+
+def _read_tracks(lines, chunk_size=1000):
+    """
+        Yields the tracks of playlist file lines in lists of up to
+        chunk_size tracks
+
+        The locations of each list are looked up in the collections
+        at once, tracks are only created for the remaining ones.
+    """
+    lines = iter(lines)
+
+    while True:
+        chunk = list(itertools.islice(lines, chunk_size))
+
+        if not chunk:
+            return
+
+        locs = []
+        metas = []
+
+        for line in chunk:
+            loc, sep, meta = line.strip().rpartition('\t')
+            if not sep:
+                loc, meta = meta, None
+            locs.append(loc)
+            metas.append(meta)
+
+        tracks = [None] * len(locs)
+        missing = range(len(locs))
+
+        for coll in list(collection.COLLECTIONS):
+            if not missing:
+                break
+
+            found = coll.get_tracks_by_locs([locs[i] for i in missing])
+            still_missing = []
+
+            for i, track in itertools.izip(missing, found):
+                if track is None:
+                    still_missing.append(i)
+                else:
+                    tracks[i] = track
+
+            missing = still_missing
+
+        for i in missing:
+            track = trax.Track(uri=locs[i])
+            meta = metas[i]
+
+            # readd meta
+            if not track.is_local() and meta is not None:
+                meta = cgi.parse_qs(meta)
+                for k, v in meta.iteritems():
+                    track.set_tag_raw(k, v[0].decode('utf-8'), notify_changed=False)
+
+            tracks[i] = track
+
+        yield tracks
+
+def _get_file_state(location):
+    """
+        Returns the size and modification time of a file, or None
+        if it does not exist
+    """
+    try:
+        stat = os.stat(location)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime
+
 class Playlist(object):
     # TODO: how do we document events in sphinx?
     """
@@ -876,10 +1176,11 @@ class Playlist(object):
             * playlist_dynamic_mode_changed
     """
     #: Valid shuffle modes (list of string)
-    shuffle_modes = ['disabled', 'track', 'album']
+    shuffle_modes = ['disabled', 'track', 'album', 'weighted']
     #: Titles of the valid shuffle modes (list of string)
     shuffle_mode_names = [_('Shuffle _Off'),
-            _('Shuffle _Tracks'), _('Shuffle _Albums')]
+            _('Shuffle _Tracks'), _('Shuffle _Albums'),
+            _('Shuffle _Weighted')]
     #: Valid repeat modes (list of string)
     repeat_modes = ['disabled', 'all', 'track']
     #: Titles of the valid repeat modes (list of string)
@@ -891,6 +1192,8 @@ class Playlist(object):
     save_attrs = ['shuffle_mode', 'repeat_mode', 'dynamic_mode',
             'current_position', 'name']
     __playlist_format_version = [2, 0]
+    # Playlists whose tracks are still to be read from their file
+    __lazy_playlists = weakref.WeakSet()
 
     def __init__(self, name, initial_tracks=[]):
         """
@@ -900,11 +1203,26 @@ class Playlist(object):
                 populate the playlist initially
             :type initial_tracks: list of :class:`xl.trax.Track`
         """
-        self.__tracks = MetadataList()
+        self.__track_list = MetadataList()
+        # File to read the tracks from when first needed and the current
+        # position to restore then, set by a lazy load_from_location
+        self.__lazy = None
+        # Held while the tracks are read, see load_tracks
+        self.__load_lock = threading.RLock()
+        self.__loading = False
         for track in initial_tracks:
             if not isinstance(track, trax.Track):
                 raise ValueError("Need trax.Track object, got %r" % type(track))
             self.__tracks.append(track)
+        # Location, end of the track lines, state and number of tracks
+        # of the file last saved or loaded, and how many leading tracks
+        # are still the same
+        self.__saved = None
+        self.__saved_tracks = 0
+        # Maps each track to its positions, built when first needed
+        self.__positions = None
+        # Unplayed tracks of the shuffle run, built when first needed
+        self.__shuffle_pool = None
         self.__shuffle_mode = self.shuffle_modes[0]
         self.__repeat_mode = self.repeat_modes[0]
         self.__dynamic_mode = self.dynamic_modes[0]
@@ -935,6 +1253,16 @@ class Playlist(object):
     name = property(lambda self: self.__name, _set_name)
     #: Whether the playlist was changed or not (boolean)
     dirty = property(lambda self: self.__dirty)
+    #: Whether the tracks were read, see :meth:`load_tracks` (boolean)
+    loaded = property(lambda self: self.__lazy is None)
+
+    def __get_tracks(self):
+        if self.__lazy is not None:
+            self.load_tracks()
+        return self.__track_list
+
+    # The tracks, read first if the playlist was loaded lazily
+    __tracks = property(__get_tracks)
 
     def clear(self):
         """
@@ -949,6 +1277,8 @@ class Playlist(object):
             :returns: the position
             :rtype: int
         """
+        if self.__lazy is not None:
+            self.load_tracks()
         return self.__current_position
 
     def set_current_position(self, position):
@@ -958,6 +1288,8 @@ class Playlist(object):
             :param position: the new position
             :type position: int
         """
+        if self.__lazy is not None:
+            self.load_tracks()
         self.__next_data = None
         oldposition = self.__current_position
         if oldposition == position:
@@ -1040,11 +1372,59 @@ class Playlist(object):
             Clear the history of played
             tracks from a shuffle run
         """
-        for i in xrange(len(self)):
+        # Tracks still to be read have no history
+        tracks = self.__track_list
+        for i in xrange(len(tracks)):
             try:
-                self.__tracks.del_meta_key(i, "playlist_shuffle_history")
+                tracks.del_meta_key(i, "playlist_shuffle_history")
             except:
                 pass
+        self.__shuffle_pool = None
+
+    def __get_shuffle_pool(self, mode):
+        """
+            Returns the pool of unplayed tracks for a shuffle mode,
+            building it from the shuffle history if needed
+        """
+        pool = self.__shuffle_pool
+        weighted = mode == 'weighted'
+
+        if pool is None or (pool.weight is not None) != weighted:
+            pool = self.__shuffle_pool = _ShufflePool(
+                _get_shuffle_weight_func() if weighted else None)
+            history = []
+
+            for position, track in enumerate(self.__tracks):
+                pool.append(track)
+                counter = self.__tracks.get_meta_key(position,
+                    'playlist_shuffle_history')
+                if counter:
+                    history.append((counter, position))
+
+            for counter, position in sorted(history):
+                pool.mark_played(position)
+
+        return pool
+
+    def __update_shuffle_pool(self, removed, added):
+        """
+            Updates the shuffle pool after a change, appended
+            tracks are added and anything else drops the pool
+        """
+        pool = self.__shuffle_pool
+
+        if pool is None:
+            return
+
+        if removed or not added or \
+                added[0][0] != len(self.__tracks) - len(added):
+            self.__shuffle_pool = None
+            return
+
+        for position, track in added:
+            pool.append(track)
+            if self.__tracks.get_meta_key(position, 'playlist_shuffle_history'):
+                pool.mark_played(position)
 
     @common.threaded
     def __fetch_dynamic_tracks(self):
@@ -1055,48 +1435,17 @@ class Playlist(object):
             Returns a valid next track if shuffle is activated based
             on random_mode
         """
-        if mode == "album":
-            # TODO: we really need proper album-level operations in
-            # xl.trax for this
-            try:
-                # Try and get the next track on the album
-                # NB If the user starts the playlist from the middle
-                # of the album some tracks of the album remain off the
-                # tracks_history, and the album can be selected again
-                # randomly from its first track
-                if current_position == -1:
-                    raise IndexError
-                curr = self[current_position]
-                t = [ x for i, x in enumerate(self) \
-                    if x.get_tag_raw('album') == curr.get_tag_raw('album') \
-                    and i > current_position ]
-                t = trax.sort_tracks(['discnumber', 'tracknumber'], t)
-                return self.__tracks.index(t[0]), t[0]
-
-            except IndexError: #Pick a new album
-                hist = set(self.get_shuffle_history())
-                albums = set()
-                for i, x in enumerate(self):
-                    if (i, x) in hist:
-                        continue
-                    alb = x.get_tag_raw('album')
-                    if alb:
-                        albums.add(tuple(alb))
-                if not albums:
-                    return -1, None
-                album = list(random.choice(list(albums)))
-                t = [ x for x in self if x.get_tag_raw('album') == album ]
-                t = trax.sort_tracks(['tracknumber'], t)
-                return self.__tracks.index(t[0]), t[0]
+        pool = self.__get_shuffle_pool(mode)
+
+        if mode == 'album':
+            position = pool.choose_album_track(current_position)
         else:
-            hist = { i for i, tr in self.get_shuffle_history() }
-            try:
-                return random.choice([ (i, self.__tracks[i]) for i, tr in enumerate(self.__tracks)
-                        if i not in hist])
-            except IndexError: # no more tracks
-                return -1, None
-                
-    
+            position = pool.choose_track()
+
+        if position < 0: # no more tracks
+            return -1, None
+        return position, self.__tracks[position]
+
     def __get_next(self, current_position):
         
         # don't recalculate
@@ -1120,6 +1469,7 @@ class Playlist(object):
                 self.__tracks.set_meta_key(current_position,
                         "playlist_shuffle_history", self.__shuffle_history_counter)
                 self.__shuffle_history_counter += 1
+                self.__get_shuffle_pool(shuffle_mode).mark_played(current_position)
             next_index, next = self.__next_random_track(current_position, shuffle_mode)
             if next is not None:
                 self.__next_data = (None, next_index)
@@ -1198,9 +1548,9 @@ class Playlist(object):
             return self.current
 
         if shuffle_mode != 'disabled':
-            try:
-                prev_index, prev = max(self.get_shuffle_history())
-            except IndexError:
+            # Go back to the track played most recently
+            prev_index = self.__get_shuffle_pool(shuffle_mode).pop_played()
+            if prev_index < 0:
                 return self.get_current()
             self.__tracks.del_meta_key(prev_index, 'playlist_shuffle_history')
             self.current_position = prev_index
@@ -1238,6 +1588,8 @@ class Playlist(object):
         else:
             self.__dirty = True
             setattr(self, "_Playlist__%s_mode"%modename, mode)
+            # the next track may have been chosen with the old mode
+            self.__next_data = None
             event.log_event("playlist_%s_mode_changed"%modename, self, mode)
 
     def get_shuffle_mode(self):
@@ -1367,14 +1719,38 @@ class Playlist(object):
         """
             Writes the content of the playlist to a given location
 
+            If the playlist was last saved to or loaded from the same
+            file, the file was not changed since and tracks were only
+            appended to the playlist, just the appended tracks and the
+            attributes are written.
+
             :param location: the location to save to
             :type location: string
         """
-        if os.path.exists(location):
-            f = open(location + ".new", "w")
+        self._load_lazy(location, exclude=self)
+        saved = self.__saved
+
+        # The tracks were not even read if the playlist is lazy, so
+        # they are the same as in the file
+        if saved is not None and saved[0] == location and \
+                saved[2] == _get_file_state(location) and \
+                (self.__lazy is not None or self.__saved_tracks == saved[3]):
+            if self.__lazy is None:
+                tracks = self.__tracks[saved[3]:]
+            else:
+                tracks = []
+            path = location
+            f = open(location, "r+")
+            f.seek(saved[1])
         else:
-            f = open(location, "w")
-        for track in self.__tracks:
+            tracks = self.__tracks
+            if os.path.exists(location):
+                path = location + ".new"
+            else:
+                path = location
+            f = open(path, "w")
+
+        for track in tracks:
             buffer = track.get_loc_for_io()
             # write track metadata
             meta = {}
@@ -1394,27 +1770,43 @@ class Playlist(object):
             except UnicodeDecodeError:
                 continue
 
+        offset = f.tell()
         f.write("EOF\n")
         for item in self.save_attrs:
-            val = getattr(self, item)
+            if item == 'current_position' and self.__lazy is not None:
+                val = self.__lazy[1]
+            else:
+                val = getattr(self, item)
             try:
                 strn = settings.MANAGER._val_to_str(val)
             except ValueError:
                 strn = ""
 
             f.write("%s=%s\n"%(item,strn))
+        f.truncate()
         f.close()
-        if os.path.exists(location + ".new"):
+        if path != location:
             os.remove(location)
-            os.rename(location + ".new", location)
+            os.rename(path, location)
+
+        if self.__lazy is None:
+            self.__saved_tracks = len(self.__tracks)
+            self.__saved = (location, offset, _get_file_state(location),
+                    self.__saved_tracks)
+        else:
+            self.__saved = (location, offset, _get_file_state(location),
+                    None)
         self.__needs_save = self.__dirty = False
 
-    def load_from_location(self, location):
+    def load_from_location(self, location, lazy=False):
         """
             Loads the content of the playlist from a given location
 
             :param location: the location to load from
             :type location: string
+            :param lazy: only read the attributes now and the tracks
+                when they are first needed, see :meth:`load_tracks`
+            :type lazy: bool
         """
         # note - this is not guaranteed to fire events when it sets
         # attributes. It is intended ONLY for initial setup, not for
@@ -1428,25 +1820,26 @@ class Playlist(object):
                 pass
         if not f:
             return
-        locs = []
-        while True:
-            line = f.readline()
-            if line == "EOF\n" or line == "":
-                break
-            locs.append(line.strip())
-        items = {}
-        while True:
-            line = f.readline()
-            if line == "":
-                break
 
-            try:
-                item, strn = line[:-1].split("=",1)
-            except ValueError:
-                continue # Skip erroneous lines
+        with f:
+            if lazy:
+                for line in _read_track_lines(f):
+                    pass
+            else:
+                trs = []
+                for tracks in _read_tracks(_read_track_lines(f)):
+                    trs.extend(tracks)
+            offset = f.tell()
+
+            items = {}
+            for line in f:
+                try:
+                    item, strn = line[:-1].split("=",1)
+                except ValueError:
+                    continue # Skip erroneous lines and the end marker
 
-            val = settings.MANAGER._str_to_val(strn)
-            items[item] = val
+                val = settings.MANAGER._str_to_val(strn)
+                items[item] = val
 
         ver = items.get("__playlist_format_version", [1])
         if ver[0] == 1:
@@ -1456,31 +1849,26 @@ class Playlist(object):
             raise IOError("Cannot load playlist, unknown format")
         elif ver > self.__playlist_format_version:
             logger.warning("Playlist created on a newer Exaile version, some attributes may not be handled.")
-        f.close()
-
-        trs = []
-
-        for loc in locs:
-            meta = None
-            if loc.find('\t') > -1:
-                splitted = loc.split('\t')
-                loc = "\t".join(splitted[:-1])
-                meta = splitted[-1]
-
-            track = None
-            track = trax.Track(uri=loc)
-
-            # readd meta
-            if not track: continue
-            if not track.is_local() and meta is not None:
-                meta = cgi.parse_qs(meta)
-                for k, v in meta.iteritems():
-                    track.set_tag_raw(k, v[0].decode('utf-8'), notify_changed=False)
-
-            trs.append(track)
-
-        self.__tracks[:] = trs
 
+        if lazy:
+            # The current position needs the tracks, so it is
+            # restored along with them
+            self.__lazy = (loc, items.pop('current_position', None))
+            self.__lazy_playlists.add(self)
+            self.__track_list[:] = []
+        else:
+            self.__lazy = None
+            self.__lazy_playlists.discard(self)
+            self.__track_list[:] = trs
+            self.__saved_tracks = len(trs)
+        self.__positions = None
+        self.__shuffle_pool = None
+
+        if loc == location:
+            self.__saved = (location, offset, _get_file_state(location),
+                    None if lazy else len(trs))
+        else:
+            self.__saved = None
 
         for item, val in items.iteritems():
             if item in self.save_attrs:
@@ -1489,6 +1877,76 @@ class Playlist(object):
                 except TypeError: # don't bail if we try to set an invalid mode
                     logger.debug("Got a TypeError when trying to set attribute %s to %s during playlist restore." % (item, val))
 
+    def load_tracks(self):
+        """
+            Reads the tracks of a playlist loaded lazily with
+            :meth:`load_from_location`
+
+            This happens by itself once the tracks or the current
+            position are first needed.
+        """
+        if self.__lazy is None:
+            return
+
+        # Other threads wait until the tracks and the position are in
+        # place; the thread reading them gets what is there so far.
+        with self.__load_lock:
+            if self.__lazy is None or self.__loading:
+                return
+            self.__loading = True
+            try:
+                self.__read_lazy_tracks(*self.__lazy)
+            finally:
+                self.__lazy = None
+                self.__lazy_playlists.discard(self)
+                self.__loading = False
+
+    def __read_lazy_tracks(self, path, position):
+        try:
+            f = open(path, 'r')
+        except IOError:
+            logger.warning("Could not read the tracks of playlist %r "
+                    "from %r", self.name, path)
+            self.__saved = None
+            return
+
+        trs = []
+        with f:
+            for tracks in _read_tracks(_read_track_lines(f)):
+                trs.extend(tracks)
+            offset = f.tell()
+
+        self.__track_list[:] = trs
+        self.__positions = None
+        self.__shuffle_pool = None
+
+        # The file might have been changed in the meantime
+        if self.__saved is not None:
+            self.__saved = (path, offset, _get_file_state(path), len(trs))
+        self.__saved_tracks = len(trs)
+
+        if position is not None:
+            try:
+                self.current_position = position
+            except (TypeError, IndexError):
+                logger.debug("Could not restore position %s of playlist %r",
+                        position, self.name)
+
+    @classmethod
+    def _load_lazy(cls, location, exclude=None):
+        """
+            Reads the tracks of lazily loaded playlists before the
+            file at location is replaced or removed
+
+            :param exclude: a playlist which should stay unread
+        """
+        paths = (location, location + ".new")
+
+        for playlist in list(cls.__lazy_playlists):
+            if playlist is not exclude and playlist.__lazy is not None \
+                    and playlist.__lazy[0] in paths:
+                playlist.load_tracks()
+
     def reverse(self):
         # reverses current view
         pass
@@ -1501,7 +1959,7 @@ class Playlist(object):
         return len(self.__tracks)
 
     def __contains__(self, track):
-        return track in self.__tracks
+        return track in self.__get_positions()
 
     def __tuple_from_slice(self, i):
         """
@@ -1522,6 +1980,86 @@ class Playlist(object):
                 newpos += 1
         self.current_position = newpos
 
+    def __get_positions(self):
+        """
+            Returns the index of track positions, building it if needed
+        """
+        positions = self.__positions
+
+        if positions is None:
+            positions = self.__positions = {}
+
+            for position, track in enumerate(self.__tracks):
+                try:
+                    positions[track].append(position)
+                except KeyError:
+                    positions[track] = [position]
+
+        return positions
+
+    def __update_positions(self, removed, added):
+        """
+            Updates the index of track positions after a change
+
+            Appending tracks and removing them from the end are
+            applied directly, anything else shifts the positions
+            of other tracks and the index is rebuilt when next needed.
+        """
+        positions = self.__positions
+
+        if positions is None:
+            return
+
+        # Positions of removed tracks refer to the old length
+        length = len(self.__tracks) + len(removed) - len(added)
+
+        if removed:
+            if removed[0][0] != length - len(removed) or \
+                    removed[-1][0] != length - 1:
+                self.__positions = None
+                return
+
+            for position, track in removed:
+                track_positions = positions[track]
+                track_positions.pop()
+
+                if not track_positions:
+                    del positions[track]
+
+            length -= len(removed)
+
+        if added:
+            if added[0][0] != length:
+                self.__positions = None
+                return
+
+            for position, track in added:
+                try:
+                    positions[track].append(position)
+                except KeyError:
+                    positions[track] = [position]
+
+    def __update_saved(self, removed, added):
+        """
+            Notes how many leading tracks are still the same as in the
+            file the playlist was last saved to or loaded from
+        """
+        for changes in (removed, added):
+            if changes:
+                first = min(position for position, track in changes)
+                self.__saved_tracks = min(self.__saved_tracks, first)
+
+    def get_positions(self, track):
+        """
+            Retrieves all positions of a track within the playlist
+
+            :param track: the track to look for
+            :type track: :class:`xl.trax.Track`
+            :returns: the positions in ascending order
+            :rtype: list of int
+        """
+        return list(self.__get_positions().get(track, ()))
+
     def __getitem__(self, i):
         return self.__tracks.__getitem__(i)
 
@@ -1560,6 +2098,11 @@ class Playlist(object):
             removed = [(i, oldtracks)]
             added = [(i, value)]
 
+        self.__update_positions(removed, added)
+        self.__update_shuffle_pool(removed, added)
+        self.__update_saved(removed, added)
+        self.__next_data = None
+
         self.on_tracks_changed()
 
         if removed:
@@ -1584,6 +2127,11 @@ class Playlist(object):
         else:
             removed = [(i, oldtracks)]
 
+        self.__update_positions(removed, [])
+        self.__update_shuffle_pool(removed, [])
+        self.__update_saved(removed, [])
+        self.__next_data = None
+
         self.on_tracks_changed()
         event.log_event('playlist_tracks_removed', self, removed)
         self.__adjust_current_pos(oldpos, removed, [])
@@ -1612,7 +2160,7 @@ class Playlist(object):
             :returns: the count
             :rtype: int
         """
-        return self.__tracks.count(other)
+        return len(self.__get_positions().get(other, ()))
 
     def index(self, item, start=0, end=None):
         """
@@ -1621,10 +2169,16 @@ class Playlist(object):
             :returns: the index
             :rtype: int
         """
-        if end is None:
-            return self.__tracks.index(item, start)
-        else:
-            return self.__tracks.index(item, start, end)
+        length = len(self.__tracks)
+        # Same semantics as list.index for negative bounds
+        start, end, step = slice(start, end).indices(length)
+        positions = self.__get_positions().get(item, ())
+        index = bisect.bisect_left(positions, start)
+
+        if index < len(positions) and positions[index] < end:
+            return positions[index]
+
+        raise ValueError('%r is not in playlist' % (item,))
 
     def pop(self, i=-1):
         """
@@ -1937,7 +2491,12 @@ class SmartPlaylist(object):
         pickle.dump(pdata, f)
         f.close()
 
-    def load_from_location(self, location):
+    def load_from_location(self, location, lazy=False):
+        """
+            Loads the playlist from a given location
+
+            :param lazy: ignored, smart playlists are always read at once
+        """
         try:
             f = open(location, 'rb')
             pdata = pickle.load(f)
@@ -2006,9 +2565,11 @@ class PlaylistManager(object):
             @param name: the name of the playlist to remove
         """
         if name in self.playlists:
+            location = os.path.join(self.playlist_dir, encode_filename(name))
+            # playlists still to read their tracks from it need them now
+            Playlist._load_lazy(location)
             try:
-                os.remove(os.path.join(self.playlist_dir,
-                    encode_filename(name)))
+                os.remove(location)
             except OSError:
                 pass
             self.playlists.remove(name)
@@ -2036,7 +2597,9 @@ class PlaylistManager(object):
             # temporary stuff in the same dir.
             if f != os.path.basename(self.order_file) and not f.startswith("."):
                 pl = self._create_playlist(f)
-                pl.load_from_location(os.path.join(self.playlist_dir, f))
+                # only the name is needed, so leave the tracks unread
+                pl.load_from_location(os.path.join(self.playlist_dir, f),
+                        lazy=True)
                 existing.append(pl.name)
 
         # if order_file exists then use it
@@ -2046,16 +2609,18 @@ class PlaylistManager(object):
         else:
             self.playlists = existing
 
-    def get_playlist(self, name):
+    def get_playlist(self, name, lazy=False):
         """
             Gets a playlist by name
 
             @param name: the name of the playlist you wish to retrieve
+            @param lazy: Set to [True] to only read the tracks of the
+                playlist when they are first needed
         """
         if name in self.playlists:
             pl = self._create_playlist(name)
             pl.load_from_location(os.path.join(self.playlist_dir,
-                encode_filename(name)))
+                encode_filename(name)), lazy)
             return pl
         else:
             raise ValueError("No such playlist '%s'" % name)
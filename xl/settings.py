@@ -29,6 +29,7 @@
 """
 
 from __future__ import with_statement
+import ast
 from ConfigParser import (
     RawConfigParser,
     NoSectionError,
@@ -37,13 +38,14 @@ from ConfigParser import (
 import logging
 import os
 import sys
+import threading
 
 from gi.repository import GLib
 
 logger = logging.getLogger(__name__)
 
 from xl import event, xdg
-from xl.common import VersionError, glib_wait, glib_wait_seconds
+from xl.common import VersionError, glib_wait_seconds
 from xl.nls import gettext as _
 
 TYPE_MAPPING = {
@@ -58,6 +60,20 @@ TYPE_MAPPING = {
 
 MANAGER = None
 
+# Cached for options which do not exist
+_MISSING = object()
+
+def _copy_value(value):
+    """
+        Copies the lists and dictionaries within a value, so that
+        callers cannot change cached values
+    """
+    if isinstance(value, list):
+        return [_copy_value(v) for v in value]
+    if isinstance(value, dict):
+        return dict((k, _copy_value(v)) for k, v in value.iteritems())
+    return value
+
 class SettingsManager(RawConfigParser):
     """
         Manages Exaile's settings
@@ -82,6 +98,13 @@ class SettingsManager(RawConfigParser):
         self.location = location
         self._saving = False
         self._dirty = False
+        self._save_source = None
+
+        # Decoded values by option path, and the option paths cached
+        # for each section and key
+        self._cache = {}
+        self._cache_options = {}
+        self._cache_lock = threading.Lock()
 
         if default_location is not None:
             try:
@@ -147,15 +170,24 @@ class SettingsManager(RawConfigParser):
         splitvals = option.split('/')
         section, key = "/".join(splitvals[:-1]), splitvals[-1]
 
-        try:
-            self.set(section, key, value)
-        except NoSectionError:
-            self.add_section(section)
-            self.set(section, key, value)
-
-        self._dirty = True
-        
-        if save:
+        with self._cache_lock:
+            try:
+                changed = self.get(section, key) != value
+            except (NoSectionError, NoOptionError):
+                changed = True
+
+            if changed:
+                try:
+                    self.set(section, key, value)
+                except NoSectionError:
+                    self.add_section(section)
+                    self.set(section, key, value)
+
+                self._uncache(section, key)
+                self._dirty = True
+
+        # Setting an option to its value does not need a save
+        if save and changed:
             self.delayed_save()
 
         section = section.replace('/', '_')
@@ -175,19 +207,49 @@ class SettingsManager(RawConfigParser):
             :returns: the option value or *default*
             :rtype: any
         """
+        try:
+            value = self._cache[option]
+        except KeyError:
+            value = self._cache_option(option)
+
+        if value is _MISSING:
+            return default
+
+        if isinstance(value, (list, dict)):
+            return _copy_value(value)
+
+        return value
+
+    def _cache_option(self, option):
+        """
+            Decodes the value of an option and caches it
+
+            :returns: the value or _MISSING
+        """
         splitvals = option.split('/')
         section, key = "/".join(splitvals[:-1]), splitvals[-1]
 
-        try:
-            value = self.get(section, key)
-            value = self._str_to_val(value)
-        except NoSectionError:
-            value = default
-        except NoOptionError:
-            value = default
+        with self._cache_lock:
+            try:
+                value = self._str_to_val(self.get(section, key))
+            except (NoSectionError, NoOptionError):
+                value = _MISSING
+
+            self._cache[option] = value
+            self._cache_options.setdefault(
+                (section, self.optionxform(key)), []).append(option)
 
         return value
 
+    def _uncache(self, section, key):
+        """
+            Drops the cached values of an option, call with
+            the cache lock held
+        """
+        for option in self._cache_options.pop(
+                (section, self.optionxform(key)), ()):
+            self._cache.pop(option, None)
+
     def has_option(self, option):
         """
             Returns information about the existence
@@ -214,7 +276,9 @@ class SettingsManager(RawConfigParser):
         splitvals = option.split('/')
         section, key = "/".join(splitvals[:-1]), splitvals[-1]
 
-        RawConfigParser.remove_option(self, section, key)
+        with self._cache_lock:
+            RawConfigParser.remove_option(self, section, key)
+            self._uncache(section, key)
 
     def _set_direct(self, option, value):
         """
@@ -229,11 +293,14 @@ class SettingsManager(RawConfigParser):
         splitvals = option.split('/')
         section, key = "/".join(splitvals[:-1]), splitvals[-1]
 
-        try:
-            self.set(section, key, value)
-        except NoSectionError:
-            self.add_section(section)
-            self.set(section, key, value)
+        with self._cache_lock:
+            try:
+                self.set(section, key, value)
+            except NoSectionError:
+                self.add_section(section)
+                self.set(section, key, value)
+
+            self._uncache(section, key)
 
         event.log_event('option_set', self, option)
 
@@ -263,7 +330,11 @@ class SettingsManager(RawConfigParser):
 
         # Lists and dictionaries are special case
         if kind in ('L', 'D'):
-            return eval(value)
+            try:
+                return ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                logger.warning("Ignoring invalid setting value %r", value)
+                return ''
 
         if kind in TYPE_MAPPING.keys():
             if kind == 'B':
@@ -279,10 +350,21 @@ class SettingsManager(RawConfigParser):
         else:
             raise ValueError(_("An Unknown type of setting was found!"))
 
-    @glib_wait(500)
     def delayed_save(self):
         '''Save options after a delay, waiting for multiple saves to accumulate'''
+        if self.location is None:
+            return
+
+        # Each call postpones the save, so a burst of changes is
+        # written once it is over
+        if self._save_source is not None:
+            GLib.source_remove(self._save_source)
+        self._save_source = GLib.timeout_add(500, self._on_delayed_save)
+
+    def _on_delayed_save(self):
+        self._save_source = None
         self.save()
+        return False
 
     def save(self):
         """
@@ -0,0 +1,476 @@
+# Copyright (C) 2008-2010 Adam Olsen
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+    Structures that a :class:`TrackDB` keeps up to date alongside its
+    tracks: an inverted tag index used to answer searches without
+    looking at every track, and presorted track orders.
+
+    A tag condition of a search only ever looks at one value per track
+    (see :func:`search_value`), so the index maps each distinct value
+    of a tag to the tracks having it. Conditions are then evaluated
+    once per distinct value instead of once per track; exact and
+    substring conditions, and regular expressions anchored to a
+    literal prefix, only look at the values that can possibly match.
+
+    The index is only used to narrow down the tracks a search looks
+    at; every candidate is still checked against the full search, so
+    results are exactly the same as with a linear scan.
+"""
+
+from __future__ import with_statement
+
+import bisect
+import re
+import threading
+from collections import OrderedDict
+
+from xl import event
+from xl.trax import search
+from xl.trax.track import Track
+
+# characters that have no special meaning in regular expressions
+_LITERAL_RE = re.compile(r'\^([\w \-\',]+)', re.UNICODE)
+
+
+def search_value(track, tag):
+    """
+        Returns the value of a tag that a search condition on that tag
+        compares against, before case folding, or None if no condition
+        can match the track.
+
+        Unlike the values used by searches, this is not memoized on the
+        track, which would double the memory used for indexed tags.
+    """
+    return search._normalize(track.get_tag_search(tag, format=False))
+
+
+def _literal_prefix(pattern):
+    """
+        Returns the literal text a regular expression requires at the
+        start of a match, or None
+    """
+    if '|' in pattern:
+        return None
+    m = _LITERAL_RE.match(pattern)
+    if not m:
+        return None
+    prefix = m.group(1)
+    # the last character is optional if a quantifier follows it
+    if pattern[m.end():m.end()+1] in ('*', '?', '{'):
+        prefix = prefix[:-1]
+    return prefix
+
+
+def _trigrams(value):
+    return set(value[i:i+3] for i in xrange(len(value) - 2))
+
+
+class _TagValues(object):
+    """
+        Index of the values of a single tag
+    """
+    __slots__ = ['tracks', 'values', 'lowered', 'trigrams', '_sorted']
+
+    def __init__(self):
+        #: value -> set of tracks
+        self.tracks = {}
+        #: track -> value
+        self.values = {}
+        #: lowered value -> set of values
+        self.lowered = {}
+        #: trigram of lowered value -> set of values
+        self.trigrams = {}
+        self._sorted = None
+
+    def add(self, track, value):
+        self.remove(track)
+        if value is None:
+            return
+        self.values[track] = value
+        tracks = self.tracks.get(value)
+        if tracks is None:
+            tracks = self.tracks[value] = set()
+            lowered = value.lower()
+            self.lowered.setdefault(lowered, set()).add(value)
+            for trigram in _trigrams(lowered):
+                self.trigrams.setdefault(trigram, set()).add(value)
+            self._sorted = None
+        tracks.add(track)
+
+    def remove(self, track):
+        value = self.values.pop(track, None)
+        if value is None:
+            return
+        tracks = self.tracks[value]
+        tracks.discard(track)
+        if tracks:
+            return
+        del self.tracks[value]
+        lowered = value.lower()
+        self._discard(self.lowered, lowered, value)
+        for trigram in _trigrams(lowered):
+            self._discard(self.trigrams, trigram, value)
+        self._sorted = None
+
+    @staticmethod
+    def _discard(mapping, key, value):
+        values = mapping[key]
+        values.discard(value)
+        if not values:
+            del mapping[key]
+
+    def with_prefix(self, prefix):
+        """
+            Returns all values whose lowered form starts with prefix
+        """
+        if self._sorted is None:
+            self._sorted = sorted(self.lowered)
+        start = bisect.bisect_left(self._sorted, prefix)
+        values = []
+        for lowered in self._sorted[start:]:
+            if not lowered.startswith(prefix):
+                break
+            values.extend(self.lowered[lowered])
+        return values
+
+    def candidate_values(self, matcher):
+        """
+            Returns the values that may satisfy a condition
+        """
+        content = matcher.content
+        if isinstance(matcher, search._ExactMatcher):
+            if content is None:
+                return ()
+            return self.lowered.get(content.lower(), ())
+        elif isinstance(matcher, search._InMatcher):
+            if content and len(content) >= 3:
+                values = None
+                for trigram in _trigrams(content.lower()):
+                    found = self.trigrams.get(trigram)
+                    if not found:
+                        return ()
+                    if values is None:
+                        values = found
+                    else:
+                        values = values & found
+                return values
+        elif isinstance(matcher, search._RegexMatcher):
+            prefix = _literal_prefix(content)
+            if prefix:
+                return self.with_prefix(prefix.lower())
+        return self.tracks.keys()
+
+    def match(self, matcher):
+        """
+            Returns the set of tracks that satisfy a condition
+        """
+        result = set()
+        for value in self.candidate_values(matcher):
+            if matcher._matches(matcher.lower(value)):
+                result.update(self.tracks[value])
+        return result
+
+
+class TagIndex(object):
+    """
+        Inverted tag index of the tracks in a :class:`TrackDB`.
+
+        The values of a tag are indexed the first time a search looks
+        at that tag, and kept up to date from then on.
+    """
+    def __init__(self, trackdb):
+        """
+            :param trackdb: the :class:`TrackDB` to index
+        """
+        self.trackdb = trackdb
+        self._tags = {}
+        self._lock = threading.RLock()
+
+    def clear(self):
+        """
+            Drops all indexed values, e.g. after the tracks of the
+            database were replaced.
+        """
+        with self._lock:
+            if self._tags:
+                event.remove_callback(self._on_track_tags_changed,
+                        'track_tags_changed')
+            self._tags = {}
+
+    def add_tracks(self, tracks):
+        """
+            Indexes tracks that were added to the database
+        """
+        with self._lock:
+            for tag, values in self._tags.iteritems():
+                for track in tracks:
+                    values.add(track, search_value(track, tag))
+
+    def remove_tracks(self, tracks):
+        """
+            Forgets tracks that were removed from the database
+        """
+        with self._lock:
+            for values in self._tags.itervalues():
+                for track in tracks:
+                    values.remove(track)
+
+    def _get_tag(self, tag):
+        with self._lock:
+            values = self._tags.get(tag)
+            if values is not None:
+                return values
+            # tracks may be added while the values are collected. those
+            # in the snapshot are indexed here, the others by
+            # add_tracks, which waits for the lock.
+            tracks = [holder._track for holder in
+                    self.trackdb.tracks.values()]
+            values = _TagValues()
+            for track in tracks:
+                values.add(track, search_value(track, tag))
+            if not self._tags:
+                event.add_callback(self._on_track_tags_changed,
+                        'track_tags_changed')
+            self._tags[tag] = values
+            return values
+
+    def _on_track_tags_changed(self, type, track, tag):
+        if tag not in self._tags and tag != 'artist':
+            return
+        if not self.trackdb.loc_is_member(track.get_loc_for_io()):
+            return
+        with self._lock:
+            for indexed, values in self._tags.iteritems():
+                # the search value of albumartist comes from artist
+                if indexed == tag or (tag == 'artist' and
+                        indexed == 'albumartist'):
+                    values.add(track, search_value(track, indexed))
+
+    def _matching(self, matcher):
+        """
+            Returns the set of tracks that may match a matcher, or None
+            if the index cannot answer it.
+        """
+        if isinstance(matcher, (search.TracksMatcher,
+                search._MultiMetaMatcher)):
+            result = None
+            for ma in matcher.matchers:
+                found = self._matching(ma)
+                if found is None:
+                    continue
+                if result is None:
+                    result = found
+                else:
+                    result = result & found
+                if not result:
+                    break
+            return result
+        elif isinstance(matcher, search._OrMetaMatcher):
+            left = self._matching(matcher.left)
+            if left is None:
+                return None
+            right = self._matching(matcher.right)
+            if right is None:
+                return None
+            return left | right
+        elif isinstance(matcher, search._ManyMultiMetaMatcher):
+            result = set()
+            for ma in matcher.matchers:
+                found = self._matching(ma)
+                if found is None:
+                    return None
+                result |= found
+            return result
+        elif isinstance(matcher, search.TracksNotInList):
+            return None
+        elif isinstance(matcher, search.TracksInList):
+            # the list may hold tracks that are not in the database
+            return set(tr for tr in matcher._tracks
+                    if self.trackdb.loc_is_member(tr.get_loc_for_io()))
+        elif isinstance(matcher, search._Matcher) and \
+                not matcher.tag.startswith('__'):
+            return self._get_tag(matcher.tag).match(matcher)
+        return None
+
+    def candidates(self, trackmatchers):
+        """
+            Returns the tracks that may match all given matchers, or
+            None if the index cannot narrow down the search.
+
+            :param trackmatchers: a list of :class:`TracksMatcher`
+                objects, as passed to :func:`search.search_tracks`
+        """
+        with self._lock:
+            result = None
+            for tma in trackmatchers:
+                found = self._matching(tma)
+                if found is None:
+                    continue
+                if result is None:
+                    result = found
+                else:
+                    result = result & found
+            return result
+
+
+class _SortedOrder(object):
+    """
+        The tracks of a database sorted by a list of tags
+    """
+    __slots__ = ['fields', 'artist_compilations', 'tracks', 'keys',
+            'track_keys', 'stale']
+
+    def __init__(self, fields, artist_compilations, tracks):
+        self.fields = fields
+        self.artist_compilations = artist_compilations
+        self.track_keys = dict((tr, self.sort_key(tr)) for tr in tracks)
+        pairs = sorted((key, tr) for tr, key in self.track_keys.iteritems())
+        self.keys = [key for key, tr in pairs]
+        self.tracks = [tr for key, tr in pairs]
+        self.stale = set()
+
+    def sort_key(self, track):
+        # the location makes the order of tracks with equal values
+        # stable across updates
+        key = [track.get_tag_sort(field,
+                artist_compilations=self.artist_compilations)
+                for field in self.fields]
+        key.append(track.get_loc_for_io())
+        return key
+
+    def add(self, track):
+        self.remove(track)
+        key = self.track_keys[track] = self.sort_key(track)
+        pos = bisect.bisect_right(self.keys, key)
+        self.keys.insert(pos, key)
+        self.tracks.insert(pos, track)
+
+    def remove(self, track):
+        key = self.track_keys.pop(track, None)
+        if key is None:
+            return
+        pos = bisect.bisect_left(self.keys, key)
+        while self.tracks[pos] is not track:
+            pos += 1
+        del self.keys[pos]
+        del self.tracks[pos]
+
+    def refresh(self):
+        for track in self.stale:
+            if track in self.track_keys:
+                self.add(track)
+        self.stale.clear()
+
+
+class SortedTracks(object):
+    """
+        Keeps the tracks of a :class:`TrackDB` presorted for the orders
+        that were requested most recently, so that they do not need to
+        be sorted again whenever the database is displayed.
+    """
+    #: number of orders that are kept up to date
+    max_orders = 2
+
+    def __init__(self, trackdb):
+        """
+            :param trackdb: the :class:`TrackDB` whose tracks to sort
+        """
+        self.trackdb = trackdb
+        self._orders = OrderedDict()
+        self._generation = Track._get_sort_generation()
+        self._lock = threading.RLock()
+
+    def clear(self):
+        """
+            Drops all sorted orders
+        """
+        with self._lock:
+            if self._orders:
+                event.remove_callback(self._on_track_tags_changed,
+                        'track_tags_changed')
+            self._orders = OrderedDict()
+
+    def add_tracks(self, tracks):
+        """
+            Inserts tracks that were added to the database
+        """
+        with self._lock:
+            for order in self._orders.itervalues():
+                for track in tracks:
+                    order.add(track)
+
+    def remove_tracks(self, tracks):
+        """
+            Removes tracks that were removed from the database
+        """
+        with self._lock:
+            for order in self._orders.itervalues():
+                for track in tracks:
+                    order.stale.discard(track)
+                    order.remove(track)
+
+    def _on_track_tags_changed(self, type, track, tag):
+        # tracks are moved lazily, as several tags usually change at
+        # once
+        with self._lock:
+            for order in self._orders.itervalues():
+                if track in order.track_keys:
+                    order.stale.add(track)
+
+    def get(self, fields, artist_compilations=False):
+        """
+            Returns the tracks sorted by some tags, in the same order
+            as :func:`xl.trax.sort_tracks` (tracks with equal values
+            are ordered by location).
+
+            :param fields: tag names to sort by
+            :param artist_compilations: passed on to
+                :meth:`Track.get_tag_sort`
+            :returns: a new list of tracks
+        """
+        id = (tuple(fields), artist_compilations)
+        with self._lock:
+            # the sort keys of all tracks change with the generation
+            generation = Track._get_sort_generation()
+            if generation != self._generation:
+                self.clear()
+                self._generation = generation
+            order = self._orders.pop(id, None)
+            if order is None:
+                if not self._orders:
+                    event.add_callback(self._on_track_tags_changed,
+                            'track_tags_changed')
+                order = _SortedOrder(id[0], artist_compilations,
+                        list(self.trackdb))
+                while len(self._orders) >= self.max_orders:
+                    self._orders.popitem(last=False)
+            else:
+                order.refresh()
+            self._orders[id] = order
+            return order.tracks[:]
+
+# vim: et sts=4 sw=4
@@ -0,0 +1,378 @@
+# Copyright (C) 2008-2010 Adam Olsen
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+    Append-only keyed record store used to persist :class:`TrackDB`
+    objects.
+
+    The file starts with a short header, followed by a sequence of
+    records. Each record either stores a pickled value for a key or
+    marks a key as deleted. Saving only appends the records that
+    changed; superseded records are dropped when the file is compacted.
+
+    Only the index (key -> offset of the newest record) is built when
+    the file is opened; values are unpickled when they are requested.
+"""
+
+from __future__ import with_statement
+
+import logging
+import os
+import struct
+import sys
+import threading
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from xl import common
+
+logger = logging.getLogger(__name__)
+
+MAGIC = 'EXDBJRNL'
+FORMAT_VERSION = 1
+
+OP_PUT = 'p'
+OP_DELETE = 'd'
+
+# magic, format version
+_HEADER = struct.Struct('>8sH')
+# operation, key length, value length
+_RECORD = struct.Struct('>cII')
+
+
+class JournalError(Exception):
+    """
+        Raised when a file is not a readable journal
+    """
+    pass
+
+
+def is_journal(location):
+    """
+        Checks whether the file at a location is a journal
+
+        :param location: the path to check
+        :returns: True if the file starts with the journal header
+    """
+    try:
+        with open(location, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+def _replace(source, destination):
+    """
+        Atomically (where the platform allows it) moves source over
+        destination
+    """
+    if sys.platform == 'win32' and os.path.exists(destination):
+        os.remove(destination)
+    os.rename(source, destination)
+
+
+class TrackJournal(object):
+    """
+        Manages an append-only journal file
+
+        Values are stored under string keys, using the same naming
+        that :class:`xl.trax.TrackDB` used for its shelve files
+        (``tracks-<key>`` for tracks, the attribute name otherwise).
+    """
+    def __init__(self, location, compact_ratio=0.5,
+            compact_min_size=4*1024*1024):
+        """
+            :param location: the path of the journal file
+            :param compact_ratio: fraction of the file that has to be
+                superseded records before :meth:`needs_compaction`
+                returns True
+            :param compact_min_size: files smaller than this (in bytes)
+                are never considered for compaction
+        """
+        self.location = location
+        self.compact_ratio = compact_ratio
+        self.compact_min_size = compact_min_size
+        self._index = {}
+        self._file = None
+        self._size = 0
+        self._dead_bytes = 0
+        self._lock = threading.RLock()
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def keys(self):
+        """
+            Returns a list of all live keys
+        """
+        return self._index.keys()
+
+    def open(self):
+        """
+            Opens the journal, creating it if it does not exist, and
+            builds the in-memory index.
+
+            A truncated trailing record (e.g. from a crash during a
+            save) is discarded.
+
+            :raises: :class:`JournalError` if the file is not a journal
+        """
+        with self._lock:
+            if self._file is not None:
+                return
+            if not os.path.exists(self.location):
+                with open(self.location, 'wb') as f:
+                    f.write(_HEADER.pack(MAGIC, FORMAT_VERSION))
+            self._file = open(self.location, 'r+b')
+            try:
+                self.__scan()
+            except Exception:
+                self._file.close()
+                self._file = None
+                raise
+
+    def __scan(self):
+        f = self._file
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise JournalError("%s is not a journal" % self.location)
+        magic, version = _HEADER.unpack(header)
+        if magic != MAGIC:
+            raise JournalError("%s is not a journal" % self.location)
+        if version > FORMAT_VERSION:
+            raise common.VersionError(
+                    "Journal was created on a newer Exaile version.")
+
+        index = {}
+        dead = 0
+        offset = _HEADER.size
+        size = os.fstat(f.fileno()).st_size
+        while True:
+            rec = f.read(_RECORD.size)
+            if not rec:
+                break
+            if len(rec) < _RECORD.size:
+                break
+            op, klen, vlen = _RECORD.unpack(rec)
+            key = f.read(klen)
+            if len(key) < klen:
+                break
+            end = offset + _RECORD.size + klen + vlen
+            if op == OP_PUT:
+                # skip the value, it is only read when requested
+                if end > size:
+                    break
+                f.seek(vlen, os.SEEK_CUR)
+                old = index.get(key)
+                if old is not None:
+                    dead += old[2]
+                index[key] = (offset + _RECORD.size + klen, vlen,
+                        end - offset)
+            elif op == OP_DELETE:
+                old = index.pop(key, None)
+                if old is not None:
+                    dead += old[2]
+                dead += end - offset
+            else:
+                break
+            offset = end
+
+        if offset != size:
+            logger.warning("Discarding %d bytes of incomplete data at the "
+                    "end of %s", size - offset, self.location)
+            f.truncate(offset)
+        self._index = index
+        self._size = offset
+        self._dead_bytes = dead
+
+    def close(self):
+        """
+            Closes the journal file
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _read_raw(self, key):
+        voffset, vlen, unused_reclen = self._index[key]
+        self._file.seek(voffset)
+        return self._file.read(vlen)
+
+    def get(self, key, default=None):
+        """
+            Retrieves the value stored for a key
+
+            :param key: the key to look up
+            :param default: returned if the key is not present
+        """
+        with self._lock:
+            if key not in self._index:
+                return default
+            return pickle.loads(self._read_raw(key))
+
+    def iteritems(self, prefix=''):
+        """
+            Yields (key, value) pairs of all live records whose key
+            starts with prefix, in file order so that reads are
+            sequential.
+
+            The journal must not be written to during iteration.
+        """
+        with self._lock:
+            keys = [(v[0], k) for k, v in self._index.iteritems()
+                    if k.startswith(prefix)]
+        keys.sort()
+        for unused_offset, key in keys:
+            with self._lock:
+                data = self._read_raw(key)
+            yield key, pickle.loads(data)
+
+    def write(self, puts=(), deletes=()):
+        """
+            Appends a batch of changes to the journal and syncs it to
+            disk.
+
+            :param puts: iterable of (key, value) pairs to store
+            :param deletes: iterable of keys to remove
+        """
+        # values are pickled outside of the lock; offsets depend on
+        # the current file, which compact() may rewrite meanwhile
+        records = []
+        for key, value in puts:
+            records.append((key, pickle.dumps(value, common.PICKLE_PROTOCOL)))
+        for key in deletes:
+            records.append((key, None))
+
+        with self._lock:
+            chunks = []
+            entries = []
+            offset = self._size
+            for key, data in records:
+                if data is not None:
+                    chunks.append(_RECORD.pack(OP_PUT, len(key), len(data)))
+                    chunks.append(key)
+                    chunks.append(data)
+                    reclen = _RECORD.size + len(key) + len(data)
+                    entries.append((key, (offset + _RECORD.size + len(key),
+                            len(data), reclen)))
+                elif key in self._index:
+                    chunks.append(_RECORD.pack(OP_DELETE, len(key), 0))
+                    chunks.append(key)
+                    reclen = _RECORD.size + len(key)
+                    entries.append((key, (None, 0, reclen)))
+                else:
+                    continue
+                offset += reclen
+
+            if not chunks:
+                return
+
+            f = self._file
+            f.seek(self._size)
+            f.write(''.join(chunks))
+            f.flush()
+            os.fsync(f.fileno())
+            for key, entry in entries:
+                old = self._index.pop(key, None)
+                if old is not None:
+                    self._dead_bytes += old[2]
+                if entry[0] is None:
+                    self._dead_bytes += entry[2]
+                else:
+                    self._index[key] = entry
+            self._size = offset
+
+    def needs_compaction(self):
+        """
+            Whether enough of the file consists of superseded records
+            that it is worth rewriting
+        """
+        return self._size >= self.compact_min_size and \
+                self._dead_bytes >= self._size * self.compact_ratio
+
+    def compact(self):
+        """
+            Rewrites the journal so it only contains live records
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            before = self._size
+            tmp = self.location + '.compact'
+            index = {}
+            with open(tmp, 'wb') as out:
+                out.write(_HEADER.pack(MAGIC, FORMAT_VERSION))
+                offset = _HEADER.size
+                for voffset, key in sorted((v[0], k) for k, v in
+                        self._index.iteritems()):
+                    data = self._read_raw(key)
+                    out.write(_RECORD.pack(OP_PUT, len(key), len(data)))
+                    out.write(key)
+                    out.write(data)
+                    reclen = _RECORD.size + len(key) + len(data)
+                    index[key] = (offset + _RECORD.size + len(key),
+                            len(data), reclen)
+                    offset += reclen
+                out.flush()
+                os.fsync(out.fileno())
+            self._file.close()
+            _replace(tmp, self.location)
+            self._file = open(self.location, 'r+b')
+            self._index = index
+            self._size = offset
+            self._dead_bytes = 0
+        logger.debug("Compacted %s from %d to %d bytes", self.location,
+                before, offset)
+
+    @classmethod
+    def create(cls, location, items):
+        """
+            Writes a fresh journal containing only the given items,
+            replacing any existing file at location.
+
+            :param location: the path to write to
+            :param items: iterable of (key, value) pairs
+            :returns: the open :class:`TrackJournal`
+        """
+        tmp = location + '.new'
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        journal = cls(tmp)
+        journal.open()
+        journal.write(puts=items)
+        journal.close()
+        _replace(tmp, location)
+        journal.location = location
+        journal.open()
+        return journal
+
+# vim: et sts=4 sw=4
@@ -219,12 +219,287 @@ class _ManyMultiMetaMatcher(object):
                     self.tags.update(ma.tags)
         return matched
 
+def _casefold(value):
+    return value.lower()
+
+def _identity(value):
+    return value
+
+def _normalize(vals):
+    """
+        Returns the value a condition on a non-internal tag compares
+        against, given the result of get_tag_search(tag, format=False):
+        the first value, stripped of diacritics. None never matches.
+
+        See _Matcher.match.
+    """
+    if vals == '__null__':
+        return None
+    if type(vals) != list:
+        vals = [vals]
+    for item in vals:
+        if item != None:
+            try:
+                return item.decode('ascii')
+            except:
+                return shave_marks(item)
+    return None
+
+def _track_cache(track):
+    """
+        Returns the dict a Track memoizes derived values in, or None
+    """
+    try:
+        cache = track._cache
+    except AttributeError:
+        return None
+    if cache is None:
+        # set before the value is computed, so that a concurrent tag
+        # change drops it again
+        cache = track._cache = {}
+    return cache
+
+def _search_value(track, tag, lower):
+    """
+        Returns the normalized value of a tag that conditions compare
+        against, memoized on the track for the built in lower functions.
+    """
+    if lower is _casefold:
+        key = (tag, True)
+    elif lower is _identity:
+        key = (tag, False)
+    else:
+        value = _normalize(track.get_tag_search(tag, format=False))
+        if value is not None:
+            value = lower(value)
+        return value
+
+    cache = _track_cache(track)
+    if cache is not None:
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+    value = _normalize(track.get_tag_search(tag, format=False))
+    if value is not None and key[1]:
+        value = value.lower()
+    if cache is not None:
+        cache[key] = value
+    return value
+
+def _internal_value(track, tag):
+    """
+        Returns the value of an internal tag that conditions compare
+        against, memoized on the track.
+    """
+    key = (tag, None)
+    cache = _track_cache(track)
+    if cache is not None:
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+    value = track.get_tag_search(tag, format=False)
+    if value == '__null__':
+        value = None
+    if cache is not None:
+        cache[key] = value
+    return value
+
+# rough relative cost of evaluating conditions, cheaper ones are
+# evaluated first
+_COSTS = {
+    _ExactMatcher: 1,
+    _InMatcher: 2,
+    _GtMatcher: 2,
+    _LtMatcher: 2,
+    _RegexMatcher: 3,
+}
+_UNKNOWN_COST = 4
+
+def _compile_value_test(matcher):
+    """
+        Returns a function that checks a normalized value against the
+        condition of a _Matcher, with the same result as its _matches.
+    """
+    cls = type(matcher)
+    content = matcher.content
+    internal = matcher.tag.startswith('__')
+    if cls is _ExactMatcher and not internal:
+        return lambda value: value == content
+    elif cls is _InMatcher and not internal and \
+            isinstance(content, basestring):
+        return lambda value: bool(value) and content in value
+    elif cls is _RegexMatcher and not internal:
+        search = matcher._re.search
+        return lambda value: bool(value) and search(value) is not None
+    elif cls in (_GtMatcher, _LtMatcher):
+        try:
+            bound = float(content)
+        except (TypeError, ValueError):
+            return lambda value: False
+        if cls is _GtMatcher:
+            def test(value):
+                try:
+                    return float(value) > bound
+                except (TypeError, ValueError):
+                    return False
+        else:
+            def test(value):
+                try:
+                    if value is None:
+                        return 0 < bound
+                    return float(value) < bound
+                except (TypeError, ValueError):
+                    return False
+        return test
+    return matcher._matches
+
+def _compile_tag_matcher(matcher):
+    tag = matcher.tag
+    test = _compile_value_test(matcher)
+    if tag.startswith('__'):
+        return lambda srtrack: bool(test(_internal_value(srtrack.track, tag)))
+    lower = matcher.lower
+    def match(srtrack):
+        value = _search_value(srtrack.track, tag, lower)
+        return value is not None and bool(test(value))
+    return match
+
+def _compile_all(compiled):
+    """
+        Returns a function that is true if all compiled conditions are,
+        checking the cheapest first
+    """
+    tests = [test for cost, test in sorted(compiled, key=lambda c: c[0])]
+    if len(tests) == 1:
+        return tests[0]
+    def match(srtrack):
+        for test in tests:
+            if not test(srtrack):
+                return False
+        return True
+    return match
+
+def _compile_matched_tags(matcher):
+    """
+        Returns the cost of a _ManyMultiMetaMatcher and a function
+        returning the tags it matches on, like its match method does.
+    """
+    tests = []
+    cost = 0
+    for ma in matcher.matchers:
+        ma_cost, test = _compile(ma)
+        cost += ma_cost
+        if ma.tag:
+            tests.append((ma.tag, test, None))
+        elif hasattr(ma, 'tags'):
+            tests.append((None, ma.match, ma))
+    def match(srtrack):
+        tags = []
+        for tag, test, ma in tests:
+            if test(srtrack):
+                if tag is not None:
+                    tags.append(tag)
+                else:
+                    tags.extend(ma.tags)
+        return tags
+    return cost, match
+
+def _is_plain(matcher, cls):
+    """
+        Whether matcher behaves like cls, i.e. does not override match
+    """
+    return isinstance(matcher, cls) and \
+        type(matcher).match.__func__ is cls.match.__func__
+
+def _compile(matcher):
+    """
+        Compiles a matcher into (cost, function taking a
+        SearchResultTrack and returning whether it matches)
+    """
+    cls = type(matcher)
+    if _is_plain(matcher, _Matcher):
+        return (_COSTS.get(cls, _UNKNOWN_COST),
+            _compile_tag_matcher(matcher))
+    elif cls is _NotMetaMatcher:
+        cost, test = _compile(matcher.matcher)
+        return cost, lambda srtrack: not test(srtrack)
+    elif cls is _OrMetaMatcher:
+        (lcost, left), (rcost, right) = sorted([_compile(matcher.left),
+            _compile(matcher.right)], key=lambda c: c[0])
+        return (lcost + rcost,
+            lambda srtrack: left(srtrack) or right(srtrack))
+    elif cls is _MultiMetaMatcher:
+        compiled = [_compile(ma) for ma in matcher.matchers]
+        return sum(c[0] for c in compiled), _compile_all(compiled)
+    elif cls is _ManyMultiMetaMatcher:
+        cost, tags = _compile_matched_tags(matcher)
+        return cost, lambda srtrack: bool(tags(srtrack))
+    elif cls is TracksInList:
+        tracks = matcher._tracks
+        return 0, lambda srtrack: srtrack.track in tracks
+    elif cls is TracksNotInList:
+        tracks = matcher._tracks
+        return 0, lambda srtrack: srtrack.track not in tracks
+    return _UNKNOWN_COST, matcher.match
+
+def _compile_top_matcher(matcher):
+    """
+        Compiles a matcher of a TracksMatcher into (cost, function
+        returning None if a SearchResultTrack does not match, or the
+        tags it matched on).
+    """
+    if type(matcher) is _ManyMultiMetaMatcher:
+        cost, tags = _compile_matched_tags(matcher)
+        return cost, lambda srtrack: tags(srtrack) or None
+
+    cost, test = _compile(matcher)
+    if matcher.tag is not None:
+        matched = (matcher.tag,)
+        return cost, lambda srtrack: matched if test(srtrack) else None
+    elif hasattr(matcher, 'tags'):
+        # tags is set by the call to match
+        return cost, lambda srtrack: \
+            list(matcher.tags) if test(srtrack) else None
+    return cost, lambda srtrack: () if test(srtrack) else None
+
+def _compile_matchers(matchers):
+    """
+        Compiles the matchers of a TracksMatcher into a single function
+        that behaves like TracksMatcher.match used to: it returns
+        whether all matchers match a SearchResultTrack and, if they do,
+        adds the tags they matched on to its on_tags.
+
+        Conditions are checked cheapest first, and values of tags are
+        normalized once per track and memoized on it.
+    """
+    compiled = [_compile_top_matcher(ma) for ma in matchers]
+    tests = list(enumerate(test for cost, test in compiled))
+    tests.sort(key=lambda t: compiled[t[0]][0])
+    count = len(tests)
+
+    def match(srtrack):
+        found = [None] * count
+        for i, test in tests:
+            tags = test(srtrack)
+            if tags is None:
+                return False
+            found[i] = tags
+        on_tags = srtrack.on_tags
+        for tags in found:
+            for tag in tags:
+                if tag not in on_tags:
+                    on_tags.append(tag)
+        return True
+    return match
+
 class TracksMatcher(object):
     """
         Holds criteria and determines whether
         a given track matches those criteria.
     """
-    __slots__ = ['matchers', 'case_sensitive', 'keyword_tags']
+    __slots__ = ['matchers', 'case_sensitive', 'keyword_tags', '_compiled']
     def __init__(self, search_string, case_sensitive=True, keyword_tags=None):
         """
             :param search_string: a string describing the match conditions
@@ -243,6 +518,7 @@ class TracksMatcher(object):
         tokens = self.__red(tokens)
         tokens = self.__optimize_tokens(tokens)
         self.matchers = self.__tokens_to_matchers(tokens)
+        self._compiled = None
 
     def append_matcher(self, matcher, or_match=False):
         '''Here so you can use playlist matchers. Probably needs better impl'''
@@ -250,6 +526,7 @@ class TracksMatcher(object):
             self.matchers.append(matcher)
         else:
             self.matchers[-1] = _OrMetaMatcher(self.matchers[-1], matcher)
+        self._compiled = None
 
     def prepend_matcher(self, matcher, or_match=False):
         '''Here so you can use playlist matchers. Probably needs better impl'''
@@ -257,25 +534,19 @@ class TracksMatcher(object):
             self.matchers.insert(0, matcher)
         else:
             self.matchers[0] = _OrMetaMatcher(matcher, self.matchers[0])
+        self._compiled = None
 
     def match(self, srtrack):
         """
             Determine whether a given SearchResultTrack's internal
             Track object matches this search condition.
+
+            The tags that matched are added to srtrack.on_tags.
         """
-        for ma in self.matchers:
-            if not ma.match(srtrack):
-                break
-            if ma.tag is not None:
-                if ma.tag not in srtrack.on_tags:
-                    srtrack.on_tags.append(ma.tag)
-            elif hasattr(ma, 'tags'):
-                for t in ma.tags:
-                    if t not in srtrack.on_tags:
-                        srtrack.on_tags.append(t)
-        else:
-            return True
-        return False
+        compiled = self._compiled
+        if compiled is None:
+            compiled = self._compiled = _compile_matchers(self.matchers)
+        return compiled(srtrack)
 
     def __tokens_to_matchers(self, tokens, matchers=None):
         """
@@ -318,9 +589,9 @@ class TracksMatcher(object):
         # normal token
         else:
             if not self.case_sensitive:
-                lower = lambda x: x.lower()
+                lower = _casefold
             else:
-                lower = lambda x: x
+                lower = _identity
 
             # TODO: this stuff is kinda repetitive, can we consolidate
             # it? Maybe move some of this into the matcher classes?
@@ -504,9 +775,17 @@ def search_tracks(trackiter, trackmatchers):
     """
         Search a set of tracks for those that match specified conditions.
 
-        :param trackiter: An iterable object returning Track objects
+        :param trackiter: An iterable object returning Track objects.
+            If it has a tag_index (see :class:`xl.trax.TrackDB`), the
+            index is used to skip tracks that cannot match.
         :param trackmatchers: A list of TrackMatcher objects
     """
+    index = getattr(trackiter, 'tag_index', None)
+    if index is not None:
+        candidates = index.candidates(trackmatchers)
+        if candidates is not None:
+            trackiter = candidates
+
     for srtr in trackiter:
         if not isinstance(srtr, SearchResultTrack):
             srtr = SearchResultTrack(srtr)
@@ -67,6 +67,42 @@ _UNKNOWNSTR = _("Unknown")
 #TRANSLATORS: String multiple tag values will be joined by
 _JOINSTR = _(u' / ')
 
+# Values of these tags are usually shared by many tracks, so equal
+# values are stored only once (see _pool_value). Values of other tags,
+# like titles, are mostly unique and not worth pooling.
+POOLED_TAGS = frozenset([
+    'artist', 'albumartist', 'album', 'genre', 'date', 'originaldate',
+    'composer', 'performer', 'conductor', 'arranger', 'lyricist',
+    'organization', 'copyright', 'encodedby', 'grouping', 'language',
+    'version', 'tracknumber', 'discnumber', 'bpm', 'artistsort',
+    'albumartistsort', 'albumsort', '__basedir', '__encoding',
+])
+
+_tag_names = {}
+# unicode values cannot be weakly referenced, so the pool only keeps
+# the most recently used ones. Tracks keep their values when they are
+# dropped from it, later equal values are just not shared with them.
+_value_pool = common.LRUCache(16384, name='xl.trax.track._value_pool')
+
+def _intern_tag(tag):
+    """
+        Returns the shared instance of a tag name
+    """
+    return _tag_names.setdefault(tag, tag)
+
+def _pool_value(value):
+    """
+        Returns the shared instance of a string value
+    """
+    if isinstance(value, str):
+        return intern(value)
+    if isinstance(value, unicode):
+        pooled = _value_pool.get(value)
+        if pooled is None:
+            pooled = _value_pool[value] = value
+        return pooled
+    return value
+
 
 class _MetadataCacher(object):
     """
@@ -130,13 +166,18 @@ class Track(object):
         Represents a single track.
     """
     # save a little memory this way
+    # (_cache holds values derived from the tags, like sort and search
+    # values; it is dropped whenever a tag changes)
     __slots__ = ["__tags", "_scan_valid",
-            "_dirty", "__weakref__", "_init"]
+            "_dirty", "__weakref__", "_init", "_cache"]
     # this is used to enforce the one-track-per-uri rule
     __tracksdict = weakref.WeakValueDictionary()
     # store a copy of the settings values here - much faster (0.25 cpu
     # seconds) (see _the_cuts_cb)
     __the_cuts = settings.get_option('collection/strip_list', [])
+    # bumped whenever the way sort keys are computed changes, so that
+    # values memoized by get_tag_sort are recomputed
+    __sort_generation = 0
 
     def __new__(cls, *args, **kwargs):
         """
@@ -222,6 +263,7 @@ class Track(object):
         self.__tags = {}
         self._scan_valid = None # whether our last tag read attempt worked
         self._dirty = False
+        self._cache = None
 
         if _unpickles:
             self._unpickles(_unpickles)
@@ -259,6 +301,7 @@ class Track(object):
         self.__unregister()
         gloc = Gio.File.new_for_commandline_arg(loc)
         self.__tags['__loc'] = gloc.get_uri()
+        self._cache = None
         self.__register()
         event.log_event('track_tags_changed', self, '__loc')
 
@@ -365,37 +408,57 @@ class Track(object):
                 self._scan_valid = False
                 return False # not a supported type
             ntags = f.read_all()
-            for k, v in ntags.iteritems():
-                self.set_tag_raw(k, v)
-
-            # remove tags that have been deleted in the file, while
-            # taking into account that the db may have tags not
-            # supported by the file's tag format.
             if f.others:
-                supported_tags = [ t for t in self.list_tags() \
-                        if not t.startswith("__") ]
+                supported_tags = None
             else:
                 supported_tags = f.tag_mapping.keys()
-            for tag in supported_tags:
-                if tag not in ntags.keys():
-                    self.set_tag_raw(tag, None)
-
-            # fill out file specific items
-            gloc = Gio.File.new_for_uri(loc)
-            mtime = gloc.query_info("time::modified", Gio.FileQueryInfoFlags.NONE, None).get_modification_time()
-            mtime = mtime.tv_sec + (mtime.tv_usec/100000.0)
-            self.set_tag_raw('__modified', mtime)
-            # TODO: this probably breaks on non-local files
-            path = gloc.get_parent().get_path()
-            self.set_tag_raw('__basedir', path)
-            self._dirty = True
-            self._scan_valid = True
+            self._set_read_tags(ntags, supported_tags)
             return f
         except Exception:
             self._scan_valid = False
             logger.exception("Error reading tags for %s", loc)
             return False
 
+    def _set_read_tags(self, ntags, supported_tags=None, mtime=None):
+        """
+            Stores tags that were read from the file for this Track.
+            Used by read_tags, and by the collection scanner which
+            reads tags in worker processes.
+
+            internal use only please
+
+            :param ntags: the tags returned by the format's read_all()
+            :param supported_tags: the tags the file's format supports,
+                or None if it supports arbitrary tags
+            :param mtime: the modification time of the file, if already
+                known
+        """
+        loc = self.get_loc_for_io()
+        for k, v in ntags.iteritems():
+            self.set_tag_raw(k, v)
+
+        # remove tags that have been deleted in the file, while
+        # taking into account that the db may have tags not
+        # supported by the file's tag format.
+        if supported_tags is None:
+            supported_tags = [ t for t in self.list_tags() \
+                    if not t.startswith("__") ]
+        for tag in supported_tags:
+            if tag not in ntags:
+                self.set_tag_raw(tag, None)
+
+        # fill out file specific items
+        gloc = Gio.File.new_for_uri(loc)
+        if mtime is None:
+            mtime = gloc.query_info("time::modified", Gio.FileQueryInfoFlags.NONE, None).get_modification_time()
+            mtime = mtime.tv_sec + (mtime.tv_usec/100000.0)
+        self.set_tag_raw('__modified', mtime)
+        # TODO: this probably breaks on non-local files
+        path = gloc.get_parent().get_path()
+        self.set_tag_raw('__basedir', path)
+        self._dirty = True
+        self._scan_valid = True
+
     def is_local(self):
         """
             Determines whether a file is accessible on the local filesystem.
@@ -444,7 +507,21 @@ class Track(object):
 
             internal use only please
         """
-        self.__tags = deepcopy(pickle_obj)
+        tags = {}
+        for tag, values in pickle_obj.iteritems():
+            pooled = tag in POOLED_TAGS
+            if isinstance(values, list):
+                if pooled:
+                    values = map(_pool_value, values)
+                else:
+                    values = values[:]
+            elif pooled:
+                values = _pool_value(values)
+            elif not isinstance(values, (basestring, int, long, float)):
+                values = deepcopy(values)
+            tags[_intern_tag(tag)] = values
+        self.__tags = tags
+        self._cache = None
 
     def list_tags(self):
         """
@@ -485,6 +562,10 @@ class Track(object):
                 for v in values
                     if v not in (None, '')
             ]
+            if tag in POOLED_TAGS:
+                values = map(_pool_value, values)
+        elif tag in POOLED_TAGS:
+            values = _pool_value(values)
 
         # Save some memory by not storing null values.
         if not values:
@@ -493,8 +574,9 @@ class Track(object):
             except KeyError:
                 pass
         else:
-            self.__tags[tag] = values
+            self.__tags[_intern_tag(tag)] = values
 
+        self._cache = None
         self._dirty = True
         if notify_changed:
             event.log_event("track_tags_changed", self, tag)
@@ -534,6 +616,22 @@ class Track(object):
             :param extend_title: If the title tag is unknown, try to
                 add some identifying information to it.
         """
+        # Computing sort values is expensive, so they are memoized
+        # until a tag of this track or the strip list changes.
+        cache = self._cache
+        if cache is None or cache.get(None) != Track.__sort_generation:
+            cache = self._cache = {None: Track.__sort_generation}
+        key = (tag, join, artist_compilations)
+        try:
+            value = cache[key]
+        except KeyError:
+            value = cache[key] = self.__get_tag_sort(tag, join,
+                    artist_compilations)
+        if isinstance(value, list):
+            return value[:]
+        return value
+
+    def __get_tag_sort(self, tag, join, artist_compilations):
         # The two magic values here are to ensure that compilations
         # and unknown values are always sorted below all normal
         # values.
@@ -929,6 +1027,17 @@ class Track(object):
         """
         if data == "collection/strip_list":
             cls._Track__the_cuts = settings.get_option('collection/strip_list', [])
+            cls._Track__sort_generation += 1
+
+    @classmethod
+    def _get_sort_generation(cls):
+        """
+            PRIVATE
+
+            returns a number that changes whenever the values returned
+            by get_tag_sort may have changed for all tracks
+        """
+        return cls.__sort_generation
 
     ### Utility method intended for TrackDB ###
     
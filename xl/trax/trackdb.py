@@ -26,8 +26,12 @@
 
 from __future__ import absolute_import
 
+import collections
+import contextlib
 import logging
+import os
 import shelve
+import shutil
 
 from copy import deepcopy
 
@@ -36,6 +40,8 @@ from gi.repository import GLib
 from xl import common, event
 from xl.nls import gettext as _
 
+from xl.trax import journal
+from xl.trax.index import SortedTracks, TagIndex
 from xl.trax.track import Track
 from xl.trax.util import sort_tracks
 from xl.trax.search import search_tracks_from_string
@@ -43,11 +49,26 @@ from xl.trax.search import search_tracks_from_string
 logger = logging.getLogger(__name__)
 
 
+def _open_shelve(location):
+    """
+        Opens a database stored in the old shelve format
+    """
+    try:
+        return shelve.open(location, flag='c',
+                protocol=common.PICKLE_PROTOCOL)
+    except ImportError:
+        import bsddb3 # ArchLinux disabled bsddb in python2, so we have to use the external module
+        _db = bsddb3.hashopen(location, 'c')
+        return shelve.Shelf(_db, protocol=common.PICKLE_PROTOCOL)
+
 class TrackHolder(object):
+    __slots__ = ['_track', '_key', '_attrs']
+
     def __init__(self, track, key, **kwargs):
         self._track = track
         self._key = key
-        self._attrs = kwargs
+        # most tracks have no attributes, don't keep a dict for them
+        self._attrs = kwargs or None
 
     def __getattr__(self, attr):
         return getattr(self._track, attr)
@@ -71,7 +92,8 @@ class TrackDB(object):
 
         :param name:   The name of this :class:`TrackDB`.
         :param location:   Path to a file where this :class:`TrackDB`
-                should be stored.
+                should be stored. See :mod:`xl.trax.journal` for the
+                file format.
         :param pickle_attrs:   A list of attributes to store in the
                 pickled representation of this object. All
                 attributes listed must be built-in types, with
@@ -96,13 +118,18 @@ class TrackDB(object):
         self.location = location
         self._dirty = False
         self.tracks = {}
-        self.pickle_attrs = pickle_attrs
-        self.pickle_attrs += ['tracks', 'name', '_key']
+        self.pickle_attrs = pickle_attrs + ['tracks', 'name', '_key']
         self._saving = False
         self._key = 0
         self._dbversion = 2.0
         self._dbminorversion = 0
         self._deleted_keys = []
+        self._journal = None
+        self._transaction_depth = 0
+        self._pending_added = collections.OrderedDict()
+        self._pending_removed = collections.OrderedDict()
+        self.tag_index = TagIndex(self)
+        self._sorted_tracks = SortedTracks(self)
         if location:
             self.load_from_location()
             self._timeout_save()
@@ -163,8 +190,11 @@ class TrackDB(object):
     @common.synchronized
     def load_from_location(self, location=None):
         """
-            Restores :class:`TrackDB` state from the pickled representation
-            stored at the specified location.
+            Restores :class:`TrackDB` state from the journal stored at
+            the specified location.
+
+            Databases in the old shelve format are converted to a
+            journal the first time they are loaded.
 
             :param location: the location to load the data from
             :type location: string
@@ -176,21 +206,52 @@ class TrackDB(object):
                     _("You did not specify a location to load the db from"))
 
         logger.debug("Loading %s DB from %s." % (self.name, location))
-                    
+
+        if os.path.exists(location) and not journal.is_journal(location):
+            self._load_from_shelve(location)
+            return
+
         try:
-            try:
-                pdata = shelve.open(location, flag='c',
-                        protocol=common.PICKLE_PROTOCOL)
-            except ImportError:
-                import bsddb3 # ArchLinux disabled bsddb in python2, so we have to use the external module
-                _db = bsddb3.hashopen(location, 'c')
-                pdata = shelve.Shelf(_db, protocol=common.PICKLE_PROTOCOL)
+            jrnl = journal.TrackJournal(location)
+            jrnl.open()
+            if int(jrnl.get('_dbversion', self._dbversion)) > \
+                    int(self._dbversion):
+                jrnl.close()
+                raise common.VersionError(
+                        "DB was created on a newer Exaile version.")
+        except common.VersionError:
+            raise
+        except Exception:
+            logger.exception("Failed to open music DB.")
+            return
+
+        duplicates = self.__restore(jrnl.iteritems('tracks-'), jrnl.get,
+                location)
+        if duplicates:
+            jrnl.write(deletes=duplicates)
+
+        if location == self.location:
+            if self._journal is not None:
+                self._journal.close()
+            self._journal = jrnl
+        else:
+            jrnl.close()
+
+        self._dirty = False
+
+    def _load_from_shelve(self, location):
+        """
+            Loads a database stored in the old shelve format and
+            rewrites it as a journal. A copy of the old file is kept
+            next to it.
+        """
+        try:
+            pdata = _open_shelve(location)
             if "_dbversion" in pdata:
                 if int(pdata['_dbversion']) > int(self._dbversion):
                     raise common.VersionError("DB was created on a newer Exaile version.")
                 elif pdata['_dbversion'] < self._dbversion:
                     logger.info("Upgrading DB format....")
-                    import shutil
                     shutil.copyfile(location,
                             location + "-%s.bak"%pdata['_dbversion'])
                     import xl.migrations.database as dbmig
@@ -203,13 +264,45 @@ class TrackDB(object):
             logger.exception("Failed to open music DB.")
             return
 
+        tracks = ((k, pdata[k]) for k in pdata.keys()
+                if k.startswith("tracks-"))
+        self.__restore(tracks, pdata.get, location)
+        pdata.close()
+
+        logger.info("Converting %s to the journal format..." % location)
+        try:
+            shutil.copyfile(location, location + "-shelve.bak")
+            jrnl = journal.TrackJournal.create(location, self.__records())
+        except Exception:
+            logger.exception("Failed to convert music DB.")
+            return
+
+        if location == self.location:
+            self._journal = jrnl
+        else:
+            jrnl.close()
+
+        for track in self.tracks.itervalues():
+            track._track._dirty = False
+        self._deleted_keys = []
+        self._dirty = False
+
+    def __restore(self, tracks, get, location):
+        """
+            Restores attributes from stored data
+
+            :param tracks: iterable of (key, value) pairs for the stored
+                tracks
+            :param get: function returning the stored value of an
+                attribute, or the passed default
+            :returns: the keys of duplicate tracks that were skipped
+        """
+        duplicates = []
         for attr in self.pickle_attrs:
             try:
                 if 'tracks' == attr:
                     data = {}
-                    for k in (x for x in pdata.keys() \
-                            if x.startswith("tracks-")):
-                        p = pdata[k]
+                    for k, p in tracks:
                         tr = Track(_unpickles=p[0])
                         loc = tr.get_loc_for_io()
                         if loc not in data:
@@ -218,24 +311,46 @@ class TrackDB(object):
                             logger.warning("Duplicate track found: %s" % loc )
                             # presumably the second track was written because of an error, 
                             # so use the first track found. 
-                            del pdata[k]
-                            
+                            duplicates.append(k)
+
                     setattr(self, attr, data)
+                    self.tag_index.clear()
+                    self._sorted_tracks.clear()
                 else:
-                    setattr(self, attr, pdata.get(attr, getattr(self, attr)))
+                    setattr(self, attr, get(attr, getattr(self, attr)))
             except Exception:
                 # FIXME: Do something about this
                 logger.exception("Exception occurred while loading %s" % location)
+        return duplicates
 
-        pdata.close()
+    def __records(self):
+        """
+            Yields (key, value) pairs for everything that is persisted
+        """
+        for attr in self.pickle_attrs:
+            # bad hack to allow saving of lists/dicts of Tracks
+            if 'tracks' == attr:
+                for track in self.tracks.itervalues():
+                    yield self.__track_record(track)
+            else:
+                yield attr, deepcopy(getattr(self, attr))
+        yield '_dbversion', self._dbversion
 
-        self._dirty = False
+    @staticmethod
+    def __track_record(track):
+        return ("tracks-%s" % track._key, (
+            track._track._pickles(),
+            track._key,
+            deepcopy(track._attrs or {})
+        ))
 
     @common.synchronized
     def save_to_location(self, location=None):
         """
-            Saves a pickled representation of this :class:`TrackDB` to the
-            specified location.
+            Saves this :class:`TrackDB` to the specified location.
+
+            When saving to the location the database was loaded from,
+            only tracks that changed since the last save are written.
 
             :param location: the location to save the data to
             :type location: string
@@ -262,49 +377,56 @@ class TrackDB(object):
         logger.debug("Saving %s DB to %s." % (self.name, location))
 
         try:
-            try:
-                pdata = shelve.open(location, flag='c',
-                        protocol=common.PICKLE_PROTOCOL)
-            except ImportError:
-                import bsddb3
-                _db = bsddb3.hashopen(location, 'c')
-                pdata = shelve.Shelf(_db, protocol=common.PICKLE_PROTOCOL)
-            if pdata.get('_dbversion', self._dbversion) > self._dbversion:
-                raise common.VersionError("DB was created on a newer Exaile.")
+            if location != self.location:
+                journal.TrackJournal.create(location, self.__records()).close()
+            else:
+                if self._journal is None:
+                    self._journal = journal.TrackJournal(location)
+                    self._journal.open()
+                self.__append_changes(self._journal)
         except Exception:
-            logger.exception("Failed to open music DB for writing.")
+            logger.exception("Failed to save music DB.")
+            self._saving = False
             return
 
-        for attr in self.pickle_attrs:
-            # bad hack to allow saving of lists/dicts of Tracks
-            if 'tracks' == attr:
-                for k, track in self.tracks.iteritems():
-                    key = "tracks-%s" % track._key
-                    if track._track._dirty or key not in pdata:
-                        pdata[key] = (
-                            track._track._pickles(),
-                            track._key,
-                            deepcopy(track._attrs)
-                        )
-            else:
-                pdata[attr] = deepcopy(getattr(self, attr))
-
-        pdata['_dbversion'] = self._dbversion
-
-        for key in self._deleted_keys:
-            key = "tracks-%s" % key
-            if key in pdata:
-                del pdata[key]
-
-        pdata.sync()
-        pdata.close()
-
         for track in self.tracks.itervalues():
             track._track._dirty = False
 
         self._dirty = False
         self._saving = False
 
+        if location == self.location and self._journal.needs_compaction():
+            self._compact_journal(self._journal)
+
+    def __append_changes(self, jrnl):
+        """
+            Appends the records that changed since the last save
+        """
+        puts = []
+        for attr in self.pickle_attrs:
+            if 'tracks' == attr:
+                for track in self.tracks.itervalues():
+                    if track._track._dirty or \
+                            "tracks-%s" % track._key not in jrnl:
+                        puts.append(self.__track_record(track))
+            else:
+                puts.append((attr, deepcopy(getattr(self, attr))))
+        puts.append(('_dbversion', self._dbversion))
+
+        deletes = ["tracks-%s" % key for key in self._deleted_keys]
+        jrnl.write(puts, deletes)
+        self._deleted_keys = []
+
+    @common.threaded
+    def _compact_journal(self, jrnl):
+        """
+            Drops superseded records from the journal in the background
+        """
+        try:
+            jrnl.compact()
+        except Exception:
+            logger.exception("Failed to compact %s", jrnl.location)
+
     def get_track_by_loc(self, loc, raw=False):
         """
             returns the track having the given loc. if no such track exists,
@@ -317,10 +439,11 @@ class TrackDB(object):
 
     def get_tracks_by_locs(self, locs):
         """
-            returns the track having the given loc. if no such track exists,
-            returns None
+            returns the tracks having the given locs, with None for
+            each loc that has no track
         """
-        return [self.get_track_by_loc(loc) for loc in locs]
+        tracks = self.tracks
+        return [tracks[loc]._track if loc in tracks else None for loc in locs]
 
     def loc_is_member(self, loc):
         """
@@ -352,19 +475,32 @@ class TrackDB(object):
     def add_tracks(self, tracks):
         """
             Like add(), but takes a list of :class:`xl.trax.Track`
+
+            The whole list is added at once and announced by a single
+            'tracks_added' event.
         """
-        locations = []
+        tracks = list(tracks)
+        if not tracks:
+            return
 
+        holders = {}
+        key = self._key
         for tr in tracks:
-            location = tr.get_loc_for_io()
-            locations += [location]
-            self.tracks[location] = TrackHolder(tr, self._key)
-            self._key += 1
+            holders[tr.get_loc_for_io()] = TrackHolder(tr, key)
+            key += 1
+        self._key = key
 
-        event.log_event('tracks_added', self, locations)
+        # tracks that are added again get a new key
+        existing = [loc for loc in holders if loc in self.tracks]
+        self._deleted_keys.extend(self.tracks[loc]._key for loc in existing)
+        self.tracks.update(holders)
 
+        self.tag_index.add_tracks(tracks)
+        self._sorted_tracks.add_tracks(tracks)
         self._dirty = True
 
+        self._notify_changes(added=holders.keys(), existing=set(existing))
+
     def remove(self, track):
         """
             Removes a track from the database
@@ -377,22 +513,107 @@ class TrackDB(object):
     def remove_tracks(self, tracks):
         """
             Like remove(), but takes a list of :class:`xl.trax.Track`
-        """
-        locations = []
 
+            The whole list is removed at once and announced by a single
+            'tracks_removed' event.
+        """
+        removed = []
         for tr in tracks:
-            location = tr.get_loc_for_io()
-            locations += [location]
-            self._deleted_keys.append(self.tracks[location]._key)
-            del self.tracks[location]
-
-        event.log_event('tracks_removed', self, locations)
+            holder = self.tracks.pop(tr.get_loc_for_io(), None)
+            if holder is None:
+                continue
+            self._deleted_keys.append(holder._key)
+            removed.append(holder._track)
+        if not removed:
+            return
 
+        self.tag_index.remove_tracks(removed)
+        self._sorted_tracks.remove_tracks(removed)
         self._dirty = True
 
+        self._notify_changes(removed=[tr.get_loc_for_io() for tr in removed])
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+            Groups several additions and removals so that listeners
+            are only notified once, when the outermost transaction ends::
+
+                with collection.transaction():
+                    collection.add_tracks(new_tracks)
+                    collection.remove_tracks(old_tracks)
+
+            At the end of the transaction a single 'tracks_removed' and
+            a single 'tracks_added' event are emitted for everything
+            that changed. Tracks that were added and removed again
+            within the transaction are not reported at all.
+
+            Transactions may be nested. Changes made by other threads
+            while a transaction is open are reported with it.
+        """
+        self._begin_transaction()
+        try:
+            yield self
+        finally:
+            self._end_transaction()
+
+    @common.synchronized
+    def _begin_transaction(self):
+        self._transaction_depth += 1
+
+    @common.synchronized
+    def _end_transaction(self):
+        self._transaction_depth -= 1
+        if self._transaction_depth:
+            return
+        added = self._pending_added.keys()
+        removed = self._pending_removed.keys()
+        self._pending_added = collections.OrderedDict()
+        self._pending_removed = collections.OrderedDict()
+        self._notify_changes(added, removed)
+
+    def _notify_changes(self, added=(), removed=(), existing=()):
+        """
+            Emits the events for added and removed locations, or
+            defers them until the current transaction ends
+
+            :param existing: the added locations that were already
+                in the database
+        """
+        if self._transaction_depth:
+            pending = self._pending_added
+            for loc in removed:
+                # a track that only existed within the transaction
+                # is dropped silently
+                if pending.pop(loc, True):
+                    self._pending_removed[loc] = None
+            for loc in added:
+                pending.setdefault(loc, loc in existing or
+                        loc in self._pending_removed)
+            return
+
+        if removed:
+            event.log_event('tracks_removed', self, list(removed))
+        if added:
+            event.log_event('tracks_added', self, list(added))
+
     def get_tracks(self):
         return list(self)
 
+    def get_sorted_tracks(self, fields, artist_compilations=False):
+        """
+            Returns all tracks sorted by some tags, like
+            :func:`xl.trax.sort_tracks` does.
+
+            The order is kept up to date as tracks change, so repeated
+            calls with the same tags do not need to sort again.
+
+            :param fields: tag names to sort by
+            :param artist_compilations: passed on to
+                :meth:`Track.get_tag_sort`
+        """
+        return self._sorted_tracks.get(fields, artist_compilations)
+
 
     def search(self, query, sort_fields=[], return_lim=-1,
             tracks=None, reverse=False):
@@ -40,6 +40,7 @@ from gi.repository import Gtk
 
 from xl import (
     common,
+    covers,
     event,
     providers,
     settings,
@@ -199,7 +200,7 @@ class CoverManager(GObject.GObject):
 
         outstanding = []
         # Speed up the following loop
-        get_cover = COVER_MANAGER.get_cover
+        get_cover_thumbnail = COVER_MANAGER.get_cover_thumbnail
         pixbuf_from_data = icons.MANAGER.pixbuf_from_data
         default_cover_pixbuf = self.default_cover_pixbuf
         cover_size = self.cover_size
@@ -210,13 +211,12 @@ class CoverManager(GObject.GObject):
             if self.stopper.is_set():
                 return
 
-            cover_data = get_cover(self.album_tracks[album][0], set_only=True)
-            cover_pixbuf = pixbuf_from_data(cover_data) if cover_data else None
+            thumbnail_data = get_cover_thumbnail(self.album_tracks[album][0],
+                max(cover_size), set_only=True)
+            thumbnail_pixbuf = pixbuf_from_data(thumbnail_data, cover_size,
+                keep_ratio=False, upscale=True)
 
-            try:
-                thumbnail_pixbuf = cover_pixbuf.scale_simple(*cover_size,
-                    interp_type=GdkPixbuf.InterpType.BILINEAR)
-            except AttributeError: # cover_pixbuf is None
+            if thumbnail_pixbuf is None:
                 thumbnail_pixbuf = default_cover_pixbuf
                 outstanding.append(album)
 
@@ -235,33 +235,43 @@ class CoverManager(GObject.GObject):
         """
         self.emit('fetch-started', len(self.outstanding))
 
-        # Speed up the following loop
-        get_cover = COVER_MANAGER.get_cover
-        save = COVER_MANAGER.save
         pixbuf_from_data = icons.MANAGER.pixbuf_from_data
+        cover_size = self.cover_size
+        tracks = [self.album_tracks[album][0] for album in self.outstanding]
+        albums = dict(zip(tracks, self.outstanding))
+        progress = [0]
+
+        def on_cover_fetched(track, cover_data):
+            """
+                Called by the scheduler for each album, in order of
+                completion
+            """
+            progress[0] += 1
+            self.emit('fetch-progress', progress[0])
 
-        for i, album in enumerate(self.outstanding[:]):
-            if self.stopper.is_set():
-                # Allow for "fetch-completed" signal to be emitted
-                break
-
-            cover_data = get_cover(self.album_tracks[album][0], save_cover=True)
-            cover_pixbuf = pixbuf_from_data(cover_data) if cover_data else None
+            if not cover_data:
+                return
 
-            self.emit('fetch-progress', i + 1)
+            thumbnail_data = COVER_MANAGER.get_cover_thumbnail(track,
+                max(cover_size), set_only=True)
+            cover_pixbuf = pixbuf_from_data(thumbnail_data, cover_size,
+                keep_ratio=False, upscale=True)
 
             if not cover_pixbuf:
-                continue
+                return
 
+            album = albums[track]
             self.outstanding.remove(album)
             self.emit('cover-fetched', album, cover_pixbuf)
 
-            if i % 50 == 0:
-                logger.debug('Saving cover database')
-                save()
+        # Returns early if stopped, which allows for the
+        # "fetch-completed" signal to be emitted
+        scheduler = covers.CoverFetchScheduler(COVER_MANAGER,
+            stopper=self.stopper)
+        scheduler.fetch(tracks, on_cover_fetched)
 
         logger.debug('Saving cover database')
-        save()
+        COVER_MANAGER.save()
 
         self.emit('fetch-completed', len(self.outstanding))
 
@@ -552,6 +562,7 @@ class CoverWidget(Gtk.EventBox):
         
         self.image = image
         self.cover_data = None
+        self.has_cover = False
         self.menu = CoverMenu(self)
         self.filename = None
 
@@ -595,12 +606,14 @@ class CoverWidget(Gtk.EventBox):
         def __get_cover():
             
             fetch = not settings.get_option('covers/automatic_fetching', True)
-            cover_data = COVER_MANAGER.get_cover(track, set_only=fetch)
+            width = settings.get_option('gui/cover_width', 100)
+            thumbnail_data = COVER_MANAGER.get_cover_thumbnail(track, width,
+                set_only=fetch)
 
-            if not cover_data:
+            if not thumbnail_data:
                 return
 
-            GLib.idle_add(self.on_cover_chosen, None, track, cover_data)
+            GLib.idle_add(self.on_thumbnail_loaded, track, thumbnail_data)
         
         if track is not None:
             __get_cover()
@@ -609,10 +622,12 @@ class CoverWidget(Gtk.EventBox):
         """
             Shows the current cover
         """
-        if not self.cover_data:
+        cover_data = self.get_cover_data()
+
+        if not cover_data:
             return
 
-        pixbuf = icons.MANAGER.pixbuf_from_data(self.cover_data)
+        pixbuf = icons.MANAGER.pixbuf_from_data(cover_data)
 
         if pixbuf:
             savedir = Gio.File.new_for_uri(self.__track.get_loc_for_io()).get_parent()
@@ -651,6 +666,7 @@ class CoverWidget(Gtk.EventBox):
         self.image.set_from_pixbuf(pixbuf)
         self.set_drag_source_enabled(False)
         self.cover_data = None
+        self.has_cover = False
 
         self.emit('cover-found', None)
 
@@ -719,7 +735,7 @@ class CoverWidget(Gtk.EventBox):
         if self.filename is None:
             self.filename = tempfile.mkstemp(prefix='exaile_cover_')[1]
 
-        pixbuf = icons.MANAGER.pixbuf_from_data(self.cover_data)
+        pixbuf = icons.MANAGER.pixbuf_from_data(self.get_cover_data())
         save_pixbuf(pixbuf, self.filename, 'png')
         selection.set_uris([Gio.File.new_for_path(self.filename).get_uri()])
 
@@ -768,8 +784,37 @@ class CoverWidget(Gtk.EventBox):
         self.image.set_from_pixbuf(pixbuf)
         self.set_drag_source_enabled(True)
         self.cover_data = cover_data
+        self.has_cover = True
+
+        self.emit('cover-found', pixbuf)
+
+    def on_thumbnail_loaded(self, track, thumbnail_data):
+        """
+            Called when the thumbnail of the cover of a track is
+            available; the full cover is only loaded when needed
+        """
+        if self.__track != track:
+            return
+
+        width = settings.get_option('gui/cover_width', 100)
+        pixbuf = icons.MANAGER.pixbuf_from_data(thumbnail_data, (width, width))
+        self.image.set_from_pixbuf(pixbuf)
+        self.set_drag_source_enabled(True)
+        self.cover_data = None
+        self.has_cover = True
 
         self.emit('cover-found', pixbuf)
+
+    def get_cover_data(self):
+        """
+            Returns the full image data of the displayed cover
+
+            :returns: the image data or None if no cover is shown
+        """
+        if self.cover_data is None and self.has_cover:
+            self.cover_data = COVER_MANAGER.get_cover(self.__track,
+                set_only=True)
+        return self.cover_data
     
     def on_track_tags_changed(self, e, track, tag):
         """
@@ -29,8 +29,10 @@ from gi.repository import GdkPixbuf
 from gi.repository import GLib
 from gi.repository import GObject
 from gi.repository import Gtk
+import collections
 import itertools
 import logging
+import time
 
 from xl.nls import gettext as _
 from xl import (
@@ -152,6 +154,126 @@ DEFAULT_ORDERS = [
             (("discnumber", "tracknumber", "title"), "$title", ("title",)))),
 ]
 
+class _TreeNode(object):
+    """
+        A node of the collection tree
+    """
+    __slots__ = ['depth', 'display', 'match_query', 'sort_key', 'tracks',
+        'children', 'track_children', 'sorted_children']
+
+    def __init__(self, depth, display=None, match_query=''):
+        self.depth = depth
+        self.display = display
+        self.match_query = match_query
+        #: smallest sort value of the tracks below this node
+        self.sort_key = None
+        #: location -> SearchResultTrack of every track below this node
+        self.tracks = {}
+        #: match query -> child node, None until the children are needed
+        self.children = None
+        #: location -> child node containing that track
+        self.track_children = None
+        self.sorted_children = None
+
+class CollectionTree(object):
+    """
+        Groups tracks into the hierarchy of an :class:`Order`.
+
+        Child nodes are only computed when a node is expanded, and kept
+        afterwards, so that expanding a node again or reloading the tree
+        is a dictionary lookup. Tracks can be added and removed without
+        rebuilding the tree.
+    """
+    def __init__(self, order, srtrs):
+        """
+            :param order: the :class:`Order` to group tracks by
+            :param srtrs: the SearchResultTracks to show in the tree
+        """
+        self.order = order
+        self.root = _TreeNode(-1)
+        for srtr in srtrs:
+            self.root.tracks[srtr.track.get_loc_for_io()] = srtr
+
+    def __group(self, depth, track):
+        """
+            Returns the match query and sort value of the node a track
+            belongs to at a depth
+        """
+        tags = self.order.get_sort_tags(depth)
+        sort_key = [track.get_tag_sort(t) for t in tags]
+        match_query = " ".join([track.get_tag_search(t, format=True)
+            for t in tags])
+        if depth == len(self.order) - 1:
+            match_query += " " + track.get_tag_search("__loc", format=True)
+        return match_query, sort_key
+
+    def __add_to_children(self, node, loc, srtr):
+        depth = node.depth + 1
+        match_query, sort_key = self.__group(depth, srtr.track)
+        child = node.children.get(match_query)
+        if child is None:
+            child = node.children[match_query] = _TreeNode(depth,
+                self.order.format_track(depth, srtr.track), match_query)
+            node.sorted_children = None
+        if child.sort_key is not None and sort_key < child.sort_key:
+            child.sort_key = sort_key
+            node.sorted_children = None
+        elif child.sort_key is None and not child.tracks:
+            child.sort_key = sort_key
+        child.tracks[loc] = srtr
+        node.track_children[loc] = child
+        return child
+
+    def get_children(self, node):
+        """
+            Returns the sorted child nodes of a node
+        """
+        if node.depth + 1 >= len(self.order):
+            return []
+        if node.children is None:
+            node.children = {}
+            node.track_children = {}
+            for loc, srtr in node.tracks.iteritems():
+                self.__add_to_children(node, loc, srtr)
+        if node.sorted_children is None:
+            depth = node.depth + 1
+            for child in node.children.itervalues():
+                if child.sort_key is None:
+                    child.sort_key = min(self.__group(depth, srtr.track)[1]
+                        for srtr in child.tracks.itervalues())
+            node.sorted_children = sorted(node.children.itervalues(),
+                key=lambda n: (n.sort_key, n.display))
+        return node.sorted_children
+
+    def add(self, srtr):
+        """
+            Adds a track to the tree
+        """
+        loc = srtr.track.get_loc_for_io()
+        node = self.root
+        node.tracks[loc] = srtr
+        while node.children is not None:
+            node = self.__add_to_children(node, loc, srtr)
+
+    def remove(self, loc):
+        """
+            Removes the track at a location from the tree
+        """
+        node = self.root
+        if node.tracks.pop(loc, None) is None:
+            return
+        while node.children is not None:
+            child = node.track_children.pop(loc)
+            del child.tracks[loc]
+            if not child.tracks:
+                del node.children[child.match_query]
+                node.sorted_children = None
+            elif child.sort_key is not None:
+                # the removed track may have had the smallest value
+                child.sort_key = None
+                node.sorted_children = None
+            node = child
+
 class CollectionPanel(panel.Panel):
     """
         The collection panel
@@ -164,6 +286,10 @@ class CollectionPanel(panel.Panel):
     }
 
     ui_info = ('collection.ui', 'CollectionPanelWindow')
+    #: number of top level rows appended at once, longer lists are
+    #: filled in the background
+    chunk_size = 500
+
     def __init__(self, parent, collection, name=None,
         _show_collection_empty_message=False, label=None):
         """
@@ -195,6 +321,12 @@ class CollectionPanel(panel.Panel):
         self.order = None
         self.tracks = []
         self.sorted_tracks = []
+        self._tree = None
+        self._tree_keyword = ''
+        self._changed_locs = set()
+        self._load_generation = 0
+        self._load_id = 0
+        self._search_times = collections.deque(maxlen=100)
 
         event.add_ui_callback(self._check_collection_empty, 'libraries_modified',
             collection)
@@ -399,7 +531,8 @@ class CollectionPanel(panel.Panel):
         self.tree.set_row_separator_func(
             (lambda m, i, d: m.get_value(i, 1) is None), None)
 
-        self.model = Gtk.TreeStore(GdkPixbuf.Pixbuf, str, object)
+        # icon, text, search terms, CollectionTree node
+        self.model = Gtk.TreeStore(GdkPixbuf.Pixbuf, str, object, object)
 
         self.tree.connect("row-expanded", self.on_expanded)
 
@@ -407,11 +540,10 @@ class CollectionPanel(panel.Panel):
         """
             finds tracks matching a given iter.
         """
-        self.load_subtree(iter)
-        search = self.get_node_search_terms(iter)
-        matcher = trax.TracksMatcher(search)
-        srtrs = trax.search_tracks(self.tracks, [matcher])
-        return [ x.track for x in srtrs ]
+        node = self.model.get_value(iter, 3)
+        if node is None:
+            return []
+        return [srtr.track for srtr in node.tracks.itervalues()]
 
     def append_to_playlist(self, item=None, event=None, replace=False):
         """
@@ -480,12 +612,18 @@ class CollectionPanel(panel.Panel):
         return " ".join(queries)
 
     def refresh_tags_in_tree(self, type, track, tag):
+        loc = track.get_loc_for_io()
+        if not self.collection.loc_is_member(loc):
+            return
+        # remember every change, so that the tree does not show stale
+        # values once it is reloaded for another reason
+        self._changed_locs.add(loc)
         if settings.get_option('gui/sync_on_tag_change', True) and \
-            tag in self.order.all_sort_tags() and \
-            self.collection.loc_is_member(track.get_loc_for_io()):
+            tag in self.order.all_sort_tags():
             self._refresh_tags_in_tree()
 
     def refresh_tracks_in_tree(self, type, obj, loc):
+        self._changed_locs.update(loc)
         self._refresh_tags_in_tree()
 
     @common.glib_wait(500)
@@ -503,11 +641,10 @@ class CollectionPanel(panel.Panel):
         return False
 
     def resort_tracks(self):
-#        import time
-#        print "sorting...", time.clock()
-        self.sorted_tracks = trax.sort_tracks(self.order.get_sort_tags(0),
-            self.collection.get_tracks())
-#        print "sorted.", time.clock()
+        # the collection keeps this order up to date, so this only
+        # sorts the first time an order is shown
+        self.sorted_tracks = self.collection.get_sorted_tracks(
+            self.order.get_sort_tags(0))
 
     def load_tree(self):
         """
@@ -517,9 +654,14 @@ class CollectionPanel(panel.Panel):
             the collection associated with this panel
         """
         logger.debug("Reloading collection tree")
+        start = time.time()
         self.current_start_count = self.start_count
-        self.tree.set_model(None)
-        self.model.clear()
+        # cancels running searches and fills of the previous tree
+        self._search_num += 1
+        self._load_generation += 1
+        if self._load_id:
+            GLib.source_remove(self._load_id)
+            self._load_id = 0
 
         self.root = None
         oldorder = self.order
@@ -534,20 +676,102 @@ class CollectionPanel(panel.Panel):
                 self.choice.get_active())
 
         keyword = self.keyword.strip()
-        tags = list(SEARCH_TAGS)
-        tags += self.order.all_search_tags()
-        tags = list(set(tags)) # uniquify list to speed up search
+        if not keyword and not self._tree_keyword and \
+                self._tree is not None and self._tree.order is self.order:
+            # the whole collection is shown; only update what changed
+            self._apply_changes()
+            self._show_tree(start)
+        else:
+            tags = list(SEARCH_TAGS)
+            tags += self.order.all_search_tags()
+            tags = list(set(tags)) # uniquify list to speed up search
+
+            # changes from now on are applied once the search is done
+            self._changed_locs.clear()
+            self._search_tracks(self._search_num, self.order, keyword,
+                tags, self.sorted_tracks, start)
+
+    @common.threaded
+    def _search_tracks(self, search_num, order, keyword, tags, tracks,
+            start):
+        """
+            Searches tracks and groups the results in the background,
+            giving up as soon as another search was started.
+
+            The tag index of the collection narrows down the tracks to
+            match, and the sorted order of the tracks is kept.
+        """
+        matchers = [trax.TracksMatcher(keyword, case_sensitive=False,
+            keyword_tags=tags)]
+
+        index = getattr(self.collection, 'tag_index', None)
+        found = None
+        if index is not None:
+            found = index.candidates(matchers)
+
+        def candidates():
+            for i, track in enumerate(tracks):
+                if i % 256 == 0 and search_num != self._search_num:
+                    return
+                if found is None or track in found:
+                    yield track
+
+        results = list(trax.search_tracks(candidates(), matchers))
+        if search_num != self._search_num:
+            return
 
-        self.tracks = list(
-                trax.search_tracks_from_string(self.sorted_tracks,
-                    keyword, case_sensitive=False, keyword_tags=tags) )
+        tree = CollectionTree(order, results)
+        tree.get_children(tree.root)
+        if search_num != self._search_num:
+            return
+        GLib.idle_add(self._search_done, search_num, tree, keyword, start)
 
-        self.load_subtree(None)
+    def _search_done(self, search_num, tree, keyword, start):
+        if search_num != self._search_num:
+            return False
+        self._tree = tree
+        self._tree_keyword = keyword
+        if not keyword:
+            self._apply_changes()
+        self._show_tree(start)
+        return False
 
+    def _apply_changes(self):
+        """
+            Updates the tree for the tracks that changed since it was
+            built
+        """
+        for loc in self._changed_locs:
+            self._tree.remove(loc)
+            track = self.collection.get_track_by_loc(loc)
+            if track is not None:
+                self._tree.add(trax.SearchResultTrack(track))
+        self._changed_locs.clear()
+
+    def _show_tree(self, start):
+        """
+            Fills the model from the current tree
+        """
+        self.tracks = self._tree.root.tracks.values()
+        self.tree.set_model(None)
+        self.model.clear()
+        self.load_subtree(None)
         self.tree.set_model(self.model)
 
+        self._log_search_time(time.time() - start)
         self.emit('collection-tree-loaded')
 
+    def _log_search_time(self, elapsed):
+        times = self._search_times
+        times.append(elapsed)
+        ordered = sorted(times)
+        percentile = lambda p: ordered[min(len(ordered) - 1,
+            int(len(ordered) * p))]
+        logger.debug("Collection tree loaded in %.3fs (%d tracks); last %d "
+            "loads: p50 %.3fs, p90 %.3fs, p99 %.3fs", elapsed,
+            len(self.tracks), len(ordered), percentile(0.5),
+            percentile(0.9), percentile(0.99))
+
     def _expand_node_by_name(self, search_num, parent, name, rest=None):
         """
             Recursive function to expand all nodes in a hierarchical list of
@@ -585,130 +809,106 @@ class CollectionPanel(panel.Panel):
 
             @param node: the node
         """
-        previously_loaded = False # was the subtree already loaded
-        iter_sep = None
-        if parent == None:
-            depth = 0
+        if parent is None:
+            node = self._tree.root
         else:
             if self.model.iter_n_children(parent) != 1 or \
                 self.model.get_value(
                     self.model.iter_children(parent), 1) != None:
-                previously_loaded = True
+                return # the subtree was already loaded
+            node = self.model.get_value(parent, 3)
+
+        children = self._tree.get_children(node)
+        if not children:
+            return # at the bottom of the tree
+        depth = node.depth + 1
+        iter_sep = None
+        if parent is not None:
             iter_sep = self.model.iter_children(parent)
-            depth = self.model.iter_depth(parent) + 1
-        if previously_loaded:
-            return
 
-        search = self.get_node_search_terms(parent)
+        if parent is None and len(children) > self.chunk_size:
+            # fill very long lists from the main loop so that the panel
+            # stays responsive
+            rows = self._append_nodes(parent, depth, iter(children))
+            if self._append_chunk(self._load_generation, rows):
+                self._load_id = GLib.idle_add(self._append_chunk,
+                    self._load_generation, rows)
+        else:
+            for unused in self._append_nodes(parent, depth, iter(children)):
+                pass
 
+        if iter_sep is not None:
+            self.model.remove(iter_sep)
+
+    def _append_chunk(self, generation, rows):
+        """
+            Appends the next chunk of top level rows
+        """
+        if generation != self._load_generation:
+            return False
+        for i, unused in enumerate(rows):
+            if i == self.chunk_size - 1:
+                return True
+        self._load_id = 0
+        return False
+
+    def _append_nodes(self, parent, depth, nodes):
+        """
+            Appends tree nodes to the model, yielding after each row
+        """
         try:
-            tags = self.order.get_sort_tags(depth)
-            matchers = [trax.TracksMatcher(search)]
-            srtrs = trax.search_tracks(self.tracks, matchers)
-            # sort only if we are not on top level, because tracks are 
-            # already sorted by fist order
-            if depth > 0:
-                srtrs = trax.sort_result_tracks(tags, srtrs)
-        except IndexError:
-            return # at the bottom of the tree
-        try:
-            image = getattr(self, "%s_image"%tags[-1])
+            image = getattr(self, "%s_image" %
+                self.order.get_sort_tags(depth)[-1])
         except:
             image = None
-        bottom = False
-        if depth == len(self.order)-1:
-            bottom = True
-
+        bottom = depth == len(self.order) - 1
 
         display_counts = settings.get_option('gui/display_track_counts', True)
         draw_seps = settings.get_option('gui/draw_separators', True)
-        last_char = ''
-        last_val = ''
-        last_dval = ''
-        last_matchq = ''
-        count = 0
-        first = True
-        path = None
-        expanded = False
-        to_expand = []
-
-        for srtr in srtrs:
-            stagvals = [unicode(srtr.track.get_tag_sort(x)) for x in tags]
-            stagval = " ".join(stagvals)
-            if (last_val != stagval or bottom):
-                tagval = self.order.format_track(depth, srtr.track)
-                match_query = " ".join([
-                    srtr.track.get_tag_search(t, format=True) for t in tags])
-                if bottom:
-                    match_query += " " + \
-                            srtr.track.get_tag_search("__loc", format=True)
-
-                # Different *sort tags can cause stagval to not match
-                # but the below code will produce identical entries in
-                # the displayed tree.  This condition checks to ensure
-                # that new entries are added if and only if they will
-                # display different results, avoiding that problem.
-                if match_query != last_matchq or tagval != last_dval or bottom:
-                    if display_counts and path and not bottom:
-                        iter = self.model.get_iter(path)
-                        val = self.model.get_value(iter, 1)
-                        val = "%s (%s)"%(val, count)
-                        self.model.set_value(iter, 1, val)
-                        count = 0
-
-                    last_val = stagval
-                    last_dval = tagval
-                    if depth == 0 and draw_seps:
-                        val = srtr.track.get_tag_sort(tags[0])
-                        char = first_meaningful_char(val)
-                        if first:
-                            last_char = char
-                        else:
-                            if char != last_char and last_char != '':
-                                self.model.append(parent, [None, None, None])
-                            last_char = char
-                    first = False
-
-                    last_matchq = match_query
-                    iter = self.model.append(parent, 
-                        [image, tagval, match_query])
-                    path = self.model.get_path(iter)
-                    expanded = False
-                    if not bottom:
-                        self.model.append(iter, [None, None, None])
-            count += 1
-            if not expanded:
-                alltags = []
-                for i in range(depth+1, len(self.order)):
-                    alltags.extend(self.order.get_sort_tags(i))
-                for t in alltags:
-                    if t in srtr.on_tags:
-                        # keep original path intact for following block
-                        newpath = path
-                        if depth > 0:
-                            # for some reason, nested iters are always
-                            # off by one in the terminal entry.
-                            newpath = Gtk.TreePath.new_from_indices(newpath[:-1] + [newpath[-1]-1])
-                        to_expand.append(newpath)
-                        expanded = True
-
-        if display_counts and path and not bottom:
-            iter = self.model.get_iter(path)
-            val = self.model.get_value(iter, 1)
-            val = "%s (%s)"%(val, count)
-            self.model.set_value(iter, 1, val)
-            count = 0
-
-        if settings.get_option("gui/expand_enabled", True) and \
-            len(to_expand) < \
-                    settings.get_option("gui/expand_maximum_results", 100) and \
+        expand = bool(self.keyword.strip()) and \
+            settings.get_option("gui/expand_enabled", True) and \
             len(self.keyword.strip()) >= \
-                    settings.get_option("gui/expand_minimum_term_length", 2):
-            for row in to_expand:
-                GLib.idle_add(self.tree.expand_row, row, False)
+                settings.get_option("gui/expand_minimum_term_length", 2)
+        alltags = []
+        if expand:
+            for i in range(depth+1, len(self.order)):
+                alltags.extend(self.order.get_sort_tags(i))
+        last_char = None
+        to_expand = []
 
-        if iter_sep is not None:
-            self.model.remove(iter_sep)
+        for node in nodes:
+            if depth == 0 and draw_seps:
+                char = first_meaningful_char(node.sort_key[0])
+                if last_char is not None and char != last_char and \
+                        last_char != '':
+                    self.model.append(parent, [None, None, None, None])
+                last_char = char
+
+            val = node.display
+            if display_counts and not bottom:
+                val = "%s (%s)" % (val, len(node.tracks))
+            iter = self.model.append(parent,
+                [image, val, node.match_query, node])
+            if not bottom:
+                self.model.append(iter, [None, None, None, None])
+
+            if alltags:
+                for srtr in node.tracks.itervalues():
+                    if any(t in srtr.on_tags for t in alltags):
+                        to_expand.append(Gtk.TreeRowReference.new(
+                            self.model, self.model.get_path(iter)))
+                        break
+            yield iter
+
+        if to_expand and len(to_expand) < \
+                settings.get_option("gui/expand_maximum_results", 100):
+            for ref in to_expand:
+                GLib.idle_add(self._expand_row, ref)
+
+    def _expand_row(self, ref):
+        # the reference stays valid while rows are inserted and removed
+        if ref.valid():
+            self.tree.expand_row(ref.get_path(), False)
 
 class CollectionDragTreeView(DragTreeView):
     """
@@ -261,7 +261,8 @@ class PlaylistNotebook(SmartNotebook):
                                                      match.group('tag'),
                                                      match.group('name'),
                                                      ))
-            pl = self.tab_manager.get_playlist(name)
+            # tabs read their tracks once they are shown
+            pl = self.tab_manager.get_playlist(name, lazy=True)
             pl.name = match.group('name')
 
             if match.group('tab') not in added_tabs:
@@ -288,13 +289,8 @@ class PlaylistNotebook(SmartNotebook):
         """
             Saves the open tabs
         """
-        # first, delete the current tabs
-        names = self.tab_manager.list_playlists()
-        for name in names:
-            logger.debug("Removing tab %s" % name)
-            self.tab_manager.remove_playlist(name)
-
         # TODO: make this generic enough to save other kinds of tabs
+        pages = []
         for n, page in enumerate(self):
             if not isinstance(page, PlaylistPage):
                 continue
@@ -306,7 +302,18 @@ class PlaylistNotebook(SmartNotebook):
             elif n == self.get_current_page():
                 tag = 'current'
 
-            page.playlist.name = 'order%d.%s.%s' % (n, tag, page.playlist.name)
+            pages.append(('order%d.%s.%s' % (n, tag, page.playlist.name), page))
+
+        # first, delete the tabs which are gone or moved; the files of
+        # the others are overwritten, which only writes what changed
+        names = set(name for name, page in pages)
+        for name in self.tab_manager.list_playlists():
+            if name not in names:
+                logger.debug("Removing tab %s" % name)
+                self.tab_manager.remove_playlist(name)
+
+        for name, page in pages:
+            page.playlist.name = name
             logger.debug('Saving tab %r', page.playlist.name)
 
             try:
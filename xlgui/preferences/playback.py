@@ -235,4 +235,13 @@ class CrossfadeDurationPreference(widgets.SpinPreference, EngineConditional):
         widgets.SpinPreference.__init__(self, preferences, widget)
         EngineConditional.__init__(self)
 
+class PrerollPreference(widgets.CheckPreference, EngineConditional):
+    default = False
+    name = 'player/preroll_next'
+    conditional_engine = 'gstreamer'
+
+    def __init__(self, preferences, widget):
+        widgets.CheckPreference.__init__(self, preferences, widget)
+        EngineConditional.__init__(self)
+
 # vim: et sts=4 sw=4
@@ -290,8 +290,8 @@ class DragTreeView(AutoScrollTreeView):
             for track in tracks:
                 album = track.get_tag_raw('album', join=True)
                 if album not in albums:
-                    image_data = cover_manager.get_cover(track,
-                        set_only=True, use_default=True)
+                    image_data = cover_manager.get_cover_thumbnail(track,
+                        width, set_only=True, use_default=True)
                     pixbuf = icons.MANAGER.pixbuf_from_data(
                         image_data, (width, height))
 
@@ -31,7 +31,6 @@ from gi.repository import GObject
 from gi.repository import Gtk
 from gi.repository import Pango
 
-from itertools import izip
 import logging
 import sys
 
@@ -690,6 +689,7 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
         self.selection.set_mode(Gtk.SelectionMode.MULTIPLE)
 
         self._filter_matcher = None
+        self.modelfilter = None
         
         self._setup_columns()
         self.columns_changed_id = self.connect("columns-changed",
@@ -716,6 +716,7 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
         self.connect("drag-data-delete", self.on_drag_data_delete)
         self.connect("drag-end", self.on_drag_end)
         self.connect("drag-motion", self.on_drag_motion)
+        self.connect("map", self.on_map)
 
     def filter_tracks(self, filter_string):
         '''
@@ -728,7 +729,7 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
     
         if filter_string is None:
             self._filter_matcher = None
-            self.modelfilter.refilter()
+            self._setup_filter()
         else:
             # Merge default columns and currently enabled columns
             keyword_tags = set(playlist_columns.DEFAULT_COLUMNS + [c.name for c in self.get_columns()])
@@ -736,7 +737,7 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
                     case_sensitive=False,
                     keyword_tags=keyword_tags)
             logger.debug("Filtering playlist %r by %r.", self.playlist.name, filter_string)
-            self.modelfilter.refilter()
+            self._setup_filter()
             logger.debug("Filtering playlist %r by %r completed.", self.playlist.name, filter_string)
         
     def get_selection_count(self):
@@ -837,7 +838,7 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
         # TODO: What is the fixme talking about?
         self.model = PlaylistModel(self.playlist, columns, self.player)
         self.model.connect('row-inserted', self.on_row_inserted)
-        self.set_model(self.model)
+        self.modelfilter = None
         self._setup_filter()
 
         font = settings.get_option('gui/playlist_font', None)
@@ -859,12 +860,16 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
                 self.on_header_key_press_event)
 
     def _setup_filter(self):
-        '''Call this anytime after you call set_model()'''
-        self.modelfilter = self.get_model().filter_new()
-        self.modelfilter.set_visible_func(self.modelfilter_visible_func)
-        self.set_model(self.modelfilter)
-        
-        if self._filter_matcher is not None:
+        '''Call this anytime after you change the model or the filter'''
+        # A filter model checks every row, so only use one while filtering
+        if self._filter_matcher is None:
+            self.modelfilter = None
+            self.set_model(self.model)
+        elif self.modelfilter is None:
+            self.modelfilter = self.model.filter_new()
+            self.modelfilter.set_visible_func(self.modelfilter_visible_func)
+            self.set_model(self.modelfilter)
+        else:
             self.modelfilter.refilter()
                 
     def _refresh_columns(self):
@@ -937,13 +942,22 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
         position = self.playlist.current_position
         if position >= 0:
             model = self.get_model()
+            path = Gtk.TreePath((position,))
             # If it's a filter, then the position isn't actually the path
             if hasattr(model, 'convert_child_path_to_path'):
-                path = model.convert_child_path_to_path(Gtk.TreePath((position,)))
+                path = model.convert_child_path_to_path(path)
             if path:
                 self.scroll_to_cell(path)
                 self.set_cursor(path)
-        
+
+    def on_map(self, widget):
+        # Restored playlists are only read once their tab is shown
+        if not self.model.loaded:
+            self.set_model(None)
+            self.modelfilter = None
+            self.model.load()
+            self._setup_filter()
+
     def on_cursor_changed(self, widget):
         context = common.LazyDict(self)
         context['selection-empty'] = lambda name, parent: parent.get_selection_count() == 0
@@ -1278,7 +1292,26 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
             return self._filter_matcher.match(trax.SearchResultTrack(track))
         return True
 
-class PlaylistModel(Gtk.ListStore):
+#: GObject types for the Python types used by playlist columns
+_COLUMN_GTYPES = {
+    object: GObject.TYPE_PYOBJECT,
+    bool: GObject.TYPE_BOOLEAN,
+    int: GObject.TYPE_INT,
+    long: GObject.TYPE_LONG,
+    float: GObject.TYPE_DOUBLE,
+    str: GObject.TYPE_STRING,
+    unicode: GObject.TYPE_STRING,
+}
+
+class PlaylistModel(GObject.GObject, Gtk.TreeModel):
+    """
+        A list model presenting the tracks of a playlist
+
+        Rows are not stored in the model: column values are formatted
+        when the view asks for them, which with fixed height mode only
+        happens for visible rows. The values of recently shown tracks
+        are kept in a bounded cache.
+    """
 
     __gsignals__ = {
         # Called with true indicates starting operation, False ends op
@@ -1288,18 +1321,36 @@ class PlaylistModel(Gtk.ListStore):
             (GObject.TYPE_BOOLEAN,)
         )
     }
+
+    #: Number of tracks whose formatted values are cached
+    render_cache_size = 2000
+    #: Number of rows formatted at once when a row is not cached
+    render_batch_size = 50
     
     def __init__(self, playlist, columns, player):
-        Gtk.ListStore.__init__(self, int) # real types are set later
+        GObject.GObject.__init__(self)
         self.playlist = playlist
         self.columns = columns
         self.player = player
         
+        # Rows are formatted on demand, so there is never anything to
+        # load; kept for users of the 'data-loading' signal
         self.data_loading = False
-        self.data_load_queue = []
 
-        self.coltypes = [object, GdkPixbuf.Pixbuf] + [providers.get_provider('playlist-columns', c).datatype for c in columns]
-        self.set_column_types(self.coltypes)
+        column_providers = [providers.get_provider('playlist-columns', c) for c in columns]
+        self.coltypes = [object, GdkPixbuf.Pixbuf] + [p.datatype for p in column_providers]
+        self._gtypes = [_COLUMN_GTYPES.get(t) or t.__gtype__ for t in self.coltypes]
+        self._formatters = [p.formatter for p in column_providers]
+        self._render_cache = common.LRUCache(self.render_cache_size,
+                name='playlist_rows:%s' % playlist.name)
+        
+        # The tracks as announced to the view. Playlist events can reach
+        # us after the playlist changed again, so rows are looked up here
+        # rather than in the playlist itself.
+        # Playlists restored lazily are only read by load() once shown,
+        # until then the model is empty and ignores their events.
+        self.loaded = playlist.loaded
+        self._tracks = list(playlist) if self.loaded else []
         
         self._redraw_timer = None
         self._redraw_queue = []
@@ -1326,7 +1377,6 @@ class PlaylistModel(Gtk.ListStore):
         event.add_ui_callback(self.on_option_set, "gui_option_set")
                 
         self._setup_icons()
-        self.on_tracks_added(None, self.playlist, list(enumerate(self.playlist))) # populate the list
 
     def _setup_icons(self):
         self.play_pixbuf = icons.ExtendedPixbuf(
@@ -1367,8 +1417,8 @@ class PlaylistModel(Gtk.ListStore):
         
     def _refresh_icons(self):
         self._setup_icons()
-        for i,row in enumerate(self):
-            row[1] = self.icon_for_row(i).pixbuf
+        for position in xrange(len(self._tracks)):
+            self._row_changed(position)
         
     def on_option_set(self, typ, obj, data):
         if data == "gui/playlist_font":
@@ -1377,7 +1427,7 @@ class PlaylistModel(Gtk.ListStore):
     def icon_for_row(self, row):
         # TODO: we really need some sort of global way to say "is this playlist/pos the current one?
         if self.playlist.current_position == row and \
-                self.playlist[row] == self.player.current and \
+                self._tracks[row] == self.player.current and \
                 self.playlist == self.player.queue.current_playlist:
             state = self.player.get_state()
             spat = self.playlist.spat_position == row
@@ -1395,20 +1445,133 @@ class PlaylistModel(Gtk.ListStore):
             return self.stop_pixbuf
         return self.clear_pixbuf
 
+    def load(self):
+        """
+            Reads the tracks of a playlist that was not loaded yet
+
+            Call this while the model is not set on a view, the rows
+            appear without being announced.
+        """
+        if self.loaded:
+            return
+        self._tracks = list(self.playlist)
+        self.loaded = True
+
     def update_icon(self, position):
-        iter = self.iter_nth_child(None, position)
-        if iter is not None:
-            self.set(iter, 1, self.icon_for_row(position).pixbuf)
+        if 0 <= position < len(self._tracks):
+            self._row_changed(position)
+
+    ### Gtk.TreeModel implementation ###
+    #
+    # Iterators store the row position plus one, as a zero user_data is
+    # indistinguishable from an unset one
+    #
+
+    def _make_iter(self, position):
+        iter = Gtk.TreeIter()
+        iter.user_data = position + 1
+        return iter
+
+    def _row_changed(self, position):
+        self.row_changed(Gtk.TreePath((position,)), self._make_iter(position))
+
+    def do_get_flags(self):
+        return Gtk.TreeModelFlags.LIST_ONLY
+
+    def do_get_n_columns(self):
+        return len(self._gtypes)
+
+    def do_get_column_type(self, index):
+        return self._gtypes[index]
+
+    def do_get_iter(self, path):
+        indices = path.get_indices()
+        if len(indices) == 1 and 0 <= indices[0] < len(self._tracks):
+            return (True, self._make_iter(indices[0]))
+        return (False, None)
+
+    def do_get_path(self, iter):
+        return Gtk.TreePath((iter.user_data - 1,))
+
+    def do_get_value(self, iter, column):
+        position = iter.user_data - 1
+        if column == 0:
+            return self._tracks[position]
+        if column == 1:
+            return self.icon_for_row(position).pixbuf
+        return self._get_row_values(position)[column - 2]
+
+    def do_iter_next(self, iter):
+        if iter.user_data < len(self._tracks):
+            iter.user_data += 1
+            return True
+        return False
+
+    def do_iter_previous(self, iter):
+        if iter.user_data > 1:
+            iter.user_data -= 1
+            return True
+        return False
+
+    def do_iter_children(self, parent):
+        if parent is None and self._tracks:
+            return (True, self._make_iter(0))
+        return (False, None)
+
+    def do_iter_has_child(self, iter):
+        return False
+
+    def do_iter_n_children(self, iter):
+        if iter is None:
+            return len(self._tracks)
+        return 0
+
+    def do_iter_nth_child(self, parent, n):
+        if parent is None and 0 <= n < len(self._tracks):
+            return (True, self._make_iter(n))
+        return (False, None)
+
+    def do_iter_parent(self, child):
+        return (False, None)
+
+    def _get_row_values(self, position):
+        """
+            Returns the formatted column values of a row
+        """
+        track = self._tracks[position]
+        try:
+            return self._render_cache[track]
+        except KeyError:
+            pass
+        
+        # The view asks for one row at a time, so format the rows
+        # following this one as well; they are most likely shown next
+        render_cache = self._render_cache
+        batch = [track] + [tr for tr in
+            self._tracks[position + 1:position + self.render_batch_size]
+            if tr not in render_cache]
+        column_data = [formatter.format_tracks(batch) for formatter in self._formatters]
+        
+        for index, tr in enumerate(batch):
+            render_cache[tr] = [values[index] for values in column_data]
+        
+        return [values[0] for values in column_data]
 
     ### Event callbacks to keep the model in sync with the playlist ###
 
     def on_tracks_added(self, event_type, playlist, tracks):
-        self._load_data(tracks)
+        if not self.loaded:
+            return
+        for position, track in tracks:
+            self._tracks.insert(position, track)
+            self.row_inserted(Gtk.TreePath((position,)), self._make_iter(position))
 
     def on_tracks_removed(self, event_type, playlist, tracks):
-        tracks.reverse()
-        for position, track in tracks:
-            self.remove(self.iter_nth_child(None, position))
+        if not self.loaded:
+            return
+        for position, track in reversed(tracks):
+            del self._tracks[position]
+            self.row_deleted(Gtk.TreePath((position,)))
 
     def on_current_position_changed(self, event_type, playlist, positions):
         for position in positions:
@@ -1418,18 +1581,20 @@ class PlaylistModel(Gtk.ListStore):
 
     def on_spat_position_changed(self, event_type, playlist, positions):
         spat_position = min(positions)
-        for position in xrange(spat_position, len(self)):
+        for position in xrange(spat_position, len(self._tracks)):
             GLib.idle_add(self.update_icon, position)
 
     def on_playback_state_change(self, event_type, player_obj, track):
+        if not self.loaded:
+            return
         position = self.playlist.current_position
-        if position < 0 or position >= len(self):
+        if position < 0 or position >= len(self._tracks):
             return
         GLib.idle_add(self.update_icon, position)
 
     @guiutil.idle_add()   # sync this call to prevent race conditions
     def on_track_tags_changed(self, type, track, tag):
-        if not track or not \
+        if not track or not self.loaded or not \
             settings.get_option('gui/sync_on_tag_change', True) or not\
             tag in self.columns:
             return
@@ -1441,78 +1606,29 @@ class PlaylistModel(Gtk.ListStore):
             
     def _on_track_tags_changed(self):
         self._redraw_timer = None
-        tracks = {}
-        redraw_queue = self._redraw_queue
+        tracks = set(self._redraw_queue)
         self._redraw_queue = []
-        for track in redraw_queue:
-            tracks[track.get_loc_for_io()] = track
-           
-        for row in self:
-            track = tracks.get( row[0].get_loc_for_io() )
-            if track is not None:
-                track_data = [providers.get_provider('playlist-columns', name).formatter.format(track) for name in self.columns]
-                for i in range(len(track_data)):
-                    row[2+i] = track_data[i]
-
-    #
-    # Loading data into the playlist:
-    #
-    # - Profiler reveals that most of the playlist loading time is spent in two
-    #   places
-    #   - Formatting values
-    #   - Converting them to GValue objects for insert into the treeview
-    #
-    # Now, the program is annoyingly blocked when this happens, so we need to
-    # process new tracks on a different thread, and show some kind of loading
-    # indicator instead. That's what these four functions help us do.
-    #
-    
-    def _load_data(self, tracks):
         
-        # Don't allow race condition between adds.. there's probably a race
-        # condition for removal
-        if self.data_loading:
-            self.data_load_queue.extend(tracks)
-            return
+        for track in tracks:
+            try:
+                del self._render_cache[track]
+            except KeyError:
+                pass
         
-        # get column types
-        coltypes = [self.get_column_type(i) for i in xrange(self.get_n_columns())]
-        formatters = [providers.get_provider('playlist-columns', name).formatter.format for name in self.columns]
-        self.data_loading = True
-        self.emit('data-loading', True)
+        # Look the rows up in the playlist index; should the playlist
+        # already be ahead of the model, fall back to checking each row
+        changed = []
+        for track in tracks:
+            for position in self.playlist.get_positions(track):
+                if position >= len(self._tracks) or \
+                        self._tracks[position] is not track:
+                    changed = None
+                    break
+                changed.append(position)
+            if changed is None:
+                changed = [position for position, track in
+                    enumerate(self._tracks) if track in tracks]
+                break
         
-        if len(tracks) > 50:
-            self._load_data_thread(coltypes, formatters, tracks)
-        else:
-            render_data = self._load_data_fn(coltypes, formatters, tracks)
-            self._load_data_done(render_data)
-    
-    @common.threaded
-    def _load_data_thread(self, coltypes, formatters, tracks):
-        render_data = self._load_data_fn(coltypes, formatters, tracks)
-        GLib.idle_add(self._load_data_done, render_data)
-    
-    def _load_data_fn(self, coltypes, formatters, tracks):
-    
-        Value = GObject.Value
-    
-        render_data = []
-    
-        for position, track in tracks:
-            track_data = [track, self.icon_for_row(position).pixbuf] + [formatter(track) for formatter in formatters]
-            render_data.append((position, [Value(typ, val) for typ, val in izip(coltypes, track_data)]))
-        
-        return render_data
-        
-    def _load_data_done(self, render_data):
-        for args in render_data:
-            self.insert(*args)
-        
-        self.data_loading = False
-        self.emit('data-loading', False)
-        
-        if self.data_load_queue:
-            tracks = self.data_load_queue
-            self.data_load_queue = None
-            
-            self._load_data(tracks)
+        for position in changed:
+            self._row_changed(position)